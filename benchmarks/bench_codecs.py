@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+
+from common.codecs import ZstdCodec, available, get_codec, train_zstd_dictionary
+from producer.main import build_payload_approx, parse_size
+
+
+# Compression ratio and throughput of every installed codec on
+# build_payload_approx documents. Large documents are measured per codec and
+# level; small documents additionally with a zstd dictionary trained on a
+# disjoint sample set, which is where dictionaries pay off.
+LEVELS = {"gzip": (1, 6, 9), "zstd": (1, 3, 9, 19), "lz4": (0, 9)}
+
+
+def measure(codec, docs, repeat: int):
+    raw = sum(len(d) for d in docs)
+    best_c = best_d = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        encoded = [codec.compress(d) for d in docs]
+        best_c = min(best_c, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        for e in encoded:
+            codec.decompress(e)
+        best_d = min(best_d, time.perf_counter() - t0)
+    size = sum(len(e) for e in encoded)
+    return raw / size, raw / best_c / 2**20, raw / best_d / 2**20
+
+
+def report(label: str, docs, codecs, repeat: int, results: list):
+    print(f"\n{label}: {len(docs)} docs, {sum(len(d) for d in docs)} bytes")
+    print(f"{'codec':<16}{'ratio':>8}{'comp MB/s':>12}{'decomp MB/s':>13}")
+    for name, codec in codecs:
+        ratio, comp, decomp = measure(codec, docs, repeat)
+        print(f"{name:<16}{ratio:>8.3f}{comp:>12.1f}{decomp:>13.1f}")
+        results.append({"set": label, "codec": name, "ratio": ratio, "compress_mbps": comp, "decompress_mbps": decomp})
+
+
+def docs_of(size: int, count: int, start: int = 0):
+    return [
+        json.dumps(build_payload_approx(size, start + i), ensure_ascii=False).encode("utf-8")
+        for i in range(count)
+    ]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark payload compression codecs.")
+    p.add_argument("--msg-size", default="1MB", help="build_payload_approx is slow; keep this small")
+    p.add_argument("--count", type=int, default=4)
+    p.add_argument("--small-size", default="4KB")
+    p.add_argument("--small-count", type=int, default=200)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--json", default=None, help="Also write results to this file")
+    args = p.parse_args()
+
+    names = available()
+    codecs = [(f"{n}-{level}", get_codec(n, level)) for n in names for level in LEVELS[n]]
+    results = []
+
+    report("large", docs_of(parse_size(args.msg_size), args.count), codecs, args.repeat, results)
+
+    small = docs_of(parse_size(args.small_size), args.small_count)
+    small_codecs = [c for c in codecs if c[0] in ("gzip-9", "zstd-3", "lz4-0")]
+    if "zstd" in names:
+        # Train on other documents than the ones measured
+        training = docs_of(parse_size(args.small_size), args.small_count, start=args.small_count)
+        dictionary = train_zstd_dictionary(training, dict_size=16 * 1024)
+        small_codecs.append(("zstd-3-dict", ZstdCodec(level=3, dictionary=dictionary)))
+    report("small", small, small_codecs, args.repeat, results)
+
+    missing = sorted(set(LEVELS) - set(names))
+    if missing:
+        print(f"\nnot installed: {', '.join(missing)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import sys
+import time
+
+from producer.main import build_payload_approx, parse_size
+from producer.payload import generate_payload
+
+
+# Payload generator throughput: per-character build_payload_approx vs the
+# bulk/streaming generator. Exits non-zero when the streaming generator is
+# below --min-mbps or a generated document does not hit the --msg-size target.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark synthetic payload generators.")
+    p.add_argument("--msg-size", default="64MB")
+    p.add_argument("--approx-size", default="2MB", help="build_payload_approx is slow; keep this small")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--min-mbps", type=float, default=200.0)
+    args = p.parse_args()
+
+    target = parse_size(args.msg_size)
+    approx_target = parse_size(args.approx_size)
+
+    t0 = time.perf_counter()
+    raw = json.dumps(build_payload_approx(approx_target, 1), ensure_ascii=False).encode("utf-8")
+    approx_mbps = len(raw) / (time.perf_counter() - t0) / 2**20
+    print(f"approx    size={len(raw)} target={approx_target} {approx_mbps:8.1f} MB/s")
+
+    best = 0.0
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        _, chunks = generate_payload(target, i)
+        size = sum(len(c) for c in chunks)
+        mbps = size / (time.perf_counter() - t0) / 2**20
+        best = max(best, mbps)
+        if size != target:
+            print(f"size mismatch: generated={size} target={target}")
+            sys.exit(1)
+    print(f"streaming size={target} target={target} {best:8.1f} MB/s (best of {args.repeat})")
+
+    # Same document shape as build_payload_approx
+    _, chunks = generate_payload(parse_size("10KB"), 1)
+    doc = json.loads(b"".join(chunks))
+    assert doc["schema"] == "demo-1c-object-v1" and isinstance(doc["data"], list)
+
+    print(f"speedup x{best / approx_mbps:.0f}")
+    if best < args.min_mbps:
+        print(f"below target: {best:.1f} < {args.min_mbps} MB/s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
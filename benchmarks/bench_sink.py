@@ -0,0 +1,56 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from branch_consumer.persist import SINK_READ_SIZE, open_sink, persist
+from common.codecs import codec_for, decode_stream
+from producer.main import parse_size
+from producer.payload import generate_payload
+
+
+# Streaming decode-and-persist: rows/s into a sink and the peak Python heap
+# while doing it, per payload size. The peak should stay flat as the payload
+# grows. Uses a temporary SQLite file unless --sink is given.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark persisting decoded payloads into a sink.")
+    p.add_argument("--sizes", default="1MB,16MB", help="Comma-separated payload sizes")
+    p.add_argument("--sink", default="", help="sqlite:///path or postgresql://... (default: temporary SQLite file)")
+    p.add_argument("--batch-rows", type=int, default=1000)
+    p.add_argument("--max-peak-mb", type=float, default=16.0)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sink = open_sink(args.sink or f"sqlite:///{os.path.join(tmp, 'payloads.db')}")
+        worst = 0.0
+        print(f"{'size':>10}{'rows':>10}{'rows/s':>10}{'MB/s':>8}{'peak MB':>9}")
+        for i, size in enumerate(parse_size(s) for s in args.sizes.split(",")):
+            _, chunks = generate_payload(size, i)
+            body = gzip.compress(b"".join(chunks))
+            del chunks
+            codec = codec_for({"encoding": "gzip"})
+
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            rows, _ = persist(sink, f"bench-{i}", decode_stream(codec, io.BytesIO(body), SINK_READ_SIZE), args.batch_rows)
+            seconds = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            peak_mb = peak / 2**20
+            worst = max(worst, peak_mb)
+            print(f"{size:>10}{rows:>10}{rows / seconds:>10.0f}{size / seconds / 2**20:>8.1f}{peak_mb:>9.1f}")
+
+    print(json.dumps({"peak_mb": round(worst, 1)}))
+    if worst > args.max_peak_mb:
+        print(f"peak heap above target: {worst:.1f} > {args.max_peak_mb} MB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
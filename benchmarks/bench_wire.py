@@ -0,0 +1,132 @@
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from common.schemas import (
+    SCHEMA_ACK,
+    SCHEMA_ACK_BATCH,
+    SCHEMA_INLINE,
+    SCHEMA_POINTER,
+    SCHEMA_POINTER_PACKED,
+)
+from common.wire import WIRE_FORMATS, check_format, decode, encode
+
+
+# Encode/decode time and size of pointer and ACK messages per wire format,
+# on messages shaped like the ones the services send.
+def sample_messages(count: int, batch: int) -> dict:
+    def now():
+        return datetime.now(timezone.utc).isoformat()
+
+    def pointer(i):
+        return {
+            "schema": SCHEMA_POINTER,
+            "pointer_id": str(uuid.uuid4()),
+            "bucket": "1c-exchange",
+            "key": f"demo/2026/10/17/{uuid.uuid4()}.json.gz",
+            "encoding": "gzip",
+            "content_type": "application/json",
+            "size_raw": 1024 * 1024 + i,
+            "size_gz": 780_000 + i,
+            "sha256": os.urandom(32).hex(),
+            "recipients_total": 3,
+            "created_at": now(),
+        }
+
+    def packed(i):
+        msg = pointer(i)
+        msg.update(schema=SCHEMA_POINTER_PACKED, pack_id=str(uuid.uuid4()), pack_members=50,
+                   offset=i * 3000, length=3000, size_gz=3000)
+        return msg
+
+    def inline(i):
+        return {
+            "schema": SCHEMA_INLINE,
+            "pointer_id": str(uuid.uuid4()),
+            "encoding": "gzip",
+            "content_type": "application/json",
+            "size_raw": 8192,
+            "size_gz": 1024,
+            "sha256": os.urandom(32).hex(),
+            "payload": base64.b64encode(os.urandom(1024)).decode("ascii"),
+            "created_at": now(),
+        }
+
+    def ack(i):
+        msg = pointer(i)
+        return {
+            "schema": SCHEMA_ACK,
+            "pointer_id": msg["pointer_id"],
+            "bucket": msg["bucket"],
+            "key": msg["key"],
+            "recipient_id": "branch1",
+            "status": "processed",
+            "processed_at": now(),
+            "recipients_total": 3,
+        }
+
+    def ack_batch(i):
+        acks = [ack(i) for _ in range(batch)]
+        for a in acks:
+            del a["schema"], a["recipient_id"]
+        return {"schema": SCHEMA_ACK_BATCH, "recipient_id": "branch1", "acks": acks}
+
+    return {
+        SCHEMA_POINTER: [pointer(i) for i in range(count)],
+        SCHEMA_POINTER_PACKED: [packed(i) for i in range(count)],
+        "s3-inline-v1 (1KB)": [inline(i) for i in range(count)],
+        SCHEMA_ACK: [ack(i) for i in range(count)],
+        f"{SCHEMA_ACK_BATCH} x{batch}": [ack_batch(i) for i in range(max(1, count // batch))],
+    }
+
+
+def measure(msgs, wire_format: str, repeat: int):
+    best_e = best_d = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        encoded = [encode(m, wire_format) for m in msgs]
+        best_e = min(best_e, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        decoded = [decode(body, content_type) for body, content_type in encoded]
+        best_d = min(best_d, time.perf_counter() - t0)
+    if decoded != msgs:
+        raise RuntimeError(f"{wire_format} does not round-trip")
+    size = sum(len(body) for body, _ in encoded) / len(msgs)
+    return size, best_e / len(msgs) * 1e6, best_d / len(msgs) * 1e6
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark pointer/ACK wire formats.")
+    p.add_argument("--count", type=int, default=20_000, help="Messages per kind")
+    p.add_argument("--batch", type=int, default=100, help="ACKs per s3-ack-batch-v1 message")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--json", default=None, help="Also write results to this file")
+    args = p.parse_args()
+
+    formats = []
+    for name in WIRE_FORMATS:
+        try:
+            check_format(name)
+            formats.append(name)
+        except ValueError as e:
+            print(f"skipping {name}: {e}")
+
+    results = []
+    print(f"{'message':<26}{'format':<10}{'bytes':>9}{'encode us':>11}{'decode us':>11}")
+    for kind, msgs in sample_messages(args.count, args.batch).items():
+        for name in formats:
+            size, enc, dec = measure(msgs, name, args.repeat)
+            print(f"{kind:<26}{name:<10}{size:>9.0f}{enc:>11.2f}{dec:>11.2f}")
+            results.append({"message": kind, "format": name, "bytes": size, "encode_us": enc, "decode_us": dec})
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+import heapq
+import io
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+
+import pika
+from botocore.exceptions import ClientError
+
+
+# In-process stand-ins for RabbitMQ and S3, used by bench_e2e.py to run the
+# producer, branch consumer and coordinator code unchanged in one process.
+#
+# FakeBroker implements the subset of pika's BlockingConnection API the
+# services use: channels, direct/fanout exchanges, queue declare/bind,
+# basic_qos/consume/publish/ack/nack, start_consuming, process_data_events,
+# add_callback_threadsafe, call_later/remove_timeout, publisher confirms
+# (blocking, and asynchronous as the producer takes them) and mandatory
+# returns. Each connection runs its callbacks on the thread that drives it,
+# as pika does.
+#
+# Both fakes report events to an optional observer(event, **fields) with a
+# time.monotonic() timestamp, which is how the benchmark measures latencies.
+
+
+class _Message:
+    __slots__ = ("exchange", "routing_key", "body", "properties", "redelivered")
+
+    def __init__(self, exchange, routing_key, body, properties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties or pika.BasicProperties()
+        self.redelivered = False
+
+
+class _Frame:
+    def __init__(self, method):
+        self.method = method
+
+
+class _DeclareOk:
+    def __init__(self, queue, message_count, consumer_count):
+        self.method = pika.spec.Queue.DeclareOk(queue=queue, message_count=message_count, consumer_count=consumer_count)
+
+
+class FakeBroker:
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.cond = threading.Condition(threading.RLock())
+        self.exchanges = {"": "direct"}
+        self.bindings = defaultdict(list)  # exchange -> [(routing_key, queue)]
+        self.queues = {}
+        self.consumers = defaultdict(list)  # queue -> [channel]
+        self.stopped = False
+
+    def connect(self, parameters=None):
+        return FakeConnection(self)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def wait_consumer(self, queue: str, timeout: float = 10.0):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not self.consumers.get(queue):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"no consumer on {queue}")
+                self.cond.wait(remaining)
+
+    def depth(self, queue: str) -> int:
+        with self.cond:
+            return len(self.queues.get(queue, ()))
+
+    def _emit(self, event, **fields):
+        if self.observer is not None:
+            self.observer(event, t=time.monotonic(), **fields)
+
+    def _route(self, exchange, routing_key):
+        if exchange == "":
+            return [routing_key] if routing_key in self.queues else []
+        kind = self.exchanges.get(exchange)
+        if kind is None:
+            raise ValueError(f"NOT_FOUND - no exchange {exchange!r}")
+        if kind == "fanout":
+            return [q for _, q in self.bindings[exchange]]
+        return [q for rk, q in self.bindings[exchange] if rk == routing_key]
+
+    def _publish(self, exchange, routing_key, body, properties):
+        with self.cond:
+            queues = self._route(exchange, routing_key)
+            for q in queues:
+                self.queues[q].append(_Message(exchange, routing_key, body, properties))
+            self.cond.notify_all()
+        self._emit("publish", exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+        return queues
+
+
+class FakeConnection:
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.channels = []
+        self.callbacks = deque()
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.cancelled = set()
+        self.is_open = True
+        self.is_closed = False
+
+    def channel(self):
+        ch = FakeChannel(self, len(self.channels) + 1)
+        self.channels.append(ch)
+        return ch
+
+    def add_callback_threadsafe(self, callback):
+        with self.broker.cond:
+            self.callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def call_later(self, delay, callback):
+        handle = next(self.timer_seq)
+        heapq.heappush(self.timers, (time.monotonic() + delay, handle, callback))
+        return handle
+
+    def remove_timeout(self, handle):
+        self.cancelled.add(handle)
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            if self._run_once():
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._wait(remaining)
+
+    def sleep(self, duration):
+        deadline = time.monotonic() + duration
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not self._run_once():
+                self._wait(remaining)
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.is_closed = True
+        with self.broker.cond:
+            for ch in self.channels:
+                ch._close()
+            self.broker.cond.notify_all()
+
+    def _run(self):
+        while self.is_open and not self.broker.stopped:
+            if not self._run_once():
+                self._wait(0.05)
+
+    def _wait(self, limit):
+        with self.broker.cond:
+            if self.callbacks or self._deliverable():
+                return
+            if self.timers:
+                limit = min(limit, max(0.0, self.timers[0][0] - time.monotonic()))
+            self.broker.cond.wait(limit)
+
+    def _run_once(self) -> bool:
+        did = False
+        while True:
+            with self.broker.cond:
+                if not self.callbacks:
+                    break
+                callback = self.callbacks.popleft()
+            callback()
+            did = True
+
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, handle, callback = heapq.heappop(self.timers)
+            if handle in self.cancelled:
+                self.cancelled.discard(handle)
+                continue
+            callback()
+            did = True
+
+        while True:
+            with self.broker.cond:
+                delivery = self._next_delivery()
+            if delivery is None:
+                break
+            ch, callback, method, msg = delivery
+            callback(ch, method, msg.properties, msg.body)
+            did = True
+        return did
+
+    def _deliverable(self) -> bool:
+        return any(ch._can_deliver() for ch in self.channels)
+
+    def _next_delivery(self):
+        for ch in self.channels:
+            delivery = ch._take()
+            if delivery is not None:
+                return delivery
+        return None
+
+
+class FakeChannel:
+    def __init__(self, connection: FakeConnection, number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = number
+        self.prefetch = 0
+        self.consumers = {}  # consumer_tag -> (queue, callback, auto_ack)
+        self.unacked = {}  # delivery_tag -> (queue, message)
+        self.delivery_tags = itertools.count(1)
+        self.consumer_tags = itertools.count(1)
+        self.publish_seq = 0
+        self.confirm_callback = None
+        self.return_callbacks = []
+        self.consuming = False
+        self.is_open = True
+        # the producer takes confirms from the pika.channel.Channel under
+        # BlockingChannel (see PointerPublisher.connect); one object serves both
+        self._impl = self
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False, **kwargs):
+        with self.broker.cond:
+            self.broker.exchanges.setdefault(exchange, exchange_type)
+
+    def queue_declare(self, queue, passive=False, durable=False, arguments=None, **kwargs):
+        with self.broker.cond:
+            if queue not in self.broker.queues:
+                if passive:
+                    raise ValueError(f"NOT_FOUND - no queue {queue!r}")
+                self.broker.queues[queue] = deque()
+            return _DeclareOk(queue, len(self.broker.queues[queue]), len(self.broker.consumers[queue]))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None, **kwargs):
+        with self.broker.cond:
+            binding = (routing_key if routing_key is not None else queue, queue)
+            if binding not in self.broker.bindings[exchange]:
+                self.broker.bindings[exchange].append(binding)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self.prefetch = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        tag = f"ctag{self.channel_number}.{next(self.consumer_tags)}"
+        with self.broker.cond:
+            self.consumers[tag] = (queue, on_message_callback, auto_ack)
+            self.broker.consumers[queue].append(self)
+            self.broker.cond.notify_all()
+        return tag
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        queues = self.broker._publish(exchange, routing_key, body, properties)
+        if self.confirm_callback is None:
+            return
+        self.publish_seq += 1
+        tag = self.publish_seq
+        if mandatory and not queues:
+            method = pika.spec.Basic.Return(reply_code=312, reply_text="NO_ROUTE", exchange=exchange, routing_key=routing_key)
+            for cb in self.return_callbacks:
+                self.connection.add_callback_threadsafe(lambda cb=cb: cb(self, method, properties, body))
+        ack = pika.spec.Basic.Ack(delivery_tag=tag, multiple=False)
+        self.connection.add_callback_threadsafe(lambda: self.confirm_callback(_Frame(ack)))
+
+    def confirm_delivery(self, ack_nack_callback=None, callback=None):
+        # Without a callback, BlockingChannel confirm mode: basic_publish
+        # returns once confirmed, and the fake routes synchronously, so there
+        # is nothing to wait for. With one, Channel confirm mode: every publish
+        # is acked through ack_nack_callback on the connection's thread.
+        if ack_nack_callback is None:
+            return
+        self.confirm_callback = ack_nack_callback
+        if callback is not None:
+            self.connection.add_callback_threadsafe(lambda: callback(_Frame(pika.spec.Confirm.SelectOk())))
+
+    def add_on_return_callback(self, callback):
+        self.return_callbacks.append(callback)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        for queue, msg in self._settle(delivery_tag, multiple):
+            self.broker._emit("ack", queue=queue, body=msg.body, properties=msg.properties)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        settled = self._settle(delivery_tag, multiple)
+        with self.broker.cond:
+            for queue, msg in reversed(settled):
+                if requeue:
+                    msg.redelivered = True
+                    self.broker.queues[queue].appendleft(msg)
+            self.broker.cond.notify_all()
+        for queue, msg in settled:
+            self.broker._emit("nack", queue=queue, body=msg.body, properties=msg.properties)
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.basic_nack(delivery_tag, requeue=requeue)
+
+    def start_consuming(self):
+        self.consuming = True
+        self.connection._run()
+
+    def stop_consuming(self, consumer_tag=None):
+        self.consuming = False
+        self.broker.stop()
+
+    def close(self):
+        with self.broker.cond:
+            self._close()
+
+    def _settle(self, delivery_tag, multiple):
+        with self.broker.cond:
+            if multiple:
+                tags = [t for t in self.unacked if t <= delivery_tag]
+            else:
+                tags = [delivery_tag] if delivery_tag in self.unacked else []
+            settled = [self.unacked.pop(t) for t in sorted(tags)]
+            self.broker.cond.notify_all()
+        return settled
+
+    def _close(self):
+        # Unacked deliveries go back to their queues, as on a real broker
+        if not self.is_open:
+            return
+        self.is_open = False
+        for tag in sorted(self.unacked, reverse=True):
+            queue, msg = self.unacked.pop(tag)
+            msg.redelivered = True
+            self.broker.queues[queue].appendleft(msg)
+        for queue, *_ in self.consumers.values():
+            if self in self.broker.consumers[queue]:
+                self.broker.consumers[queue].remove(self)
+        self.consumers.clear()
+
+    def _can_deliver(self) -> bool:
+        if not self.is_open or (self.prefetch and len(self.unacked) >= self.prefetch):
+            return False
+        return any(self.broker.queues.get(q) for q, _, _ in self.consumers.values())
+
+    def _take(self):
+        if not self._can_deliver():
+            return None
+        for tag, (queue, callback, auto_ack) in self.consumers.items():
+            q = self.broker.queues.get(queue)
+            if not q:
+                continue
+            msg = q.popleft()
+            delivery_tag = next(self.delivery_tags)
+            if not auto_ack:
+                self.unacked[delivery_tag] = (queue, msg)
+            method = pika.spec.Basic.Deliver(
+                consumer_tag=tag,
+                delivery_tag=delivery_tag,
+                redelivered=msg.redelivered,
+                exchange=msg.exchange,
+                routing_key=msg.routing_key,
+            )
+            return self, callback, method, msg
+        return None
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._f = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._f.read(amt)
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while chunk := self._f.read(chunk_size):
+            yield chunk
+
+    def close(self):
+        pass
+
+
+def _not_found(operation: str, key: str):
+    return ClientError(
+        {"Error": {"Code": "NoSuchKey", "Message": key}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+        operation,
+    )
+
+
+class FakeS3:
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.objects = {}  # (bucket, key) -> bytes
+        self.uploads = {}  # upload_id -> (bucket, key, {part: bytes})
+        self.upload_ids = itertools.count(1)
+        self.requests = defaultdict(int)
+
+    def _emit(self, event, **fields):
+        if self.observer is not None:
+            self.observer(event, t=time.monotonic(), **fields)
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        with self.lock:
+            self.requests["PutObject"] += 1
+            self.objects[(Bucket, Key)] = bytes(data)
+        return {"ETag": f'"{len(data)}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        with self.lock:
+            self.requests["GetObject"] += 1
+            data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise _not_found("GetObject", Key)
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": _Body(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.requests["HeadObject"] += 1
+            data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise _not_found("HeadObject", Key)
+        return {"ContentLength": len(data)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.requests["DeleteObject"] += 1
+            self.objects.pop((Bucket, Key), None)
+        self._emit("delete", bucket=Bucket, key=Key)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        keys = [o["Key"] for o in Delete["Objects"]]
+        with self.lock:
+            self.requests["DeleteObjects"] += 1
+            for key in keys:
+                self.objects.pop((Bucket, key), None)
+        for key in keys:
+            self._emit("delete", bucket=Bucket, key=key)
+        return {"Deleted": [] if Delete.get("Quiet") else [{"Key": k} for k in keys], "Errors": []}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self.lock:
+            upload_id = str(next(self.upload_ids))
+            self.uploads[upload_id] = (Bucket, Key, {})
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        with self.lock:
+            self.requests["UploadPart"] += 1
+            self.uploads[UploadId][2][PartNumber] = bytes(Body)
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            _, _, parts = self.uploads.pop(UploadId)
+            numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+            self.objects[(Bucket, Key)] = b"".join(parts[n] for n in numbers)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
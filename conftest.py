@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# Unit tests (services/*/tests) import the services from their src/ trees,
+# as the Dockerfiles' PYTHONPATH does
+for src in sorted(Path(__file__).parent.glob("services/*/src")):
+    sys.path.insert(0, str(src))
@@ -1,21 +1,99 @@
--- Objects stored in S3
+-- Objects stored in S3.
+-- objects and acks are range-partitioned by created_at, one partition per UTC
+-- day (objects_pYYYYMMDD / acks_pYYYYMMDD, created ahead of time by the
+-- coordinator and `python -m coordinator.maintenance`, which also drops
+-- expired ones). Rows outside every daily partition land in *_default.
+-- Primary keys must contain the partition key, so pointer_id uniqueness
+-- across partitions is enforced by the coordinator: every transaction takes
+-- pg_advisory_xact_lock(pointer_id) before looking a pointer up.
 CREATE TABLE IF NOT EXISTS objects (
-    pointer_id       TEXT PRIMARY KEY,
+    pointer_id       TEXT NOT NULL,
     bucket           TEXT,
     object_key       TEXT,
     recipients_total INT,
+    -- Partition key: the pointer's created_at, or the first ACK's arrival
+    -- for ACK-before-pointer placeholders; never updated
+    created_at       TIMESTAMPTZ NOT NULL,
+    deleted_at       TIMESTAMPTZ,
+    pointer_received_at TIMESTAMPTZ,
+    -- Number of distinct ACK rows in `acks` for this pointer,
+    -- bumped only when an ACK insert actually inserts a row
+    acks_received    INT NOT NULL DEFAULT 0,
+    -- Real S3 deletion outcome (deleted_at only marks the claim)
+    s3_deleted_at    TIMESTAMPTZ,
+    delete_attempts  INT NOT NULL DEFAULT 0,
+    -- Set for s3-pointer-v2: bucket/object_key name the shared pack object,
+    -- which is deleted through `packs` once all its members are done
+    pack_id          TEXT,
+    PRIMARY KEY (pointer_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS objects_default PARTITION OF objects DEFAULT;
+
+-- Pack objects (several payloads in one S3 object, see s3-pointer-v2)
+CREATE TABLE IF NOT EXISTS packs (
+    pack_id          TEXT PRIMARY KEY,
+    bucket           TEXT NOT NULL,
+    object_key       TEXT NOT NULL,
+    members_total    INT NOT NULL,
+    -- Members whose deletion was claimed (objects.deleted_at); the pack is
+    -- claimed when this reaches members_total
+    members_done     INT NOT NULL DEFAULT 0,
     created_at       TIMESTAMPTZ,
     deleted_at       TIMESTAMPTZ,
-    pointer_received_at TIMESTAMPTZ
+    s3_deleted_at    TIMESTAMPTZ,
+    delete_attempts  INT NOT NULL DEFAULT 0
 );
 
--- Business ACKs from recipients (idempotent via PK)
+-- Business ACKs from recipients (idempotent via PK). created_at is the
+-- created_at of the ACKed objects row, so ACKs live in the same day partition
+-- as their object and are dropped with it.
 CREATE TABLE IF NOT EXISTS acks (
     pointer_id   TEXT NOT NULL,
     recipient_id TEXT NOT NULL,
     processed_at TIMESTAMPTZ NOT NULL,
-    PRIMARY KEY (pointer_id, recipient_id)
-);
+    created_at   TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (pointer_id, created_at, recipient_id)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS acks_default PARTITION OF acks DEFAULT;
 
-CREATE INDEX IF NOT EXISTS idx_acks_pointer_id ON acks(pointer_id);
 CREATE INDEX IF NOT EXISTS idx_objects_deleted_at ON objects(deleted_at);
+-- Claimed but not yet deleted from S3 (resumed by the coordinator on start)
+CREATE INDEX IF NOT EXISTS idx_objects_delete_pending ON objects(deleted_at)
+    WHERE deleted_at IS NOT NULL AND s3_deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_objects_pack_id ON objects(pack_id) WHERE pack_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_packs_delete_pending ON packs(deleted_at)
+    WHERE deleted_at IS NOT NULL AND s3_deleted_at IS NULL;
+-- Key lookups of the S3 sweeper (coordinator.sweeper)
+CREATE INDEX IF NOT EXISTS idx_objects_bucket_key ON objects(bucket, object_key);
+CREATE INDEX IF NOT EXISTS idx_packs_bucket_key ON packs(bucket, object_key);
+
+-- Sweeper progress: the last listed key that was fully handled, so an
+-- interrupted sweep resumes there; removed when a sweep completes
+CREATE TABLE IF NOT EXISTS sweep_checkpoints (
+    bucket      TEXT NOT NULL,
+    prefix      TEXT NOT NULL,
+    last_key    TEXT NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL,
+    updated_at  TIMESTAMPTZ NOT NULL,
+    -- running totals of the sweep
+    stats       JSONB NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
+
+-- Recipient registry: one row per branch. The producer binds the queue of
+-- every active recipient to the pointer exchange and stamps the number of
+-- active recipients into each pointer as recipients_total.
+-- recipient_id is the branch consumer's CONSUMER_ID.
+CREATE TABLE IF NOT EXISTS recipients (
+    recipient_id TEXT PRIMARY KEY,
+    queue        TEXT NOT NULL,
+    active       BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- One active recipient per queue: recipients sharing one would compete for
+-- a single copy of each pointer and recipients_total could never be reached
+CREATE UNIQUE INDEX IF NOT EXISTS recipients_active_queue ON recipients(queue) WHERE active;
@@ -0,0 +1,16 @@
+-- Incremental refcount column on objects.
+-- Fresh databases already get it from init/001_init.sql; this migration
+-- upgrades existing ones. Stop the coordinator while it runs so no ACK
+-- lands between the column add and the backfill.
+
+ALTER TABLE objects ADD COLUMN IF NOT EXISTS acks_received INT NOT NULL DEFAULT 0;
+
+UPDATE objects o
+SET acks_received = a.n
+FROM (
+    SELECT pointer_id, COUNT(*) AS n
+    FROM acks
+    GROUP BY pointer_id
+) a
+WHERE a.pointer_id = o.pointer_id
+AND o.acks_received <> a.n;
@@ -0,0 +1,13 @@
+-- Track the real S3 deletion outcome separately from the deletion claim.
+-- deleted_at: the coordinator claimed the deletion (exactly once)
+-- s3_deleted_at: the background deleter confirmed the object is gone
+
+ALTER TABLE objects ADD COLUMN IF NOT EXISTS s3_deleted_at TIMESTAMPTZ;
+ALTER TABLE objects ADD COLUMN IF NOT EXISTS delete_attempts INT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_objects_delete_pending ON objects(deleted_at)
+    WHERE deleted_at IS NOT NULL AND s3_deleted_at IS NULL;
+
+-- Claims made before this migration were deleted inline and their outcome
+-- is unknown; they are left pending so the coordinator retries them on
+-- start (deleting a missing key is a no-op).
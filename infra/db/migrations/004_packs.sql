@@ -0,0 +1,22 @@
+-- Pack objects: several payloads concatenated into one S3 object, each
+-- addressed by an s3-pointer-v2 (pack_id, offset, length).
+-- objects.pack_id maps a pointer to its pack; the pack is deleted once
+-- members_done reaches members_total.
+
+ALTER TABLE objects ADD COLUMN IF NOT EXISTS pack_id TEXT;
+
+CREATE TABLE IF NOT EXISTS packs (
+    pack_id          TEXT PRIMARY KEY,
+    bucket           TEXT NOT NULL,
+    object_key       TEXT NOT NULL,
+    members_total    INT NOT NULL,
+    members_done     INT NOT NULL DEFAULT 0,
+    created_at       TIMESTAMPTZ,
+    deleted_at       TIMESTAMPTZ,
+    s3_deleted_at    TIMESTAMPTZ,
+    delete_attempts  INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_objects_pack_id ON objects(pack_id) WHERE pack_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_packs_delete_pending ON packs(deleted_at)
+    WHERE deleted_at IS NOT NULL AND s3_deleted_at IS NULL;
@@ -0,0 +1,73 @@
+-- Range-partition objects and acks by created_at (one partition per UTC day).
+-- Fresh databases already get the partitioned tables from init/001_init.sql;
+-- this migration converts existing ones. Stop the coordinator while it runs.
+--
+-- The existing tables become the DEFAULT partitions (objects_default,
+-- acks_default), so no data is copied. Their rows are purged row by row by
+-- `python -m coordinator.maintenance` once past the retention; new rows go to
+-- the day partitions it creates.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'objects'::regclass) THEN
+        RETURN;
+    END IF;
+
+    -- objects: created_at becomes the (NOT NULL) partition key
+    UPDATE objects SET created_at = COALESCE(pointer_received_at, NOW()) WHERE created_at IS NULL;
+    ALTER TABLE objects ALTER COLUMN created_at SET NOT NULL;
+    ALTER TABLE objects RENAME TO objects_default;
+    -- the partition key must be part of the primary key
+    ALTER TABLE objects_default DROP CONSTRAINT objects_pkey;
+    ALTER TABLE objects_default ADD CONSTRAINT objects_default_pkey PRIMARY KEY (pointer_id, created_at);
+    ALTER INDEX IF EXISTS idx_objects_deleted_at RENAME TO objects_default_deleted_at_idx;
+    ALTER INDEX IF EXISTS idx_objects_delete_pending RENAME TO objects_default_delete_pending_idx;
+    ALTER INDEX IF EXISTS idx_objects_pack_id RENAME TO objects_default_pack_id_idx;
+
+    -- acks: carry their object's created_at
+    ALTER TABLE acks ADD COLUMN created_at TIMESTAMPTZ;
+    UPDATE acks a
+    SET created_at = o.created_at
+    FROM objects_default o
+    WHERE o.pointer_id = a.pointer_id;
+    UPDATE acks SET created_at = processed_at WHERE created_at IS NULL;
+    ALTER TABLE acks ALTER COLUMN created_at SET NOT NULL;
+    ALTER TABLE acks RENAME TO acks_default;
+    ALTER TABLE acks_default DROP CONSTRAINT acks_pkey;
+    ALTER TABLE acks_default ADD CONSTRAINT acks_default_pkey PRIMARY KEY (pointer_id, created_at, recipient_id);
+    DROP INDEX IF EXISTS idx_acks_pointer_id;
+
+    CREATE TABLE objects (
+        pointer_id       TEXT NOT NULL,
+        bucket           TEXT,
+        object_key       TEXT,
+        recipients_total INT,
+        created_at       TIMESTAMPTZ NOT NULL,
+        deleted_at       TIMESTAMPTZ,
+        pointer_received_at TIMESTAMPTZ,
+        acks_received    INT NOT NULL DEFAULT 0,
+        s3_deleted_at    TIMESTAMPTZ,
+        delete_attempts  INT NOT NULL DEFAULT 0,
+        pack_id          TEXT,
+        PRIMARY KEY (pointer_id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE acks (
+        pointer_id   TEXT NOT NULL,
+        recipient_id TEXT NOT NULL,
+        processed_at TIMESTAMPTZ NOT NULL,
+        created_at   TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (pointer_id, created_at, recipient_id)
+    ) PARTITION BY RANGE (created_at);
+
+    -- Column order of the old tables may differ (columns added by earlier
+    -- migrations); ATTACH matches columns by name
+    ALTER TABLE objects ATTACH PARTITION objects_default DEFAULT;
+    ALTER TABLE acks ATTACH PARTITION acks_default DEFAULT;
+
+    CREATE INDEX idx_objects_deleted_at ON objects(deleted_at);
+    CREATE INDEX idx_objects_delete_pending ON objects(deleted_at)
+        WHERE deleted_at IS NOT NULL AND s3_deleted_at IS NULL;
+    CREATE INDEX idx_objects_pack_id ON objects(pack_id) WHERE pack_id IS NOT NULL;
+END
+$$;
@@ -0,0 +1,15 @@
+-- S3 reconciliation sweeper (python -m coordinator.sweeper): indexes for
+-- joining listed keys against objects/packs, and its resume checkpoints.
+
+CREATE INDEX IF NOT EXISTS idx_objects_bucket_key ON objects(bucket, object_key);
+CREATE INDEX IF NOT EXISTS idx_packs_bucket_key ON packs(bucket, object_key);
+
+CREATE TABLE IF NOT EXISTS sweep_checkpoints (
+    bucket      TEXT NOT NULL,
+    prefix      TEXT NOT NULL,
+    last_key    TEXT NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL,
+    updated_at  TIMESTAMPTZ NOT NULL,
+    stats       JSONB NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
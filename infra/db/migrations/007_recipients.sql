@@ -0,0 +1,10 @@
+-- Recipient registry (python -m coordinator.recipients); read by the producer
+-- when DB_DSN is set.
+
+CREATE TABLE IF NOT EXISTS recipients (
+    recipient_id TEXT PRIMARY KEY,
+    queue        TEXT NOT NULL,
+    active       BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
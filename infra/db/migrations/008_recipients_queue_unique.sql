@@ -0,0 +1,5 @@
+-- One active recipient per queue. Recipients sharing a queue would compete
+-- for a single copy of each pointer, so recipients_total (the number of
+-- active recipients) could never be reached and the object never deleted.
+
+CREATE UNIQUE INDEX IF NOT EXISTS recipients_active_queue ON recipients(queue) WHERE active;
@@ -0,0 +1,91 @@
+import time
+import uuid
+
+import pika
+
+from common.metrics import NACKS_TOTAL, PUBLISH_CONFIRM_SECONDS, timed
+from common.schemas import SCHEMA_ACK_BATCH
+from common.wire import encode
+
+
+# Batched business ACKs.
+#
+# Instead of one s3-ack-v1 message per processed pointer, ACKs are collected
+# per ACK routing key (one per coordinator shard) and published as one
+# s3-ack-batch-v1 message after `batch_size` ACKs or `linger` seconds. The
+# publish channel is in confirm mode: the source deliveries are acked only
+# once the broker has confirmed their batch. A failed publish requeues them;
+# the pointers are processed again and the coordinator ignores the duplicate
+# ACKs. Runs on the connection thread only.
+class AckBatchPublisher:
+    def __init__(self, connection, channel, exchange: str, recipient_id: str, batch_size: int, linger: float,
+                 queue_name: str, wire_format: str = "json"):
+        self.connection = connection
+        # source deliveries are settled here
+        self.channel = channel
+        self.exchange = exchange
+        self.recipient_id = recipient_id
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.queue_name = queue_name
+        self.wire_format = wire_format
+
+        # BlockingChannel in confirm mode: basic_publish returns once confirmed
+        self.publish_channel = connection.channel()
+        self.publish_channel.confirm_delivery()
+
+        # routing key -> [(source delivery tag, ACK fields)]
+        self.pending = {}
+        self.count = 0
+        self.timer = None
+
+    def add(self, routing_key: str, delivery_tag: int, ack_msg: dict):
+        # pointer_id, processed_at, ...; schema and recipient_id move to the batch
+        fields = {k: v for k, v in ack_msg.items() if k not in ("schema", "recipient_id")}
+        self.pending.setdefault(routing_key, []).append((delivery_tag, fields))
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.linger, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        pending, self.pending, self.count = self.pending, {}, 0
+
+        for routing_key, items in pending.items():
+            body, content_type = encode(
+                {
+                    "schema": SCHEMA_ACK_BATCH,
+                    "recipient_id": self.recipient_id,
+                    "acks": [fields for _, fields in items],
+                },
+                self.wire_format,
+            )
+            props = pika.BasicProperties(
+                content_type=content_type,
+                delivery_mode=2,
+                message_id=f"{self.recipient_id}:{uuid.uuid4().hex}",
+                timestamp=int(time.time()),
+            )
+            try:
+                with timed(PUBLISH_CONFIRM_SECONDS):
+                    self.publish_channel.basic_publish(
+                        exchange=self.exchange,
+                        routing_key=routing_key,
+                        body=body,
+                        properties=props,
+                        mandatory=True,
+                    )
+            except Exception as e:
+                print(f"[{self.recipient_id}] ACK batch publish failed rk={routing_key} size={len(items)}: {e!r} (requeue)")
+                for tag, _ in items:
+                    self.channel.basic_nack(delivery_tag=tag, requeue=True)
+                NACKS_TOTAL.labels(queue=self.queue_name, requeue="true").inc(len(items))
+                continue
+
+            for tag, _ in items:
+                self.channel.basic_ack(delivery_tag=tag)
+            print(f"[{self.recipient_id}] ACK batch published rk={routing_key} size={len(items)}")
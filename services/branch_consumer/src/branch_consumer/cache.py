@@ -0,0 +1,150 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+
+# On-disk payload cache keyed by the pointer's sha256 (of the stored bytes).
+#
+# Layout: <root>/<sha[:2]>/<sha>. Entries are written to a temp file in the
+# same directory, fsynced and renamed into place, so a crash never leaves a
+# partial entry under a valid name. Several consumer processes on one host can
+# share the directory: readers keep reading an entry even if another process
+# evicts it meanwhile, and concurrent writers of the same key write identical
+# bytes.
+#
+# Eviction is LRU by mtime (hits touch the entry) once the total size goes
+# over max_bytes.
+#
+# Keys come from pointers, i.e. from the network: anything but a lowercase
+# hex sha256 is never turned into a path. A hit is re-hashed before it is
+# served, so a damaged or planted entry is dropped and counted as a miss.
+SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+
+
+class PayloadCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # Approximate total; rescanned from disk whenever it crosses the limit
+        self.approx_bytes = self._scan_total()
+
+    def path(self, sha256: str) -> str:
+        if not isinstance(sha256, str) or not SHA256_HEX.fullmatch(sha256):
+            raise ValueError(f"invalid cache key {sha256!r}")
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    # Verified entry as an open file, or None; `size` (if known) must match too
+    def open(self, sha256: str, size: int | None = None):
+        try:
+            path = self.path(sha256)
+            f = open(path, "rb")
+        except (ValueError, FileNotFoundError):
+            with self.lock:
+                self.misses += 1
+            return None
+        if not self._intact(f, sha256, size):
+            f.close()
+            print(f"[cache] dropping corrupt entry {path}")
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return f
+
+    def put(self, sha256: str, src) -> None:
+        # `src` is a readable file object; it is rewound afterwards
+        try:
+            path = self.path(sha256)
+        except ValueError:
+            return
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+                out.flush()
+                os.fsync(out.fileno())
+                size = out.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        finally:
+            src.seek(0)
+
+        with self.lock:
+            self.approx_bytes += size
+            over = self.approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for path, size, mtime in self._entries():
+            entries.append((mtime, path, size))
+            total += size
+
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # evicted by another process
+            total -= size
+
+        with self.lock:
+            self.approx_bytes = total
+
+    def stats(self) -> str:
+        with self.lock:
+            return f"cache_hits={self.hits} cache_misses={self.misses} cache_bytes~{self.approx_bytes}"
+
+    @staticmethod
+    def _intact(f, sha256: str, size: int | None) -> bool:
+        if size is not None and os.fstat(f.fileno()).st_size != int(size):
+            return False
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+        f.seek(0)
+        return h.hexdigest() == sha256
+
+    def _entries(self):
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime
+
+    def _scan_total(self) -> int:
+        return sum(size for _, size, _ in self._entries())
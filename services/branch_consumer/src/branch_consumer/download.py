@@ -0,0 +1,84 @@
+import hashlib
+import io
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Object download with bounded memory.
+#
+# Objects below `threshold` (by the pointer's size_gz) use one plain GET.
+# Larger ones are fetched as parallel ranged GETs of `range_size` bytes, at
+# most `max_inflight` at a time; ranges are consumed in order, fed into an
+# incremental sha256 and spooled to an anonymous temp file. Peak heap use per
+# message is therefore about max_inflight x range_size. `fetchers` is the
+# number of threads that may call fetch() at once; the range pool has
+# max_inflight threads for each, so one large object cannot hold up the others.
+#
+# With `offset` set, only the byte range [offset, offset + size_hint) of the
+# object is fetched (a member of a pack object); the same threshold applies to
+# the range length.
+#
+# fetch() returns (file object positioned at 0, size, sha256 hex); the caller
+# closes the file.
+class RangeDownloader:
+    def __init__(
+        self,
+        s3,
+        threshold: int = 16 * 1024 * 1024,
+        range_size: int = 8 * 1024 * 1024,
+        max_inflight: int = 4,
+        spool_dir: str | None = None,
+        fetchers: int = 1,
+    ):
+        self.s3 = s3
+        self.threshold = threshold
+        self.range_size = max(1, range_size)
+        self.max_inflight = max(1, max_inflight)
+        self.spool_dir = spool_dir
+        self.pool = ThreadPoolExecutor(max_workers=max(1, fetchers) * self.max_inflight, thread_name_prefix="s3-range")
+
+    def fetch(self, bucket: str, key: str, size_hint: int | None = None, offset: int | None = None):
+        if offset is not None:
+            if size_hint < self.threshold:
+                data = self._get_range(bucket, key, offset, offset + size_hint - 1)
+                return io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest()
+            return self._fetch_ranges(bucket, key, size_hint, offset)
+        if size_hint is None or size_hint < self.threshold:
+            return self._fetch_simple(bucket, key)
+        return self._fetch_ranges(bucket, key, size_hint)
+
+    def _fetch_simple(self, bucket: str, key: str):
+        obj = self.s3.get_object(Bucket=bucket, Key=key)
+        data = obj["Body"].read()
+        return io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest()
+
+    def _get_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        obj = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        return obj["Body"].read()
+
+    def _fetch_ranges(self, bucket: str, key: str, size: int, offset: int = 0):
+        ranges = deque(
+            (offset + start, offset + min(start + self.range_size, size) - 1)
+            for start in range(0, size, self.range_size)
+        )
+        inflight = deque()
+        digest = hashlib.sha256()
+        spool = tempfile.TemporaryFile(dir=self.spool_dir)
+        total = 0
+        try:
+            while ranges or inflight:
+                while ranges and len(inflight) < self.max_inflight:
+                    start, end = ranges.popleft()
+                    inflight.append(self.pool.submit(self._get_range, bucket, key, start, end))
+                chunk = inflight.popleft().result()
+                digest.update(chunk)
+                spool.write(chunk)
+                total += len(chunk)
+            spool.seek(0)
+            return spool, total, digest.hexdigest()
+        except BaseException:
+            for f in inflight:
+                f.cancel()
+            spool.close()
+            raise
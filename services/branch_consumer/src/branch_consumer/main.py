@@ -1,26 +1,47 @@
-import json
+import base64
+import functools
+import hashlib
+import io
 import os
 import time
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 import boto3
 import pika
 
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-def sha256_bytes(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
-
-
-def make_s3_client(endpoint: str, access: str, secret: str, region: str):
-    return boto3.client(
+from branch_consumer.acks import AckBatchPublisher
+from branch_consumer.cache import PayloadCache
+from branch_consumer.download import RangeDownloader
+from branch_consumer.persist import SINK_READ_SIZE, open_sink, persist
+from common.codecs import codec_for, decode_stream
+from common.metrics import (
+    CALLBACK_SECONDS,
+    CODEC_SECONDS,
+    NACKS_TOTAL,
+    REDELIVERIES_TOTAL,
+    S3_NOT_FOUND_TOTAL,
+    SHA256_SECONDS,
+    instrument_s3,
+    start_metrics_server,
+    timed,
+)
+from common.schemas import SCHEMA_ACK, SCHEMA_INLINE, SCHEMA_POINTER, SCHEMA_POINTER_PACKED
+from common.sharding import shard_key, shard_name, shard_names
+from common.wire import check_format, decode as decode_message, encode as encode_message
+
+def make_s3_client(endpoint: str, access: str, secret: str, region: str, max_pool_connections: int = 10):
+    return instrument_s3(boto3.client(
         "s3",
         endpoint_url=endpoint,
         aws_access_key_id=access,
         aws_secret_access_key=secret,
         region_name=region,
-    )
+        config=Config(max_pool_connections=max_pool_connections),
+    ))
 
 
 def main():
@@ -37,12 +58,64 @@ def main():
     exchange = os.getenv("RMQ_EXCHANGE", "ex.msg")
     routing_key = os.getenv("RMQ_ROUTING_KEY", "branch1")
     queue_name = os.getenv("RMQ_QUEUE", "q.branch1")
+    # RECIPIENT_REGISTRY=1: the producer binds the queues of registered
+    # recipients; an unregistered consumer must not receive (and ACK) pointers
+    registry_bindings = os.getenv("RECIPIENT_REGISTRY", "0") == "1"
     ack_exchange = os.getenv("RMQ_ACK_EXCHANGE", "ex.ack")
     ack_routing_key = os.getenv("RMQ_ACK_ROUTING_KEY", "ack")
     ack_queue = os.getenv("RMQ_ACK_QUEUE", "q.ack")
+    # SHARDS > 1: pointers arrive on "<routing_key>.<shard>", ACKs go to
+    # "<ack_routing_key>.<shard>" of the coordinator owning the pointer_id
+    shards = int(os.getenv("SHARDS", "1"))
     prefetch = int(os.getenv("PREFETCH", "10"))
-
-    s3 = make_s3_client(endpoint, access, secret, region)
+    # WORKERS > 0: process deliveries on a thread pool (keep PREFETCH >= WORKERS)
+    workers = int(os.getenv("WORKERS", "0"))
+    # ACK_PUBLISH_BATCH > 1: business ACKs go out as s3-ack-batch-v1 messages
+    # of up to that many ACKs, or after ACK_PUBLISH_LINGER_MS (keep PREFETCH
+    # >= ACK_PUBLISH_BATCH, the source deliveries stay unacked until then)
+    ack_publish_batch = int(os.getenv("ACK_PUBLISH_BATCH", "1"))
+    ack_publish_linger = int(os.getenv("ACK_PUBLISH_LINGER_MS", "50")) / 1000.0
+    # Encoding of the ACKs we send (json | msgpack); pointers are decoded by
+    # their content_type whatever this says
+    wire_format = os.getenv("WIRE_FORMAT", "json")
+    check_format(wire_format)
+
+    # Large objects: parallel ranged GETs spooled to disk.
+    # Peak memory per message is about DOWNLOAD_MAX_INFLIGHT x DOWNLOAD_RANGE_SIZE.
+    download_threshold = int(os.getenv("DOWNLOAD_PARALLEL_THRESHOLD", str(16 * 1024 * 1024)))
+    download_range_size = int(os.getenv("DOWNLOAD_RANGE_SIZE", str(8 * 1024 * 1024)))
+    download_max_inflight = int(os.getenv("DOWNLOAD_MAX_INFLIGHT", "4"))
+    spool_dir = os.getenv("DOWNLOAD_SPOOL_DIR") or None
+
+    # Local content-addressed payload cache (disabled when CACHE_DIR is empty)
+    cache_dir = os.getenv("CACHE_DIR", "")
+    cache_max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    cache = PayloadCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    # Trained zstd dictionary, required for payloads that carry a dict_id
+    zstd_dict = os.getenv("ZSTD_DICT") or None
+
+    # Where decoded payload items are persisted (disabled when SINK is empty):
+    # sqlite:///path/to/file.db or postgresql://...
+    sink_url = os.getenv("SINK", "")
+    sink_batch_rows = int(os.getenv("SINK_BATCH_ROWS", "1000"))
+    sink = open_sink(sink_url) if sink_url else None
+
+    start_metrics_server(int(os.getenv("METRICS_PORT", "9101")))
+
+    # every worker may have DOWNLOAD_MAX_INFLIGHT ranged GETs open at once
+    s3 = make_s3_client(
+        endpoint, access, secret, region,
+        max_pool_connections=max(10, workers + max(1, workers) * download_max_inflight),
+    )
+    downloader = RangeDownloader(
+        s3,
+        threshold=download_threshold,
+        range_size=download_range_size,
+        max_inflight=download_max_inflight,
+        spool_dir=spool_dir,
+        fetchers=workers,
+    )
 
     params = pika.URLParameters(amqp_url)
     conn = pika.BlockingConnection(params)
@@ -58,37 +131,67 @@ def main():
         "x-queue-type": "quorum"
         }
     )
-    ch.queue_bind(queue=queue_name, exchange=exchange, routing_key=routing_key)
-    # ACK exchange/queue
+    if registry_bindings:
+        print(f"[{consumer_id}] queue {queue_name} is bound by the producer from the recipient registry")
+    else:
+        for key in shard_names(routing_key, shards):
+            ch.queue_bind(queue=queue_name, exchange=exchange, routing_key=key)
+    # ACK exchange/queue (one per shard)
     ch.exchange_declare(exchange=ack_exchange, exchange_type="direct", durable=True)
-    ch.queue_declare(
-        queue=ack_queue, 
-        durable=True,
-        arguments={
-        "x-queue-type": "quorum"
-        }
-    )
-    ch.queue_bind(queue=ack_queue, exchange=ack_exchange, routing_key=ack_routing_key)
+    for shard in range(max(1, shards)):
+        ch.queue_declare(
+            queue=shard_name(ack_queue, shard, shards),
+            durable=True,
+            arguments={
+            "x-queue-type": "quorum"
+            }
+        )
+        ch.queue_bind(
+            queue=shard_name(ack_queue, shard, shards),
+            exchange=ack_exchange,
+            routing_key=shard_name(ack_routing_key, shard, shards),
+        )
 
     ch.basic_qos(prefetch_count=prefetch)
 
-    print(f"[{consumer_id}] consuming from queue={queue_name} exchange={exchange} rk={routing_key}")
-
-    def on_message(channel, method, properties, body: bytes):
-        try:
-            msg = json.loads(body.decode("utf-8"))
-            if msg.get("schema") != "s3-pointer-v1":
-                print(f"[{consumer_id}] skip schema={msg.get('schema')}")
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-                return
-
-            bucket = msg["bucket"]
-            key = msg["key"]
-            expected = msg.get("sha256")
+    print(
+        f"[{consumer_id}] consuming from queue={queue_name} exchange={exchange} rk={routing_key} "
+        f"workers={workers} shards={shards} ack_batch={ack_publish_batch}"
+    )
 
+    ack_batcher = None
+    if ack_publish_batch > 1:
+        ack_batcher = AckBatchPublisher(
+            conn, ch, ack_exchange, consumer_id, ack_publish_batch, ack_publish_linger, queue_name, wire_format
+        )
+
+    # Download + verify one pointer. Returns (outcome, ack_msg): outcome is
+    # "ack" or "nack" for the source delivery, ack_msg the business ACK to
+    # publish first (or None). Runs on a worker thread when WORKERS > 0, so it
+    # must not touch the channel.
+    def process(body: bytes, content_type: str | None = None):
+        msg = decode_message(body, content_type)
+        if msg.get("schema") == SCHEMA_INLINE:
+            return process_inline(msg)
+        if msg.get("schema") not in (SCHEMA_POINTER, SCHEMA_POINTER_PACKED):
+            print(f"[{consumer_id}] skip schema={msg.get('schema')}")
+            return "ack", None
+
+        bucket = msg["bucket"]
+        key = msg["key"]
+        expected = msg.get("sha256")
+
+        # Cache hit: no S3 GET at all (the cache re-verifies the entry's sha256)
+        data = cache.open(expected, msg.get("size_gz")) if cache is not None and expected else None
+        if data is not None:
+            size_gz, actual, source = os.fstat(data.fileno()).st_size, expected, "cache"
+        else:
             try:
-                obj = s3.get_object(Bucket=bucket, Key=key)
-                data = obj["Body"].read()
+                if msg["schema"] == SCHEMA_POINTER_PACKED:
+                    # Only this payload's byte range of the pack object
+                    data, size_gz, actual = downloader.fetch(bucket, key, msg["length"], offset=msg["offset"])
+                else:
+                    data, size_gz, actual = downloader.fetch(bucket, key, msg.get("size_gz"))
 
             except ClientError as e:
                 status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
@@ -96,65 +199,179 @@ def main():
 
                 # MinIO/S3: missing object often looks like 404 / NotFound
                 if status == 404 or code in ("404", "NotFound", "NoSuchKey", "NoSuchObject"):
-                    print(f"[branch1] S3 object missing {bucket}/{key} (ack, no requeue)")
-                    channel.basic_ack(method.delivery_tag)
-                    return
+                    S3_NOT_FOUND_TOTAL.inc()
+                    print(f"[{consumer_id}] S3 object missing {bucket}/{key} (ack, no requeue)")
+                    return "ack", None
 
                 # Anything else: keep retrying
-                print(f"[branch1] S3 error {bucket}/{key}: status={status} code={code} (requeue)")
-                channel.basic_nack(method.delivery_tag, requeue=True)
-                return
+                print(f"[{consumer_id}] S3 error {bucket}/{key}: status={status} code={code} (requeue)")
+                return "nack", None
+            source = "s3"
 
-            actual = sha256_bytes(data)
+        try:
             if expected and actual != expected:
                 raise RuntimeError(f"sha mismatch key={key} expected={expected} actual={actual}")
-
-            size_gz = len(data)
-            pointer_id = msg.get("pointer_id")
-            print(f"[{consumer_id}] OK pointer_id={pointer_id} size_gz={size_gz} key={key}")
-
-            # Acknowledge message
-            recipients_total = int(msg.get("recipients_total", 1))
-
-            ack_msg = {
-                "schema": "s3-ack-v1",
-                "pointer_id": pointer_id,
-                "bucket": bucket,
-                "key": key,
-                "recipient_id": consumer_id,
-                "status": "processed",
-                "processed_at": datetime.now(timezone.utc).isoformat(),
-                "recipients_total": recipients_total,
-            }
-
-            ack_body = json.dumps(ack_msg, ensure_ascii=False).encode("utf-8")
+            # Only verified payloads enter the cache
+            if cache is not None and expected and source == "s3":
+                cache.put(expected, data)
+            size_raw, persisted = decode(msg, data)
+        finally:
+            # Persisted (or nothing to persist); drop the local copy right away
+            data.close()
+
+        pointer_id = msg.get("pointer_id")
+        cache_stats = f" {cache.stats()}" if cache is not None else ""
+        print(
+            f"[{consumer_id}] OK pointer_id={pointer_id} size_gz={size_gz} size_raw={size_raw} "
+            f"encoding={msg.get('encoding', 'gzip')} key={key} from={source}{persisted}{cache_stats}"
+        )
+
+        # The sink has committed: the business ACK may go out
+        recipients_total = int(msg.get("recipients_total", 1))
+
+        ack_msg = {
+            "schema": SCHEMA_ACK,
+            "pointer_id": pointer_id,
+            "bucket": bucket,
+            "key": key,
+            "recipient_id": consumer_id,
+            "status": "processed",
+            "processed_at": datetime.now(timezone.utc).isoformat(),
+            "recipients_total": recipients_total,
+        }
+        return "ack", ack_msg
+
+    # Decode by the pointer's `encoding` (streaming, bounded memory) and check
+    # the raw size. With a SINK the items are persisted while decoding and the
+    # size check runs before the sink commits. Returns (decoded bytes, log text).
+    def decode(msg: dict, data):
+        codec = codec_for(msg, zstd_dict)
+        size_raw = 0
+
+        def check():
+            expected = msg.get("size_raw")
+            if expected is not None and size_raw != int(expected):
+                raise RuntimeError(
+                    f"size mismatch pointer_id={msg.get('pointer_id')} expected={expected} decoded={size_raw}"
+                )
+
+        if sink is None:
+            with timed(CODEC_SECONDS, op="decompress", encoding=codec.name):
+                size_raw = sum(len(chunk) for chunk in decode_stream(codec, data))
+            check()
+            return size_raw, ""
+
+        def counted():
+            nonlocal size_raw
+            for chunk in decode_stream(codec, data, SINK_READ_SIZE):
+                size_raw += len(chunk)
+                yield chunk
+
+        rows, seconds = persist(sink, msg["pointer_id"], counted(), sink_batch_rows, check)
+        return size_raw, f" rows={rows} rows/s={rows / max(seconds, 1e-9):.0f}"
+
+    # Inline payload: nothing to download and no S3 object to refcount, so no
+    # business ACK either.
+    def process_inline(msg: dict):
+        data = base64.b64decode(msg["payload"])
+        expected = msg.get("sha256")
+        with timed(SHA256_SECONDS):
+            actual = hashlib.sha256(data).hexdigest()
+        if expected and actual != expected:
+            raise RuntimeError(f"sha mismatch pointer_id={msg.get('pointer_id')} expected={expected} actual={actual}")
+
+        size_raw, persisted = decode(msg, io.BytesIO(data))
+        print(
+            f"[{consumer_id}] OK pointer_id={msg.get('pointer_id')} size_gz={len(data)} size_raw={size_raw}{persisted} "
+            f"encoding={msg.get('encoding', 'gzip')} from=inline"
+        )
+        return "ack", None
+
+    # Publish the business ACK (if any), then settle the source delivery.
+    # Always runs on the connection thread.
+    def settle(channel, delivery_tag: int, outcome: str, ack_msg):
+        if ack_msg is not None and ack_batcher is not None:
+            # settled once its batch is confirmed
+            ack_batcher.add(shard_key(ack_routing_key, ack_msg["pointer_id"], shards), delivery_tag, ack_msg)
+            return
+
+        if ack_msg is not None:
+            pointer_id = ack_msg["pointer_id"]
+            ack_body, content_type = encode_message(ack_msg, wire_format)
 
             ack_props = pika.BasicProperties(
-                content_type="application/json",
+                content_type=content_type,
                 delivery_mode=2,
                 message_id=f"{pointer_id}:{consumer_id}",
                 timestamp=int(time.time()),
             )
 
-            ch.basic_publish(
+            channel.basic_publish(
                 exchange=ack_exchange,
-                routing_key=ack_routing_key,
+                routing_key=shard_key(ack_routing_key, pointer_id, shards),
                 body=ack_body,
                 properties=ack_props,
             )
 
-            # Here would be: decompress + deserialize + persist (later)
-            channel.basic_ack(delivery_tag=method.delivery_tag)
+        if outcome == "ack":
+            channel.basic_ack(delivery_tag=delivery_tag)
+        else:
+            NACKS_TOTAL.labels(queue=queue_name, requeue="true").inc()
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def on_message(channel, method, properties, body: bytes):
+        if method.redelivered:
+            REDELIVERIES_TOTAL.labels(queue=queue_name).inc()
+        try:
+            with timed(CALLBACK_SECONDS, callback="on_message"):
+                outcome, ack_msg = process(body, properties.content_type)
+                settle(channel, method.delivery_tag, outcome, ack_msg)
 
         except Exception as e:
             print(f"[{consumer_id}] ERROR: {e!r} (requeue)")
+            NACKS_TOTAL.labels(queue=queue_name, requeue="true").inc()
             channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
             time.sleep(1.0)
 
-    ch.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=False)
+    # Worker-pool mode: deliveries are processed on WORKERS threads while the
+    # connection thread keeps serving heartbeats; results are marshalled back
+    # with add_callback_threadsafe for the ACK publish and basic_ack/nack.
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker") if workers > 0 else None
+
+    def settle_threadsafe(channel, delivery_tag: int, outcome: str, ack_msg):
+        try:
+            settle(channel, delivery_tag, outcome, ack_msg)
+        except Exception as e:
+            print(f"[{consumer_id}] ERROR: {e!r} (requeue)")
+            NACKS_TOTAL.labels(queue=queue_name, requeue="true").inc()
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def run_in_worker(channel, delivery_tag: int, body: bytes, content_type: str | None):
+        try:
+            with timed(CALLBACK_SECONDS, callback="on_message"):
+                outcome, ack_msg = process(body, content_type)
+        except Exception as e:
+            print(f"[{consumer_id}] ERROR: {e!r} (requeue)")
+            outcome, ack_msg = "nack", None
+        conn.add_callback_threadsafe(functools.partial(settle_threadsafe, channel, delivery_tag, outcome, ack_msg))
+        if outcome == "nack":
+            time.sleep(1.0)
+
+    def on_message_pooled(channel, method, properties, body: bytes):
+        if method.redelivered:
+            REDELIVERIES_TOTAL.labels(queue=queue_name).inc()
+        pool.submit(run_in_worker, channel, method.delivery_tag, body, properties.content_type)
+
+    ch.basic_consume(
+        queue=queue_name,
+        on_message_callback=on_message_pooled if pool is not None else on_message,
+        auto_ack=False,
+    )
     try:
         ch.start_consuming()
     finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
         try:
             conn.close()
         except Exception:
@@ -0,0 +1,315 @@
+import codecs
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from common.metrics import DB_STATEMENT_SECONDS, SINK_ROWS_TOTAL, timed
+
+try:
+    import psycopg
+except ImportError:  # optional: only the postgresql:// sink needs it
+    psycopg = None
+
+# Streaming decode-and-persist.
+#
+# A payload is a JSON object whose `data` member is an array of items
+# ({"schema": ..., "id": ..., "data": [...]}). JsonArrayStream parses the
+# decompressed chunks incrementally and yields the raw JSON text of one item
+# at a time, so memory holds one input chunk plus one item, whatever the
+# payload size. The other members end up in `header`.
+#
+# Items are written to a sink in batches of `batch_rows`, inside one
+# transaction per payload that first removes the rows of an earlier attempt
+# (redeliveries replace, never duplicate). The caller publishes the business
+# ACK only after persist() returned, i.e. after the sink committed.
+#
+# Sinks (SINK):
+#   sqlite:///path/to/file.db   local SQLite file (WAL), executemany inserts
+#   postgresql://...            PostgreSQL, rows streamed with COPY
+# Both create their tables on first use:
+#   payloads(pointer_id, header, rows, persisted_at)
+#   payload_rows(pointer_id, seq, item)   item = raw JSON text of the item
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# What may follow a complete JSON value
+DELIMITERS = frozenset(" \t\n\r,]}:")
+
+# Compressed bytes read per step while persisting: small enough that a
+# decompressed chunk stays far below the payload size
+SINK_READ_SIZE = 64 * 1024
+
+# An item (or header value) larger than this is rejected rather than buffered
+MAX_ITEM_CHARS = 64 * 1024 * 1024
+
+
+class JsonArrayStream:
+    def __init__(self, chunks, field: str = "data", max_item: int = MAX_ITEM_CHARS):
+        self.chunks = iter(chunks)
+        self.field = field
+        self.max_item = max_item
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.header = {}
+        self.rows = 0
+
+    # Yields lists of at most `size` item texts
+    def batches(self, size: int):
+        batch = []
+        for item in self.items():
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def items(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+        else:
+            while True:
+                key, _ = self._value()
+                if not isinstance(key, str):
+                    raise ValueError(f"payload: object key expected at offset {self.pos}")
+                self._expect(":")
+                if key == self.field:
+                    yield from self._array()
+                else:
+                    self.header[key], _ = self._value()
+                if self._expect(",}") == "}":
+                    break
+        if self._peek() is not None:
+            raise ValueError("payload: trailing data after the top-level object")
+
+    def _array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            _, text = self._value()
+            self.rows += 1
+            yield text
+            if self._expect(",]") == "]":
+                return
+
+    # Appends the next chunk; False at the end of the input
+    def _more(self) -> bool:
+        if self.eof:
+            return False
+        # drop what is already parsed
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            text = self.utf8.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self.utf8.decode(b"", final=True)
+        self.eof = True
+        return True
+
+    # Next non-whitespace character (not consumed), None at the end
+    def _peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return None
+
+    def _expect(self, allowed: str) -> str:
+        c = self._peek()
+        if c is None or c not in allowed:
+            raise ValueError(f"payload: expected one of {allowed!r}, got {c!r}")
+        self.pos += 1
+        return c
+
+    # (value, its JSON text); reads more input until the value is complete.
+    # A number cut by the chunk boundary ("2" of "2.5") also parses, so a
+    # value is only accepted once the character after it is a delimiter.
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                if self.eof or (end < len(self.buf) and self.buf[end] in DELIMITERS):
+                    text = self.buf[self.pos:end]
+                    self.pos = end
+                    return obj, text
+            if len(self.buf) - self.pos > self.max_item:
+                raise ValueError(f"payload: item larger than {self.max_item} characters")
+            self._more()
+
+
+class SqliteSink:
+    kind = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS payloads (
+        pointer_id   TEXT PRIMARY KEY,
+        header       TEXT NOT NULL,
+        rows         INTEGER NOT NULL,
+        persisted_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS payload_rows (
+        pointer_id TEXT NOT NULL,
+        seq        INTEGER NOT NULL,
+        item       TEXT NOT NULL,
+        PRIMARY KEY (pointer_id, seq)
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # one connection per worker thread
+        self.local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # autocommit mode; transactions are explicit BEGIN/COMMIT
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def begin(self, pointer_id: str):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM payload_rows WHERE pointer_id = ?", (pointer_id,))
+
+    def write(self, pointer_id: str, first_seq: int, items: list[str]):
+        self._conn().executemany(
+            "INSERT INTO payload_rows (pointer_id, seq, item) VALUES (?, ?, ?)",
+            [(pointer_id, seq, item) for seq, item in enumerate(items, first_seq)],
+        )
+
+    def commit(self, pointer_id: str, header: dict, rows: int):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO payloads (pointer_id, header, rows, persisted_at) VALUES (?, ?, ?, ?)",
+            (pointer_id, json.dumps(header, ensure_ascii=False), rows, datetime.now(timezone.utc).isoformat()),
+        )
+        conn.execute("COMMIT")
+
+    def rollback(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+
+class PostgresSink:
+    kind = "postgresql"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS payloads (
+        pointer_id   TEXT PRIMARY KEY,
+        header       JSONB NOT NULL,
+        rows         INTEGER NOT NULL,
+        persisted_at TIMESTAMPTZ NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS payload_rows (
+        pointer_id TEXT NOT NULL,
+        seq        INTEGER NOT NULL,
+        item       TEXT NOT NULL,
+        PRIMARY KEY (pointer_id, seq)
+    );
+    """
+
+    def __init__(self, dsn: str):
+        if psycopg is None:
+            raise RuntimeError("the postgresql sink requires psycopg")
+        self.dsn = dsn
+        self.local = threading.local()
+        self.schema_ready = False
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or conn.closed:
+            conn = psycopg.connect(self.dsn)
+            if not self.schema_ready:
+                conn.execute(self.SCHEMA)
+                conn.commit()
+                self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def begin(self, pointer_id: str):
+        # psycopg opens the transaction with the first statement
+        self._conn().execute("DELETE FROM payload_rows WHERE pointer_id = %s", (pointer_id,))
+
+    def write(self, pointer_id: str, first_seq: int, items: list[str]):
+        with self._conn().cursor() as cur:
+            with timed(DB_STATEMENT_SECONDS, statement="sink_copy"):
+                with cur.copy("COPY payload_rows (pointer_id, seq, item) FROM STDIN") as copy:
+                    for seq, item in enumerate(items, first_seq):
+                        copy.write_row((pointer_id, seq, item))
+
+    def commit(self, pointer_id: str, header: dict, rows: int):
+        conn = self._conn()
+        conn.execute(
+            """
+            INSERT INTO payloads (pointer_id, header, rows, persisted_at)
+            VALUES (%s, %s::jsonb, %s, NOW())
+            ON CONFLICT (pointer_id) DO UPDATE
+            SET header = EXCLUDED.header,
+                rows = EXCLUDED.rows,
+                persisted_at = EXCLUDED.persisted_at
+            """,
+            (pointer_id, json.dumps(header, ensure_ascii=False), rows),
+        )
+        conn.commit()
+
+    def rollback(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and not conn.closed:
+            conn.rollback()
+
+
+# sqlite:///relative/path.db or sqlite:////absolute/path.db (the path is what
+# follows the third slash), postgresql://... / postgres://...
+def open_sink(url: str):
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite":
+        if parts.netloc or len(parts.path) < 2:
+            raise ValueError(f"unsupported SINK {url!r} (sqlite:///relative.db or sqlite:////absolute.db)")
+        return SqliteSink(parts.path[1:])
+    if parts.scheme in ("postgresql", "postgres"):
+        return PostgresSink(url)
+    raise ValueError(f"unsupported SINK scheme {parts.scheme!r} (sqlite:///path or postgresql://...)")
+
+
+# Parses the decompressed `chunks` into the sink in one transaction.
+# `verify` runs after the last row and before the commit (e.g. the raw size
+# check); anything it raises rolls the payload back. Returns (rows, seconds).
+def persist(sink, pointer_id: str, chunks, batch_rows: int = 1000, verify=None):
+    t0 = time.perf_counter()
+    doc = JsonArrayStream(chunks)
+    try:
+        sink.begin(pointer_id)
+        for batch in doc.batches(max(1, batch_rows)):
+            sink.write(pointer_id, doc.rows - len(batch), batch)
+        if verify is not None:
+            verify()
+        sink.commit(pointer_id, doc.header, doc.rows)
+    except BaseException:
+        sink.rollback()
+        raise
+    SINK_ROWS_TOTAL.labels(sink=sink.kind).inc(doc.rows)
+    return doc.rows, time.perf_counter() - t0
@@ -0,0 +1,62 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from branch_consumer.cache import PayloadCache
+
+DATA = b"payload bytes" * 100
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PayloadCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+
+
+def test_put_and_open(cache):
+    assert cache.open(SHA) is None
+    cache.put(SHA, io.BytesIO(DATA))
+    with cache.open(SHA, len(DATA)) as f:
+        assert f.read() == DATA
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize("key", [
+    "../../etc/passwd",
+    "/etc/passwd",
+    SHA.upper(),
+    SHA[:-1],
+    SHA[:-2] + "/x",
+    "",
+    None,
+])
+def test_invalid_keys_never_become_paths(cache, tmp_path, key):
+    outside = tmp_path / "outside"
+    outside.write_bytes(DATA)
+    assert cache.open(key) is None
+    cache.put(key, io.BytesIO(DATA))
+    with pytest.raises(ValueError):
+        cache.path(key)
+    assert not any(files for _, _, files in os.walk(cache.root))
+
+
+def test_corrupt_or_wrong_size_entries_are_dropped(cache):
+    cache.put(SHA, io.BytesIO(DATA))
+    assert cache.open(SHA, len(DATA) + 1) is None
+    assert not os.path.exists(cache.path(SHA))
+
+    cache.put(SHA, io.BytesIO(DATA))
+    with open(cache.path(SHA), "r+b") as f:
+        f.write(b"X")
+    assert cache.open(SHA) is None
+    assert not os.path.exists(cache.path(SHA))
+
+
+def test_eviction_keeps_the_total_under_the_limit(tmp_path):
+    cache = PayloadCache(str(tmp_path / "cache"), 3000)
+    for i in range(5):
+        data = bytes([i]) * 1000
+        cache.put(hashlib.sha256(data).hexdigest(), io.BytesIO(data))
+    assert cache.approx_bytes <= 3000
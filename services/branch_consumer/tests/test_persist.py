@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+import pytest
+
+from branch_consumer.persist import JsonArrayStream, SqliteSink, open_sink, persist
+
+DOC = {"schema": "demo-1c-object-v1", "id": "x", "data": [1, 2.5, -3e2, "a,b]", {"k": [1, {"n": None}]}, True], "idx": 7}
+
+
+def chunks(text: str, size: int):
+    raw = text.encode("utf-8")
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1 << 20])
+def test_items_across_chunk_boundaries(size):
+    doc = JsonArrayStream(chunks(json.dumps(DOC), size))
+    items = [json.loads(text) for text in doc.items()]
+    assert items == DOC["data"]
+    assert doc.header == {"schema": "demo-1c-object-v1", "id": "x", "idx": 7}
+    assert doc.rows == len(DOC["data"])
+
+
+def test_multibyte_utf8_split_between_chunks():
+    doc = JsonArrayStream(chunks(json.dumps({"data": ["жёлтый", "€"]}, ensure_ascii=False), 1))
+    assert [json.loads(t) for t in doc.items()] == ["жёлтый", "€"]
+
+
+def test_number_cut_by_a_chunk_is_not_accepted_early():
+    doc = JsonArrayStream([b'{"data": [12', b"34.5", b"6]}"])
+    assert list(doc.items()) == ["1234.56"]
+
+
+def test_batches():
+    doc = JsonArrayStream([json.dumps({"data": list(range(10))}).encode()])
+    assert [len(b) for b in doc.batches(4)] == [4, 4, 2]
+
+
+def test_empty_data():
+    doc = JsonArrayStream([b'{"data": [], "id": 1}'])
+    assert list(doc.items()) == [] and doc.header == {"id": 1}
+
+
+@pytest.mark.parametrize("text", ['{"data": [1, 2', '{"data": [1 2]}', '{"data": [1]} x', "[1, 2]"])
+def test_malformed(text):
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([text.encode()]).items())
+
+
+def test_item_size_limit():
+    with pytest.raises(ValueError):
+        list(JsonArrayStream(chunks(json.dumps({"data": ["x" * 100]}), 10), max_item=50).items())
+
+
+def test_persist_replaces_rows_and_rolls_back(tmp_path):
+    sink = SqliteSink(str(tmp_path / "rows.db"))
+    rows, _ = persist(sink, "p1", chunks(json.dumps(DOC), 5), batch_rows=4)
+    assert rows == len(DOC["data"])
+    # a redelivery replaces, never duplicates
+    persist(sink, "p1", chunks(json.dumps(DOC), 5), batch_rows=4)
+
+    def fail():
+        raise RuntimeError("size mismatch")
+
+    with pytest.raises(RuntimeError):
+        persist(sink, "p2", chunks(json.dumps(DOC), 5), verify=fail)
+
+    db = sqlite3.connect(tmp_path / "rows.db")
+    assert db.execute("SELECT pointer_id, COUNT(*) FROM payload_rows GROUP BY pointer_id").fetchall() == [("p1", 6)]
+    header, count = db.execute("SELECT header, rows FROM payloads WHERE pointer_id = 'p1'").fetchone()
+    assert json.loads(header)["idx"] == 7 and count == 6
+    assert db.execute("SELECT COUNT(*) FROM payloads WHERE pointer_id = 'p2'").fetchone() == (0,)
+
+
+@pytest.mark.parametrize("url, path", [
+    ("sqlite:///rows.db", "rows.db"),
+    ("sqlite:///data/rows.db", "data/rows.db"),
+    ("sqlite:////var/lib/rows.db", "/var/lib/rows.db"),
+])
+def test_open_sink_sqlite_paths(url, path):
+    assert open_sink(url).path == path
+
+
+@pytest.mark.parametrize("url", ["sqlite://rows.db", "sqlite:///", "mysql://x/y", "/tmp/rows.db", "file:///tmp/rows.db"])
+def test_open_sink_rejects_other_forms(url):
+    with pytest.raises(ValueError):
+        open_sink(url)
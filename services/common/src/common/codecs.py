@@ -0,0 +1,302 @@
+import zlib
+from functools import lru_cache
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is unavailable without it
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:  # optional: lz4 is unavailable without it
+    lz4frame = None
+
+# Compression codecs shared by producer and consumer.
+#
+# The pointer's `encoding` field names the codec ("gzip", "zstd", "lz4"); a
+# zstd payload compressed with a trained dictionary also carries `dict_id`, and
+# the consumer must have loaded the same dictionary to decode it. Every codec
+# offers one-shot compress/decompress plus incremental compressobj() /
+# decompressobj() objects (compress/flush, decompress) for the streaming paths,
+# and iter_decode(), which decodes a file object with bounded memory.
+
+# Payloads at least this large go to lz4 under the "auto" rule: at that size
+# compression speed matters more than ratio.
+AUTO_LZ4_MIN_SIZE = 64 * 1024 * 1024
+
+
+class GzipCodec:
+    name = "gzip"
+    extension = "gz"
+
+    def __init__(self, level: int | None = None, dictionary: bytes | None = None):
+        if dictionary is not None:
+            raise ValueError("gzip does not support dictionaries")
+        self.level = 9 if level is None else level
+        self.dict_id = None
+
+    def compressobj(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+
+    def decompressobj(self):
+        return zlib.decompressobj(31)
+
+    def compress(self, data: bytes) -> bytes:
+        c = self.compressobj()
+        return c.compress(data) + c.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressobj().decompress(data)
+
+    def iter_decode(self, fileobj, chunk_size: int):
+        d = self.decompressobj()
+        while not d.eof:
+            # input held back by max_length comes first, then more from the file
+            buf = d.unconsumed_tail or fileobj.read(chunk_size)
+            out = d.decompress(buf, chunk_size)
+            if out:
+                yield out
+            elif not buf:
+                raise ValueError("truncated gzip stream")
+        if d.unused_data or fileobj.read(1):
+            raise ValueError("trailing data after gzip stream")
+
+
+class ZstdCodec:
+    name = "zstd"
+    extension = "zst"
+
+    def __init__(self, level: int | None = None, dictionary: bytes | None = None):
+        if zstandard is None:
+            raise ValueError("zstd codec requires the zstandard package")
+        self.level = 3 if level is None else level
+        self.dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+        self.dict_id = self.dict_data.dict_id() if self.dict_data is not None else None
+
+    def _compressor(self):
+        return zstandard.ZstdCompressor(level=self.level, dict_data=self.dict_data)
+
+    def _decompressor(self):
+        return zstandard.ZstdDecompressor(dict_data=self.dict_data)
+
+    def compressobj(self):
+        return self._compressor().compressobj()
+
+    def decompressobj(self):
+        return self._decompressor().decompressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor().compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        # decompressobj also handles frames without a content size
+        return self.decompressobj().decompress(data)
+
+    def iter_decode(self, fileobj, chunk_size: int):
+        # decompressobj has no output limit, stream_reader has one but ends
+        # quietly on a truncated frame, so _ZstdFrames checks the end
+        frames = _ZstdFrames(fileobj)
+        reader = self._decompressor().stream_reader(frames, read_size=chunk_size, read_across_frames=True, closefd=False)
+        while True:
+            out = reader.read(chunk_size)
+            if not out:
+                break
+            yield out
+        while frames.read(chunk_size):
+            pass
+        frames.finish()
+
+
+_ZSTD_MAGIC = 0xFD2FB528
+_ZSTD_SKIPPABLE = 0x184D2A50
+
+
+# Read-through wrapper that follows the frame and block headers (RFC 8878)
+# of the zstd bytes passing through it, to tell where the stream may end.
+# Only headers are buffered; block bodies are counted and skipped.
+class _ZstdFrames:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.state = "magic"
+        self.need = 4
+        self.head = bytearray()
+        self.skip = 0
+        self.checksum = 0
+        self.frames = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        view = memoryview(data)
+        i = 0
+        while i < len(view):
+            if self.skip:
+                n = min(self.skip, len(view) - i)
+                self.skip -= n
+                i += n
+                continue
+            n = min(self.need - len(self.head), len(view) - i)
+            self.head += view[i:i + n]
+            i += n
+            if len(self.head) == self.need:
+                self._header(int.from_bytes(self.head, "little"))
+                self.head.clear()
+        return data
+
+    def _header(self, value: int):
+        if self.state == "magic":
+            if value == _ZSTD_MAGIC:
+                self.state, self.need = "descriptor", 1
+            elif value & 0xFFFFFFF0 == _ZSTD_SKIPPABLE:
+                self.state, self.need = "skippable", 4
+            else:
+                raise ValueError("trailing data after zstd stream")
+        elif self.state == "skippable":
+            self.skip = value
+            self.state, self.need = "magic", 4
+        elif self.state == "descriptor":
+            if value & 0x08:
+                raise ValueError("invalid zstd frame header")
+            single_segment = value >> 5 & 1
+            self.checksum = value >> 2 & 1
+            # window descriptor + dictionary id + frame content size
+            self.skip = (1 - single_segment) + (0, 1, 2, 4)[value & 3] + (single_segment, 2, 4, 8)[value >> 6]
+            self.state, self.need = "block", 3
+        else:
+            block_type, size = value >> 1 & 3, value >> 3
+            if block_type == 3:
+                raise ValueError("invalid zstd block header")
+            self.skip = 1 if block_type == 1 else size  # RLE blocks carry one byte
+            if value & 1:  # last block
+                self.skip += 4 * self.checksum
+                self.frames += 1
+                self.state, self.need = "magic", 4
+
+    def finish(self):
+        if self.state != "magic" or self.head or self.skip or not self.frames:
+            raise ValueError("truncated zstd stream")
+
+
+class _Lz4Compressobj:
+    # LZ4FrameCompressor needs begin() before the first block
+    def __init__(self, level: int):
+        self.compressor = lz4frame.LZ4FrameCompressor(compression_level=level)
+        self.started = False
+
+    def compress(self, data: bytes) -> bytes:
+        head = b""
+        if not self.started:
+            head = self.compressor.begin()
+            self.started = True
+        return head + self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        head = b"" if self.started else self.compressor.begin()
+        self.started = True
+        return head + self.compressor.flush()
+
+
+class Lz4Codec:
+    name = "lz4"
+    extension = "lz4"
+
+    def __init__(self, level: int | None = None, dictionary: bytes | None = None):
+        if lz4frame is None:
+            raise ValueError("lz4 codec requires the lz4 package")
+        if dictionary is not None:
+            raise ValueError("lz4 does not support dictionaries")
+        self.level = 0 if level is None else level
+        self.dict_id = None
+
+    def compressobj(self):
+        return _Lz4Compressobj(self.level)
+
+    def decompressobj(self):
+        return lz4frame.LZ4FrameDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4frame.decompress(data)
+
+    def iter_decode(self, fileobj, chunk_size: int):
+        d = self.decompressobj()
+        while not d.eof:
+            buf = b""
+            # input held back by max_length is kept inside the decompressor
+            if d.needs_input:
+                buf = fileobj.read(chunk_size)
+                if not buf:
+                    raise ValueError("truncated lz4 stream")
+            out = d.decompress(buf, chunk_size)
+            if out:
+                yield out
+        if d.unused_data or fileobj.read(1):
+            raise ValueError("trailing data after lz4 stream")
+
+
+CODECS = {c.name: c for c in (GzipCodec, ZstdCodec, Lz4Codec)}
+
+
+def available() -> list[str]:
+    names = ["gzip"]
+    if zstandard is not None:
+        names.append("zstd")
+    if lz4frame is not None:
+        names.append("lz4")
+    return names
+
+
+# Codecs are cached per (name, level, dictionary file), so worker processes
+# and per-message callers load a dictionary once.
+@lru_cache(maxsize=None)
+def get_codec(name: str, level: int | None = None, dict_path: str | None = None):
+    if name not in CODECS:
+        raise ValueError(f"unknown encoding {name!r}")
+    dictionary = None
+    if dict_path and name == "zstd":
+        with open(dict_path, "rb") as f:
+            dictionary = f.read()
+    return CODECS[name](level=level, dictionary=dictionary)
+
+
+# Size-based rule behind `--codec auto`: lz4 for huge payloads, zstd (with the
+# dictionary, if any) otherwise, gzip when neither package is installed.
+def choose_codec(size_raw: int) -> str:
+    if size_raw >= AUTO_LZ4_MIN_SIZE and lz4frame is not None:
+        return "lz4"
+    if zstandard is not None:
+        return "zstd"
+    return "gzip"
+
+
+# Pointer fields describing how a payload was encoded
+def pointer_fields(codec) -> dict:
+    fields = {"encoding": codec.name}
+    if codec.dict_id is not None:
+        fields["dict_id"] = codec.dict_id
+    return fields
+
+
+# Codec for a received pointer/inline message. zstd payloads made with a
+# dictionary need the same dictionary (dict_path) on this side.
+def codec_for(msg: dict, dict_path: str | None = None):
+    name = msg.get("encoding", "gzip")
+    codec = get_codec(name, dict_path=dict_path if msg.get("dict_id") is not None else None)
+    if msg.get("dict_id") is not None and codec.dict_id != msg["dict_id"]:
+        raise ValueError(f"zstd dictionary mismatch: payload dict_id={msg['dict_id']} loaded={codec.dict_id}")
+    return codec
+
+
+# Yields the decoded chunks of an encoded file object. Reads and decoded chunks
+# are both at most chunk_size bytes, so memory stays bounded whatever the
+# payload size or compression ratio. Raises ValueError if the stream is
+# truncated or followed by other data.
+def decode_stream(codec, fileobj, chunk_size: int = 1024 * 1024):
+    return codec.iter_decode(fileobj, chunk_size)
+
+
+def train_zstd_dictionary(samples: list[bytes], dict_size: int = 112640) -> bytes:
+    if zstandard is None:
+        raise ValueError("zstd dictionaries require the zstandard package")
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
@@ -0,0 +1,109 @@
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+except ImportError:  # optional: metrics become no-ops without it
+    prometheus_client = None
+
+# Prometheus metrics shared by all services. Every process registers the same
+# families and only fills the ones on its own code paths; the scrape job tells
+# the services apart. Without prometheus_client installed every metric is a
+# no-op and no /metrics endpoint is started.
+
+# Latency buckets from 1 ms to ~1 min
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _histogram(name, doc, labels):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, doc, labels, buckets=LATENCY_BUCKETS)
+
+
+def _counter(name, doc, labels):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, doc, labels)
+
+
+def _gauge(name, doc, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Gauge(name, doc, labels)
+
+
+S3_REQUEST_SECONDS = _histogram("s3ack_s3_request_seconds", "S3 request latency", ["op"])
+CALLBACK_SECONDS = _histogram("s3ack_callback_seconds", "AMQP delivery handling time", ["callback"])
+DB_STATEMENT_SECONDS = _histogram("s3ack_db_statement_seconds", "DB statement time", ["statement"])
+CODEC_SECONDS = _histogram("s3ack_codec_seconds", "Compression/decompression time", ["op", "encoding"])
+SHA256_SECONDS = _histogram("s3ack_sha256_seconds", "sha256 time per payload", [])
+PUBLISH_CONFIRM_SECONDS = _histogram("s3ack_publish_confirm_seconds", "Publish to broker confirm latency", [])
+
+NACKS_TOTAL = _counter("s3ack_nacks_total", "Deliveries nacked", ["queue", "requeue"])
+REDELIVERIES_TOTAL = _counter("s3ack_redeliveries_total", "Deliveries received with the redelivered flag", ["queue"])
+S3_NOT_FOUND_TOTAL = _counter("s3ack_s3_not_found_total", "S3 GETs answered with 404", [])
+DELETIONS_TOTAL = _counter("s3ack_deletions_total", "S3 deletions, by result", ["kind", "result"])
+PUBLISHED_TOTAL = _counter("s3ack_published_total", "Pointers published, by result", ["result"])
+SINK_ROWS_TOTAL = _counter("s3ack_sink_rows_total", "Payload items committed to the consumer's sink", ["sink"])
+
+OBJECTS_PENDING = _gauge("s3ack_objects_pending", "Undeleted objects with fewer ACKs than recipients_total")
+OLDEST_UNDELETED_SECONDS = _gauge("s3ack_oldest_undeleted_object_age_seconds", "Age of the oldest undeleted object")
+DELETE_QUEUE_DEPTH = _gauge("s3ack_delete_queue_depth", "Claimed deletions waiting in the deleter (incl. retries)")
+REFCACHE_ENTRIES = _gauge("s3ack_refcache_entries", "Pointers in the coordinator's refcount cache", ["state"])
+RECIPIENTS_ACTIVE = _gauge("s3ack_recipients_active", "Active recipients in the producer's registry snapshot")
+PRODUCER_RATE_LIMIT = _gauge("s3ack_producer_rate_limit", "Producer message rate limit in msg/s (0 = unlimited)")
+QUEUE_DEPTH = _gauge("s3ack_queue_depth", "Ready messages in the fullest recipient queue, as sampled by the producer")
+
+
+def start_metrics_server(port: int) -> bool:
+    # port <= 0 disables the endpoint
+    if prometheus_client is None or port <= 0:
+        return False
+    prometheus_client.start_http_server(port)
+    return True
+
+
+# Times every S3 API call of a boto3 client, labelled by operation name
+# (PutObject, GetObject, DeleteObjects, UploadPart, ...). Clients without
+# botocore events (test doubles) are left alone.
+def instrument_s3(client):
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None or prometheus_client is None:
+        return client
+
+    def before(model, context, **kwargs):
+        context["s3ack_call"] = (model.name, time.perf_counter())
+
+    def after(context, **kwargs):
+        call = context.pop("s3ack_call", None)
+        if call is not None:
+            S3_REQUEST_SECONDS.labels(op=call[0]).observe(time.perf_counter() - call[1])
+
+    events.register("before-call.s3", before)
+    events.register("after-call.s3", after)
+    events.register("after-call-error.s3", after)
+    return client
+
+
+@contextmanager
+def timed(metric, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        (metric.labels(**labels) if labels else metric).observe(time.perf_counter() - t0)
@@ -1,5 +1,92 @@
-# Common message schemas (placeholders)
+# Common message schemas
 
 SCHEMA_POINTER = "s3-pointer-v1"
 SCHEMA_ACK = "s3-ack-v1"
+# Several ACKs of one recipient in one message: recipient_id plus "acks", a
+# list of s3-ack-v1 bodies without schema/recipient_id
+SCHEMA_ACK_BATCH = "s3-ack-batch-v1"
 SCHEMA_STORE = "s3-store-v1"
+# Small payloads embedded in the AMQP message itself (base64 of the encoded
+# bytes under "payload"); no S3 object, so no ACKs and no refcount.
+SCHEMA_INLINE = "s3-inline-v1"
+# Pointer into a pack object: several encoded payloads concatenated into one
+# S3 object. Adds pack_id, pack_members, offset and length (byte range of this
+# payload inside the pack); sha256/size_gz describe that range only.
+SCHEMA_POINTER_PACKED = "s3-pointer-v2"
+# JSON index appended to every pack (gzip member at metadata "index-offset")
+SCHEMA_PACK_INDEX = "s3-pack-index-v1"
+
+# Wire formats, told apart by the AMQP content_type. Every service decodes
+# both; WIRE_FORMAT picks what the producer and the branch consumers send.
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+
+# Typed records of the binary format (common.wire): a message is a msgpack
+# array [tag, field values in this order..., extra fields or nil], so field
+# names are not repeated per message. Field kinds:
+#   uuid    canonical UUID string <-> 16 bytes
+#   sha256  lowercase hex digest <-> 32 bytes
+#   ts      UTC ISO-8601 timestamp <-> int epoch microseconds
+#   b64     base64 string <-> raw bytes
+#   acks    list of ACK_ITEM records
+#   None    as is
+# Strings that would not round-trip exactly (e.g. a non-UTC timestamp) are
+# kept as they are; ts fields must be strings, never numbers. Tags are part
+# of the format: never reuse or renumber them.
+ACK_ITEM = (
+    ("pointer_id", "uuid"),
+    ("bucket", None),
+    ("key", None),
+    ("status", None),
+    ("processed_at", "ts"),
+    ("recipients_total", None),
+)
+
+RECORDS = {
+    SCHEMA_POINTER: (1, (
+        ("pointer_id", "uuid"),
+        ("bucket", None),
+        ("key", None),
+        ("encoding", None),
+        ("dict_id", None),
+        ("content_type", None),
+        ("size_raw", None),
+        ("size_gz", None),
+        ("sha256", "sha256"),
+        ("recipients_total", None),
+        ("created_at", "ts"),
+    )),
+    SCHEMA_POINTER_PACKED: (2, (
+        ("pointer_id", "uuid"),
+        ("pack_id", "uuid"),
+        ("pack_members", None),
+        ("bucket", None),
+        ("key", None),
+        ("offset", None),
+        ("length", None),
+        ("encoding", None),
+        ("dict_id", None),
+        ("content_type", None),
+        ("size_raw", None),
+        ("size_gz", None),
+        ("sha256", "sha256"),
+        ("recipients_total", None),
+        ("created_at", "ts"),
+    )),
+    SCHEMA_INLINE: (3, (
+        ("pointer_id", "uuid"),
+        ("encoding", None),
+        ("dict_id", None),
+        ("content_type", None),
+        ("size_raw", None),
+        ("size_gz", None),
+        ("sha256", "sha256"),
+        ("payload", "b64"),
+        ("created_at", "ts"),
+    )),
+    SCHEMA_ACK: (4, (("recipient_id", None),) + ACK_ITEM),
+    SCHEMA_ACK_BATCH: (5, (
+        ("recipient_id", None),
+        ("acks", "acks"),
+    )),
+}
@@ -0,0 +1,33 @@
+import zlib
+
+# Sharded deployment (SHARDS > 1).
+#
+# Pointers and ACKs are routed by a stable hash of pointer_id onto N routing
+# keys of the existing direct exchanges: "<key>.<shard>" (branch1.0, ack.2,
+# ...). Branch queues bind every pointer key, coordinator instance i owns
+# q.pointer.<i> and q.ack.<i>, so all statements and S3 deletes for a
+# pointer_id happen in exactly one coordinator. SHARDS <= 1 keeps the plain
+# keys and queue names.
+
+
+def shard_of(pointer_id: str, shards: int) -> int:
+    return zlib.crc32(pointer_id.encode("utf-8")) % shards
+
+
+# Routing key for a pointer_id
+def shard_key(base: str, pointer_id: str, shards: int) -> str:
+    if shards <= 1:
+        return base
+    return f"{base}.{shard_of(pointer_id, shards)}"
+
+
+# Queue name / routing key of one shard
+def shard_name(base: str, shard: int, shards: int) -> str:
+    if shards <= 1:
+        return base
+    return f"{base}.{shard}"
+
+
+# Every routing key (or queue) of a sharded base name
+def shard_names(base: str, shards: int) -> list[str]:
+    return [shard_name(base, shard, shards) for shard in range(max(1, shards))]
@@ -0,0 +1,232 @@
+import base64
+import binascii
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from operator import itemgetter
+
+from common.schemas import ACK_ITEM, CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK, RECORDS
+
+try:
+    import msgpack
+except ImportError:  # optional: the binary format is unavailable without it
+    msgpack = None
+
+# Pointer/ACK message encoding (see the records in common.schemas).
+#
+# encode() turns a message dict into (body, content_type); decode() turns a
+# body back into the same dict, picking the format by content_type (anything
+# but CONTENT_TYPE_MSGPACK is JSON, which is what every older sender used).
+# Messages of schemas without a record are sent as a plain msgpack map.
+
+WIRE_FORMATS = ("json", "msgpack")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_SECOND = timedelta(seconds=1)
+
+
+# The *_in converters only accept the exact shape they can reproduce, so a
+# value either round-trips unchanged or travels as it is.
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _uuid_in(value):
+    if isinstance(value, str) and _UUID.fullmatch(value):
+        return bytes.fromhex(value.replace("-", ""))
+    return value
+
+
+def _uuid_out(value):
+    if not isinstance(value, bytes):
+        return value
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _sha256_in(value):
+    try:
+        raw = bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return value
+    return raw if len(raw) == 32 and raw.hex() == value else value
+
+
+def _sha256_out(value):
+    return value.hex() if isinstance(value, bytes) else value
+
+
+# Timestamps: only "YYYY-MM-DDTHH:MM:SS.ffffff+00:00", what isoformat() gives
+# for an aware UTC datetime with microseconds. The date/time part is mostly
+# the same second for a burst of messages, so it is converted through a cache.
+@lru_cache(maxsize=4096)
+def _second_in(prefix: str):
+    try:
+        dt = datetime.fromisoformat(prefix + "+00:00")
+    except ValueError:
+        return None
+    return (dt - EPOCH) // ONE_SECOND if dt.isoformat() == prefix + "+00:00" else None
+
+
+@lru_cache(maxsize=4096)
+def _second_out(seconds: int) -> str:
+    return (EPOCH + seconds * ONE_SECOND).isoformat()[:19]
+
+
+def _ts_in(value):
+    if not isinstance(value, str) or len(value) != 32 or value[19] != "." or not value.endswith("+00:00"):
+        return value
+    fraction = value[20:26]
+    seconds = _second_in(value[:19])
+    if seconds is None or not (fraction.isascii() and fraction.isdigit()):
+        return value
+    return seconds * 1_000_000 + int(fraction)
+
+
+def _ts_out(value):
+    if not isinstance(value, int):
+        return value
+    seconds, us = divmod(value, 1_000_000)
+    return f"{_second_out(seconds)}.{us:06d}+00:00"
+
+
+# Canonical base64 only. With the alphabet validated, that is the length and
+# the last quantum (no stray padding bits), so the whole payload is not
+# encoded again to compare.
+def _b64_in(value):
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (TypeError, ValueError, binascii.Error):
+        return value
+    if len(value) != 4 * ((len(raw) + 2) // 3):
+        return value
+    if raw and base64.b64encode(raw[-(len(raw) % 3 or 3):]) != value[-4:].encode("ascii"):
+        return value
+    return raw
+
+
+def _b64_out(value):
+    return base64.b64encode(value).decode("ascii") if isinstance(value, bytes) else value
+
+
+# An ACK batch carries up to hundreds of items, so the common item shape
+# (every ACK_ITEM field present, nothing else) is packed and unpacked with the
+# fields unrolled, without the per-field loop of _pack/_unpack; any other
+# item goes through them. Both produce the same layout.
+_ACK_UNROLLED = (
+    ("pointer_id", "uuid"),
+    ("bucket", None),
+    ("key", None),
+    ("status", None),
+    ("processed_at", "ts"),
+    ("recipients_total", None),
+)
+
+
+def _acks_in(value):
+    out = []
+    for item in value:
+        try:
+            pointer_id, bucket, key, status, processed_at, recipients_total = _ack_values(item)
+        except KeyError:
+            out.append(_pack(item, _ACK_ITEM))
+            continue
+        if len(item) != 6:
+            out.append(_pack(item, _ACK_ITEM))
+            continue
+        # the converters pass None through, as _pack does
+        out.append([_uuid_in(pointer_id), bucket, key, status, _ts_in(processed_at), recipients_total, None])
+    return out
+
+
+def _acks_out(value):
+    out = []
+    for values in value:
+        if len(values) != 7 or values.count(None) != 1 or values[6] is not None:
+            out.append(_unpack(values, _ACK_ITEM, {}))
+            continue
+        pointer_id, bucket, key, status, processed_at, recipients_total, _ = values
+        out.append({
+            "pointer_id": _uuid_out(pointer_id),
+            "bucket": bucket,
+            "key": key,
+            "status": status,
+            "processed_at": _ts_out(processed_at),
+            "recipients_total": recipients_total,
+        })
+    return out
+
+
+KINDS = {
+    None: (None, None),
+    "uuid": (_uuid_in, _uuid_out),
+    "sha256": (_sha256_in, _sha256_out),
+    "ts": (_ts_in, _ts_out),
+    "b64": (_b64_in, _b64_out),
+    "acks": (_acks_in, _acks_out),
+}
+
+
+# (known names, [(name, to wire, from wire)]) of a field list; keys outside
+# the known names travel in the trailing extra map
+def _layout(fields, implied=()):
+    return frozenset(name for name, _ in fields) | set(implied), [(name, *KINDS[kind]) for name, kind in fields]
+
+
+_ACK_ITEM = _layout(ACK_ITEM)
+if ACK_ITEM != _ACK_UNROLLED:
+    raise ImportError("common.schemas.ACK_ITEM changed: update _acks_in/_acks_out")
+_ack_values = itemgetter(*(name for name, _ in ACK_ITEM))
+_BY_SCHEMA = {schema: (tag, _layout(fields, ("schema",))) for schema, (tag, fields) in RECORDS.items()}
+_BY_TAG = {tag: (schema, layout) for schema, (tag, layout) in _BY_SCHEMA.items()}
+
+
+def _pack(msg: dict, layout, head=()) -> list:
+    names, fields = layout
+    values = list(head)
+    for name, to_wire, _ in fields:
+        value = msg.get(name)
+        values.append(value if value is None or to_wire is None else to_wire(value))
+    values.append(None if names.issuperset(msg) else {k: v for k, v in msg.items() if k not in names})
+    return values
+
+
+def _unpack(values, layout, msg: dict) -> dict:
+    _, fields = layout
+    for (name, _, from_wire), value in zip(fields, values):
+        if value is not None:
+            msg[name] = value if from_wire is None else from_wire(value)
+    extra = values[len(fields)]
+    if extra:
+        msg.update(extra)
+    return msg
+
+
+# Raises ValueError for formats that are unknown or not installed
+def check_format(wire_format: str):
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"unknown wire format {wire_format!r} (choose from {', '.join(WIRE_FORMATS)})")
+    if wire_format == "msgpack" and msgpack is None:
+        raise ValueError("the msgpack wire format requires the msgpack package")
+
+
+def encode(msg: dict, wire_format: str = "json") -> tuple[bytes, str]:
+    if wire_format == "json":
+        return json.dumps(msg, ensure_ascii=False).encode("utf-8"), CONTENT_TYPE_JSON
+    record = _BY_SCHEMA.get(msg.get("schema"))
+    if record is None:
+        return msgpack.packb(msg), CONTENT_TYPE_MSGPACK
+    tag, layout = record
+    return msgpack.packb(_pack(msg, layout, (tag,))), CONTENT_TYPE_MSGPACK
+
+
+def decode(body: bytes, content_type: str | None = None) -> dict:
+    if content_type != CONTENT_TYPE_MSGPACK:
+        return json.loads(body)
+    if msgpack is None:
+        raise RuntimeError("received a msgpack message but the msgpack package is not installed")
+    values = msgpack.unpackb(body)
+    if isinstance(values, dict):
+        return values
+    schema, layout = _BY_TAG[values[0]]
+    return _unpack(values[1:], layout, {"schema": schema})
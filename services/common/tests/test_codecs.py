@@ -0,0 +1,78 @@
+import io
+import tracemalloc
+
+import pytest
+
+from common.codecs import available, codec_for, decode_stream, get_codec
+
+RAW = b'{"schema": "demo", "data": [' + b",".join(b'"item-%d"' % i for i in range(20000)) + b"]}"
+
+
+@pytest.mark.parametrize("name", available())
+def test_round_trip(name):
+    codec = get_codec(name)
+    data = codec.compress(RAW)
+    assert codec.decompress(data) == RAW
+    assert b"".join(decode_stream(codec, io.BytesIO(data), 1000)) == RAW
+
+
+@pytest.mark.parametrize("name", available())
+def test_streaming_compressobj(name):
+    codec = get_codec(name)
+    c = codec.compressobj()
+    data = b"".join(c.compress(RAW[i:i + 4096]) for i in range(0, len(RAW), 4096)) + c.flush()
+    assert b"".join(decode_stream(codec, io.BytesIO(data))) == RAW
+
+
+def test_codec_for_defaults_to_gzip():
+    assert codec_for({}).name == "gzip"
+    with pytest.raises(ValueError):
+        codec_for({"encoding": "brotli"})
+
+
+@pytest.mark.parametrize("name", available())
+def test_decoded_chunks_are_bounded(name):
+    codec = get_codec(name)
+    # ~32 MB of zeros compress to a few hundred KB at most
+    data = codec.compress(bytes(32 * 1024 * 1024))
+    tracemalloc.start()
+    try:
+        total = 0
+        for chunk in decode_stream(codec, io.BytesIO(data), 64 * 1024):
+            assert len(chunk) <= 64 * 1024
+            total += len(chunk)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert total == 32 * 1024 * 1024
+    assert peak < 4 * 1024 * 1024
+
+
+@pytest.mark.parametrize("name", available())
+@pytest.mark.parametrize("cut", [1, 4, 100, "half", "all"])
+def test_truncated_stream_is_rejected(name, cut):
+    codec = get_codec(name)
+    data = codec.compress(RAW)
+    data = {"half": data[:len(data) // 2], "all": b""}.get(cut) if isinstance(cut, str) else data[:-cut]
+    with pytest.raises(ValueError):
+        for _ in decode_stream(codec, io.BytesIO(data), 1000):
+            pass
+
+
+@pytest.mark.parametrize("name", available())
+def test_trailing_data_is_rejected(name):
+    codec = get_codec(name)
+    with pytest.raises(ValueError):
+        for _ in decode_stream(codec, io.BytesIO(codec.compress(RAW) + b"junk"), 1000):
+            pass
+
+
+def test_zstd_frames_without_content_size_and_skippable_frames():
+    if "zstd" not in available():
+        pytest.skip("zstandard not installed")
+    codec = get_codec("zstd")
+    c = codec.compressobj()
+    streamed = c.compress(RAW) + c.flush()
+    skippable = (0x184D2A5A).to_bytes(4, "little") + (3).to_bytes(4, "little") + b"abc"
+    data = skippable + streamed + codec.compress(b"more")
+    assert b"".join(decode_stream(codec, io.BytesIO(data), 777)) == RAW + b"more"
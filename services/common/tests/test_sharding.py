@@ -0,0 +1,21 @@
+import zlib
+
+from common.sharding import shard_key, shard_name, shard_names, shard_of
+
+
+def test_shard_of_is_crc32_mod_shards():
+    for pointer_id in ("a", "0f8e4c1e-8d43-4b7e-9a51-6d2f0c7e2b11", "ünïcode"):
+        assert shard_of(pointer_id, 7) == zlib.crc32(pointer_id.encode("utf-8")) % 7
+        assert 0 <= shard_of(pointer_id, 3) < 3
+
+
+def test_unsharded_names_are_plain():
+    assert shard_key("ack", "any", 1) == "ack"
+    assert shard_name("q.ack", 0, 0) == "q.ack"
+    assert shard_names("q.ack", 1) == ["q.ack"]
+
+
+def test_sharded_names():
+    assert shard_names("branch1", 3) == ["branch1.0", "branch1.1", "branch1.2"]
+    pointer_id = "0f8e4c1e-8d43-4b7e-9a51-6d2f0c7e2b11"
+    assert shard_key("ack", pointer_id, 3) == f"ack.{shard_of(pointer_id, 3)}"
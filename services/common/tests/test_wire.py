@@ -0,0 +1,97 @@
+import base64
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from common.schemas import (
+    CONTENT_TYPE_JSON,
+    CONTENT_TYPE_MSGPACK,
+    SCHEMA_ACK,
+    SCHEMA_ACK_BATCH,
+    SCHEMA_INLINE,
+    SCHEMA_POINTER,
+)
+from common.wire import check_format, decode, encode, msgpack
+
+NOW = datetime(2026, 10, 17, 12, 30, 45, 123456, tzinfo=timezone.utc).isoformat()
+
+
+def pointer(**extra):
+    return {
+        "schema": SCHEMA_POINTER,
+        "pointer_id": str(uuid.uuid4()),
+        "bucket": "1c-exchange",
+        "key": "demo/2026/10/17/x.json.gz",
+        "encoding": "gzip",
+        "content_type": "application/json",
+        "size_raw": 1048576,
+        "size_gz": 780000,
+        "sha256": "ab" * 32,
+        "recipients_total": 3,
+        "created_at": NOW,
+        **extra,
+    }
+
+
+def ack():
+    return {
+        "pointer_id": str(uuid.uuid4()),
+        "bucket": "1c-exchange",
+        "key": "demo/k",
+        "status": "processed",
+        "processed_at": NOW,
+        "recipients_total": 3,
+    }
+
+
+MESSAGES = [
+    pointer(),
+    # values a typed field cannot convert travel unchanged
+    pointer(pointer_id="not-a-uuid", sha256="XYZ", created_at="2026-10-17T12:30:45Z"),
+    # unknown keys go through the extra map
+    pointer(trace_id="t-1", dict_id=42),
+    {
+        "schema": SCHEMA_INLINE,
+        "pointer_id": str(uuid.uuid4()),
+        "encoding": "gzip",
+        "size_raw": 10,
+        "size_gz": 5,
+        "sha256": "cd" * 32,
+        "payload": base64.b64encode(b"\x00\x01payload").decode("ascii"),
+        "created_at": NOW,
+    },
+    {"schema": SCHEMA_ACK, "recipient_id": "branch1", **ack()},
+    {"schema": SCHEMA_ACK_BATCH, "recipient_id": "branch1", "acks": [ack() for _ in range(3)]},
+    # items off the unrolled path: missing fields, an extra key (a field set
+    # to None travels as a missing one)
+    {"schema": SCHEMA_ACK_BATCH, "recipient_id": "branch1", "acks": [
+        {k: v for k, v in ack().items() if k != "recipients_total"},
+        {k: v for k, v in ack().items() if k not in ("pointer_id", "processed_at")},
+        {**ack(), "error": "size mismatch"},
+        {**ack(), "processed_at": "2026-10-17T12:30:45+02:00"},
+        ack(),
+    ]},
+    {"schema": "something-else-v9", "x": [1, 2]},
+]
+
+
+@pytest.mark.parametrize("wire_format", ["json", "msgpack"])
+@pytest.mark.parametrize("msg", MESSAGES, ids=lambda m: m["schema"])
+def test_round_trip(wire_format, msg):
+    if wire_format == "msgpack" and msgpack is None:
+        pytest.skip("msgpack not installed")
+    body, content_type = encode(msg, wire_format)
+    assert content_type == (CONTENT_TYPE_JSON if wire_format == "json" else CONTENT_TYPE_MSGPACK)
+    assert decode(body, content_type) == msg
+
+
+def test_json_is_the_default_for_unknown_content_types():
+    body, _ = encode(pointer(), "json")
+    assert decode(body, None) == decode(body, "text/plain") == decode(body, CONTENT_TYPE_JSON)
+
+
+def test_check_format():
+    check_format("json")
+    with pytest.raises(ValueError):
+        check_format("xml")
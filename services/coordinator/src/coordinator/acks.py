@@ -0,0 +1,297 @@
+import time
+
+from common.metrics import CALLBACK_SECONDS, NACKS_TOTAL, timed
+from common.schemas import SCHEMA_ACK, SCHEMA_ACK_BATCH
+from common.wire import decode
+from coordinator.db import aexecute, execute, get_conn
+
+
+# [(pointer_id, recipient_id, processed_at)] of an s3-ack-v1 or
+# s3-ack-batch-v1 message (JSON or msgpack, by content_type); [] for anything else
+def parse_acks(body: bytes, content_type: str | None = None):
+    msg = decode(body, content_type)
+    schema = msg.get("schema")
+    if schema == SCHEMA_ACK:
+        return [(msg["pointer_id"], msg["recipient_id"], msg["processed_at"])]
+    if schema == SCHEMA_ACK_BATCH:
+        recipient_id = msg["recipient_id"]
+        return [(a["pointer_id"], recipient_id, a["processed_at"]) for a in msg["acks"]]
+    return []
+
+
+def log_acks(acks, states):
+    for pointer_id, recipient_id, _ in acks:
+        if pointer_id in states:
+            acks_received, recipients_total = states[pointer_id]
+            print(
+                f"[coordinator] ACK stored pointer_id={pointer_id} "
+                f"recipient={recipient_id} ({acks_received}/{recipients_total})"
+            )
+        else:
+            print(f"[coordinator] ACK duplicate pointer_id={pointer_id} recipient={recipient_id} (already deleted)")
+
+
+# The statements are shared by the blocking (store_acks) and the asyncio
+# (store_acks_async) coordinators.
+#
+# 0️⃣ objects/acks are partitioned by created_at and their primary keys
+# include it, so ON CONFLICT alone cannot see a pointer_id that lives in
+# another partition. Every transaction first takes a per-pointer_id advisory
+# lock (in hash order, so batches cannot deadlock); with it held, "use the
+# existing row from any partition, else insert" is race-free.
+LOCK_POINTERS_SQL = """
+SELECT pg_advisory_xact_lock(k)
+FROM (
+    SELECT DISTINCT hashtextextended(pointer_id, 0) AS k
+    FROM unnest(%s::text[]) AS t(pointer_id)
+    ORDER BY k
+) AS s
+"""
+
+# 1️⃣ Idempotent ACK insert, placeholder upsert (ACK-before-pointer allowed)
+# and refcount bump by the number of ACK rows that were actually inserted.
+# ACK rows take the created_at (partition) of their objects row; a new
+# placeholder gets NOW(). Duplicates of already deleted objects leave the row
+# untouched and return nothing. Rows are upserted in pointer_id order, so
+# concurrent transactions lock them in the same order.
+STORE_ACKS_SQL = """
+WITH input AS (
+    SELECT *
+    FROM unnest(%s::text[], %s::text[], %s::timestamptz[])
+        AS t(pointer_id, recipient_id, processed_at)
+),
+existing AS (
+    SELECT DISTINCT ON (pointer_id) pointer_id, created_at
+    FROM objects
+    WHERE pointer_id IN (SELECT pointer_id FROM input)
+),
+keyed AS (
+    SELECT i.pointer_id, i.recipient_id, i.processed_at, COALESCE(e.created_at, NOW()) AS created_at
+    FROM input i
+    LEFT JOIN existing e ON e.pointer_id = i.pointer_id
+),
+inserted AS (
+    INSERT INTO acks (pointer_id, recipient_id, processed_at, created_at)
+    SELECT pointer_id, recipient_id, processed_at, created_at FROM keyed
+    ON CONFLICT (pointer_id, created_at, recipient_id) DO NOTHING
+    RETURNING pointer_id
+),
+delta AS (
+    SELECT k.pointer_id, k.created_at, COUNT(ins.pointer_id) AS n
+    FROM (SELECT DISTINCT pointer_id, created_at FROM keyed) k
+    LEFT JOIN inserted ins ON ins.pointer_id = k.pointer_id
+    GROUP BY k.pointer_id, k.created_at
+)
+INSERT INTO objects AS o (pointer_id, created_at, acks_received)
+SELECT pointer_id, created_at, n FROM delta
+ORDER BY pointer_id
+ON CONFLICT (pointer_id, created_at) DO UPDATE
+SET acks_received = o.acks_received + EXCLUDED.acks_received
+WHERE EXCLUDED.acks_received > 0 OR o.deleted_at IS NULL
+RETURNING o.pointer_id,
+    o.acks_received,
+    o.recipients_total,
+    o.bucket,
+    o.object_key,
+    o.pack_id,
+    (
+        o.recipients_total IS NOT NULL
+        AND o.pointer_received_at IS NOT NULL
+        AND o.deleted_at IS NULL
+        AND o.acks_received >= o.recipients_total
+    ) AS ready
+"""
+
+# 3️⃣ Acquire deletion lock (pointer must be real!); only the last ACK of an
+# object pays for this second statement
+CLAIM_DELETE_SQL = """
+UPDATE objects
+SET deleted_at = NOW()
+WHERE pointer_id = ANY(%s::text[])
+AND deleted_at IS NULL
+AND pointer_received_at IS NOT NULL
+AND acks_received >= recipients_total
+RETURNING pointer_id
+"""
+
+# 4️⃣ Pack members: each member claim above happens exactly once, so
+# members_done crosses members_total in exactly one statement, which claims
+# the pack object itself
+CLAIM_PACK_SQL = """
+UPDATE packs AS p
+SET members_done = p.members_done + d.n,
+    deleted_at = CASE
+        WHEN p.members_done < p.members_total AND p.members_done + d.n >= p.members_total
+        THEN NOW()
+        ELSE p.deleted_at
+    END
+FROM (
+    SELECT pack_id, COUNT(*) AS n
+    FROM unnest(%s::text[]) AS t(pack_id)
+    GROUP BY pack_id
+) AS d
+WHERE p.pack_id = d.pack_id
+RETURNING p.pack_id,
+    p.bucket,
+    p.object_key,
+    (p.members_done - d.n < p.members_total AND p.members_done >= p.members_total) AS complete
+"""
+
+
+def _ack_params(acks):
+    return ([a[0] for a in acks], [a[1] for a in acks], [a[2] for a in acks])
+
+
+def _ready(rows):
+    states = {}
+    ready = {}
+    for pointer_id, acks_received, recipients_total, bucket, object_key, pack_id, is_ready in rows:
+        states[pointer_id] = (acks_received, recipients_total)
+        # 2️⃣ Deletion gate
+        if is_ready:
+            ready[pointer_id] = (pointer_id, bucket, object_key, pack_id)
+    return states, ready
+
+
+def _split_claimed(ready, rows):
+    claimed = [ready[row[0]] for row in rows]
+    plain = [("object", pointer_id, bucket, key) for pointer_id, bucket, key, pack_id in claimed if pack_id is None]
+    members = [pack_id for _, _, _, pack_id in claimed if pack_id is not None]
+    return plain, members
+
+
+def _complete_packs(rows):
+    return [("pack", pack_id, bucket, key) for pack_id, bucket, key, complete in rows if complete]
+
+
+# Applies (pointer_id, recipient_id, processed_at) ACKs inside the caller's transaction.
+# Returns ({pointer_id: (acks_received, recipients_total)}, [(kind, id, bucket, object_key)]),
+# the second list holding the S3 objects whose deletion was claimed by this call:
+# ("object", pointer_id, ...) for plain pointers, ("pack", pack_id, ...) for a
+# pack whose last member just completed.
+def store_acks(conn, acks):
+    with conn.cursor() as cur:
+        execute(cur, "lock_pointers", LOCK_POINTERS_SQL, ([a[0] for a in acks],))
+        execute(cur, "store_acks", STORE_ACKS_SQL, _ack_params(acks))
+        states, ready = _ready(cur.fetchall())
+        if not ready:
+            return states, []
+
+        _, claimed = claim_ready(cur, ready)
+        return states, claimed
+
+
+# Claims {pointer_id: (pointer_id, bucket, object_key, pack_id)} candidates
+# (3️⃣/4️⃣). The guarded UPDATE re-checks the deletion gate, so candidates may
+# come from anywhere (e.g. the in-memory refcount cache). Returns the claimed
+# pointer_ids and the S3 objects to delete, as store_acks does.
+def claim_ready(cur, ready):
+    execute(cur, "claim_delete", CLAIM_DELETE_SQL, (list(ready),))
+    rows = cur.fetchall()
+    plain, members = _split_claimed(ready, rows)
+    pointer_ids = [row[0] for row in rows]
+    if not members:
+        return pointer_ids, plain
+
+    execute(cur, "claim_pack", CLAIM_PACK_SQL, (members,))
+    return pointer_ids, plain + _complete_packs(cur.fetchall())
+
+
+# store_acks on a psycopg AsyncConnection
+async def store_acks_async(conn, acks):
+    async with conn.cursor() as cur:
+        await aexecute(cur, "lock_pointers", LOCK_POINTERS_SQL, ([a[0] for a in acks],))
+        await aexecute(cur, "store_acks", STORE_ACKS_SQL, _ack_params(acks))
+        states, ready = _ready(await cur.fetchall())
+        if not ready:
+            return states, []
+
+        await aexecute(cur, "claim_delete", CLAIM_DELETE_SQL, (list(ready),))
+        plain, members = _split_claimed(ready, await cur.fetchall())
+        if not members:
+            return states, plain
+
+        await aexecute(cur, "claim_pack", CLAIM_PACK_SQL, (members,))
+        return states, plain + _complete_packs(await cur.fetchall())
+
+
+# Collects q.ack deliveries (each holding one or, for s3-ack-batch-v1, several
+# ACKs) and applies them in one transaction per batch, then confirms the whole
+# batch with a single cumulative basic_ack.
+class AckBatcher:
+    def __init__(self, connection, channel, batch_size: int, flush_interval: float, delete_claimed,
+                 queue_name: str = "q.ack"):
+        self.connection = connection
+        self.channel = channel
+        self.queue_name = queue_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.delete_claimed = delete_claimed
+        self.pending = []
+        # ACKs in `pending` (a delivery may hold several)
+        self.count = 0
+        self.timer = None
+
+    def add(self, delivery_tag: int, acks):
+        self.pending.append((delivery_tag, acks))
+        self.count += len(acks)
+        if self.count >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        batch, self.pending, self.count = self.pending, [], 0
+        if not batch:
+            return
+
+        failed = set()
+        with timed(CALLBACK_SECONDS, callback="ack_batch"):
+            try:
+                with get_conn() as conn:
+                    states, claimed = store_acks(conn, [ack for _, acks in batch for ack in acks])
+            except Exception as e:
+                print(f"[coordinator] ACK batch error: {e!r} (retrying one by one)")
+                states, claimed, failed = self._store_one_by_one(batch)
+
+        self.delete_claimed(claimed)
+
+        # Settle failures first so the cumulative ack below never covers them
+        for tag in sorted(failed):
+            self.channel.basic_nack(tag, requeue=True)
+        NACKS_TOTAL.labels(queue=self.queue_name, requeue="true").inc(len(failed))
+        ok = [tag for tag, _ in batch if tag not in failed]
+        if ok:
+            self.channel.basic_ack(max(ok), multiple=True)
+
+        complete = sum(1 for count, total in states.values() if total is not None and count >= total)
+        print(
+            f"[coordinator] ACK batch stored size={len(batch)} failed={len(failed)} "
+            f"pointers={len(states)} complete={complete} deleted={len(claimed)}"
+        )
+        if failed:
+            time.sleep(1)
+
+    def _store_one_by_one(self, batch):
+        states, claimed, failed = {}, [], set()
+        done = set()
+        try:
+            with get_conn() as conn:
+                for tag, acks in batch:
+                    try:
+                        with conn.transaction():
+                            s, c = store_acks(conn, acks)
+                        states.update(s)
+                        claimed.extend(c)
+                    except Exception as e:
+                        print(f"[coordinator] ACK error: {e!r} pointer_ids={[a[0] for a in acks]}")
+                        failed.add(tag)
+                    done.add(tag)
+        except Exception as e:
+            print(f"[coordinator] ACK error: {e!r}")
+            # Committed deliveries keep their claims; the rest is redelivered
+            failed |= {tag for tag, _ in batch if tag not in done}
+        return states, claimed, failed
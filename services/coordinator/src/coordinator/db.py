@@ -1,8 +1,46 @@
 import os
 import psycopg
 
-def get_conn():
+from common.metrics import DB_STATEMENT_SECONDS, timed
+
+try:
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # optional: only the asyncio coordinator needs it
+    AsyncConnectionPool = None
+
+
+def get_dsn():
     dsn = os.getenv("DB_DSN")
     if not dsn:
         raise RuntimeError("DB_DSN is not set")
-    return psycopg.connect(dsn)
+    return dsn
+
+
+def get_conn():
+    return psycopg.connect(get_dsn())
+
+
+# Opened pool for the asyncio coordinator; `async with pool.connection()`
+# commits on success like `with get_conn()` does
+async def open_pool(min_size: int, max_size: int):
+    if AsyncConnectionPool is None:
+        raise RuntimeError("the asyncio coordinator requires psycopg-pool")
+    pool = AsyncConnectionPool(get_dsn(), min_size=min_size, max_size=max_size, open=False)
+    await pool.open(wait=True)
+    return pool
+
+
+# cur.execute timed into s3ack_db_statement_seconds{statement=...}
+def execute(cur, statement: str, query, params=None):
+    with timed(DB_STATEMENT_SECONDS, statement=statement):
+        return cur.execute(query, params)
+
+
+def executemany(cur, statement: str, query, params_seq, returning: bool = False):
+    with timed(DB_STATEMENT_SECONDS, statement=statement):
+        return cur.executemany(query, params_seq, returning=returning)
+
+
+async def aexecute(cur, statement: str, query, params=None):
+    with timed(DB_STATEMENT_SECONDS, statement=statement):
+        return await cur.execute(query, params)
@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+from common.metrics import DELETE_QUEUE_DEPTH, DELETIONS_TOTAL
+from coordinator.db import execute, get_conn
+from coordinator.s3 import MAX_DELETE_KEYS, delete_objects
+
+
+# Background S3 deleter.
+#
+# The ACK path only claims deletions (objects.deleted_at) and hands them over
+# here; this thread batches them into multi-key DeleteObjects requests, retries
+# failed keys with capped exponential backoff and records the real outcome
+# (objects.s3_deleted_at, objects.delete_attempts). Claims that were never
+# completed, e.g. because the coordinator died, are picked up again on start.
+#
+# Items are either single objects (kind "object", keyed by pointer_id) or pack
+# objects (kind "pack", keyed by pack_id, outcome recorded in `packs`). Pack
+# members are never deleted on their own.
+#
+# kind -> (table, id column) for recording outcomes
+TABLES = {"object": ("objects", "pointer_id"), "pack": ("packs", "pack_id")}
+
+
+class DeletionWorker(threading.Thread):
+    def __init__(
+        self,
+        batch_size: int = MAX_DELETE_KEYS,
+        linger: float = 0.2,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        owns=None,
+    ):
+        super().__init__(name="s3-deleter", daemon=True)
+        self.batch_size = max(1, min(batch_size, MAX_DELETE_KEYS))
+        self.linger = linger
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # owns(id) -> bool: which claims resume_pending() picks up (sharded
+        # coordinators each resume their own ids only)
+        self.owns = owns or (lambda object_id: True)
+        self.queue = queue.Queue()
+        # (due monotonic time, seq, item) of keys waiting for another attempt
+        self.retries = []
+        self.seq = itertools.count()
+
+    def submit(self, pointer_id: str, bucket: str, object_key: str, attempts: int = 0, kind: str = "object"):
+        self.queue.put((pointer_id, bucket, object_key, attempts, kind))
+
+    def resume_pending(self) -> int:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                execute(
+                    cur,
+                    "resume_objects",
+                    """
+                    SELECT pointer_id, bucket, object_key, delete_attempts
+                    FROM objects
+                    WHERE deleted_at IS NOT NULL
+                    AND s3_deleted_at IS NULL
+                    AND bucket IS NOT NULL
+                    AND object_key IS NOT NULL
+                    AND pack_id IS NULL
+                    """
+                )
+                rows = [row + ("object",) for row in cur.fetchall()]
+                execute(
+                    cur,
+                    "resume_packs",
+                    """
+                    SELECT pack_id, bucket, object_key, delete_attempts
+                    FROM packs
+                    WHERE deleted_at IS NOT NULL
+                    AND s3_deleted_at IS NULL
+                    """
+                )
+                rows += [row + ("pack",) for row in cur.fetchall()]
+        rows = [row for row in rows if self.owns(row[0])]
+        for row in rows:
+            self.submit(*row)
+        return len(rows)
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            DELETE_QUEUE_DEPTH.set(self.queue.qsize() + len(self.retries))
+            if not batch:
+                continue
+            try:
+                self._delete(batch)
+            except Exception as e:
+                print(f"[coordinator] deleter error: {e!r}")
+                for item in batch:
+                    self._retry(item)
+
+    def _next_batch(self):
+        batch = []
+        now = time.monotonic()
+        while self.retries and self.retries[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self.retries)[2])
+
+        if not batch:
+            timeout = self.retries[0][0] - now if self.retries else None
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                return batch
+
+        # Linger briefly so a burst of claims shares one request
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _delete(self, batch):
+        by_bucket = defaultdict(lambda: defaultdict(list))
+        for item in batch:
+            by_bucket[item[1]][item[2]].append(item)
+
+        done, failed = [], []
+        for bucket, by_key in by_bucket.items():
+            keys = list(by_key)
+            try:
+                errors = delete_objects(bucket, keys)
+            except Exception as e:
+                errors = {k: repr(e) for k in keys}
+
+            for key, items in by_key.items():
+                if key in errors:
+                    failed.extend(items)
+                else:
+                    done.extend(items)
+
+            print(f"[coordinator] deleted {len(keys) - len(errors)}/{len(keys)} S3 objects bucket={bucket}")
+            for key, code in list(errors.items())[:5]:
+                print(f"[coordinator] S3 delete failed: {bucket}/{key} {code}")
+
+        for item in done:
+            DELETIONS_TOTAL.labels(kind=item[4], result="deleted").inc()
+        for item in failed:
+            DELETIONS_TOTAL.labels(kind=item[4], result="failed").inc()
+        self._record(done, failed)
+        for item in failed:
+            self._retry(item)
+
+    def _record(self, done, failed):
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    for kind, (table, id_column) in TABLES.items():
+                        done_ids = [item[0] for item in done if item[4] == kind]
+                        failed_ids = [item[0] for item in failed if item[4] == kind]
+                        if done_ids:
+                            execute(
+                                cur,
+                                "record_deleted",
+                                f"""
+                                UPDATE {table}
+                                SET s3_deleted_at = NOW(),
+                                    delete_attempts = delete_attempts + 1
+                                WHERE {id_column} = ANY(%s::text[])
+                                """,
+                                (done_ids,),
+                            )
+                        if failed_ids:
+                            execute(
+                                cur,
+                                "record_failed",
+                                f"""
+                                UPDATE {table}
+                                SET delete_attempts = delete_attempts + 1
+                                WHERE {id_column} = ANY(%s::text[])
+                                """,
+                                (failed_ids,),
+                            )
+                    pack_ids = [item[0] for item in done if item[4] == "pack"]
+                    if pack_ids:
+                        # Members share the pack's outcome
+                        execute(
+                            cur,
+                            "record_pack_members",
+                            """
+                            UPDATE objects
+                            SET s3_deleted_at = NOW()
+                            WHERE pack_id = ANY(%s::text[])
+                            """,
+                            (pack_ids,),
+                        )
+        except Exception as e:
+            # Deleted keys stay pending in the DB and are re-sent on the next
+            # start; deleting a missing key is harmless.
+            print(f"[coordinator] deleter DB error: {e!r}")
+
+    def _retry(self, item):
+        pointer_id, bucket, object_key, attempts, kind = item
+        attempts += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        delay *= random.uniform(0.5, 1.0)
+        heapq.heappush(
+            self.retries,
+            (time.monotonic() + delay, next(self.seq), (pointer_id, bucket, object_key, attempts, kind)),
+        )
@@ -0,0 +1,300 @@
+import argparse
+import gzip
+import os
+import re
+import tempfile
+import time
+from datetime import date, datetime, time as dtime, timedelta, timezone
+
+from psycopg import sql
+
+from coordinator.db import execute, get_conn
+from coordinator.s3 import get_s3
+
+# Partition maintenance for the refcount tables.
+#
+# objects and acks are range-partitioned by created_at into UTC days
+# (<table>_pYYYYMMDD). This command
+#   - creates the partitions for today .. today + days_ahead; rows that already
+#     landed in <table>_default for such a day are moved into the new partition
+#   - drops, optionally after archiving them to S3 as gzipped CSV, the day
+#     partitions older than the retention whose objects are all deleted from S3
+#     (acks_pX goes together with objects_pX)
+#   - purges finished rows older than the retention from the default
+#     partitions and from packs, which are not partitioned by day
+#
+# Retention should comfortably exceed the time a duplicate ACK can still be
+# redelivered: an ACK for a dropped pointer is stored as a new placeholder.
+# Placeholders (no object_key: the pointer never arrived) have no S3 work
+# and never block a drop; they go with their partition, or are purged from
+# the default partition, once older than the retention.
+
+TABLES = ("objects", "acks")
+PARTITION_RE = re.compile(r"^(objects|acks)_p(\d{8})$")
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def _bounds(day: date):
+    lo = datetime.combine(day, dtime.min, tzinfo=timezone.utc)
+    return lo, lo + timedelta(days=1)
+
+
+def partitions(conn, table: str) -> dict[date, str]:
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "list_partitions",
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            (table,),
+        )
+        days = {}
+        for (name,) in cur.fetchall():
+            m = PARTITION_RE.match(name)
+            if m and m.group(1) == table:
+                days[datetime.strptime(m.group(2), "%Y%m%d").date()] = name
+        return days
+
+
+def _columns(conn, table: str) -> str:
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "list_columns",
+            """
+            SELECT attname
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+            """,
+            (table,),
+        )
+        return ", ".join(row[0] for row in cur.fetchall())
+
+
+# Creates <table>_pYYYYMMDD for one day. Rows of that day already sitting in
+# the default partition are moved into it in the same transaction (a plain
+# CREATE ... PARTITION OF would fail on them).
+def create_partition(conn, table: str, day: date):
+    name = partition_name(table, day)
+    lo, hi = _bounds(day)
+    # explicit columns: a default partition converted by migration 005 may
+    # order them differently from the parent
+    columns = _columns(conn, table)
+    with conn.transaction():
+        with conn.cursor() as cur:
+            execute(cur, "create_partition", f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+            execute(
+                cur,
+                "move_default_rows",
+                f"""
+                WITH moved AS (
+                    DELETE FROM {table}_default
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING {columns}
+                )
+                INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+                """,
+                (lo, hi),
+            )
+            moved = cur.rowcount
+            # DDL takes no bind parameters: bounds are quoted client-side
+            execute(
+                cur,
+                "attach_partition",
+                sql.SQL(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({{}}) TO ({{}})").format(
+                    sql.Literal(lo), sql.Literal(hi)
+                ),
+            )
+    return moved
+
+
+def create_partitions(conn, days_ahead: int, today: date | None = None) -> list[str]:
+    today = today or datetime.now(timezone.utc).date()
+    created = []
+    for table in TABLES:
+        existing = partitions(conn, table)
+        for n in range(days_ahead + 1):
+            day = today + timedelta(days=n)
+            if day in existing:
+                continue
+            moved = create_partition(conn, table, day)
+            created.append(partition_name(table, day))
+            print(f"[maintenance] created {partition_name(table, day)} (moved {moved} rows from {table}_default)")
+    return created
+
+
+# (rows, rows still needing S3 work) of an objects day partition
+def _counts(conn, name: str) -> tuple[int, int]:
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "partition_counts",
+            f"""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE s3_deleted_at IS NULL AND object_key IS NOT NULL)
+            FROM {name}
+            """,
+        )
+        return cur.fetchone()
+
+
+def _rows(conn, name: str) -> int:
+    with conn.cursor() as cur:
+        execute(cur, "partition_rows", f"SELECT COUNT(*) FROM {name}")
+        return cur.fetchone()[0]
+
+
+# Streams a partition as gzipped CSV (with header) to s3://bucket/key.
+# Returns (rows, compressed bytes).
+def archive_partition(conn, name: str, bucket: str, key: str) -> tuple[int, int]:
+    with tempfile.TemporaryFile() as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+                    for chunk in copy:
+                        gz.write(chunk)
+                rows = cur.rowcount
+        size = raw.tell()
+        raw.seek(0)
+        get_s3().upload_fileobj(raw, bucket, key, ExtraArgs={"ContentType": "text/csv", "ContentEncoding": "gzip"})
+    return rows, size
+
+
+def drop_expired(conn, retention_days: int, archive_bucket: str | None = None, archive_prefix: str = "archive",
+                 dry_run: bool = False, today: date | None = None) -> list[date]:
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = today - timedelta(days=retention_days)
+    acks = partitions(conn, "acks")
+    dropped = []
+    for day, name in sorted(partitions(conn, "objects").items()):
+        # whole day older than the retention
+        if day >= cutoff:
+            continue
+        _, pending = _counts(conn, name)
+        if pending:
+            print(f"[maintenance] keeping {name}: {pending} objects not deleted from S3 yet")
+            continue
+        names = [name] + ([acks[day]] if day in acks else [])
+        if dry_run:
+            print(f"[maintenance] would drop {', '.join(names)}")
+            continue
+
+        # Archive without locks (COPY would block the coordinator's
+        # cross-partition queries for the whole upload), then drop only if
+        # nothing changed in between
+        archived = {}
+        if archive_bucket:
+            for n in names:
+                table = PARTITION_RE.match(n).group(1)
+                key = f"{archive_prefix}/{table}/{day:%Y-%m-%d}.csv.gz"
+                archived[n], size = archive_partition(conn, n, archive_bucket, key)
+                print(f"[maintenance] archived {n} to s3://{archive_bucket}/{key} ({archived[n]} rows, {size} bytes)")
+
+        with conn.transaction():
+            with conn.cursor() as cur:
+                execute(cur, "lock_partition", f"LOCK TABLE {', '.join(names)} IN ACCESS EXCLUSIVE MODE")
+            rows, pending = _counts(conn, name)
+            changed = pending or any(_rows(conn, n) != count for n, count in archived.items())
+            if not changed:
+                with conn.cursor() as cur:
+                    execute(cur, "drop_partition", f"DROP TABLE {', '.join(names)}")
+        if changed:
+            print(f"[maintenance] keeping {name}: changed while archiving, retrying next run")
+            continue
+        print(f"[maintenance] dropped {', '.join(names)} ({rows} objects)")
+        dropped.append(day)
+    return dropped
+
+
+# Row-level cleanup for what is not covered by day partitions: rows in the
+# default partitions (late/early created_at, data from before partitioning)
+# and finished packs. ACK-only placeholders count as finished.
+def purge_rows(conn, retention_days: int) -> tuple[int, int]:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    with conn.transaction():
+        with conn.cursor() as cur:
+            execute(
+                cur,
+                "purge_default",
+                """
+                WITH gone AS (
+                    DELETE FROM objects_default
+                    WHERE created_at < %s
+                    AND (s3_deleted_at IS NOT NULL OR object_key IS NULL)
+                    RETURNING pointer_id, created_at
+                )
+                DELETE FROM acks_default a
+                USING gone g
+                WHERE a.pointer_id = g.pointer_id
+                AND a.created_at = g.created_at
+                """,
+                (cutoff,),
+            )
+            acks = cur.rowcount
+            execute(
+                cur,
+                "purge_packs",
+                "DELETE FROM packs WHERE s3_deleted_at < %s",
+                (cutoff,),
+            )
+            packs = cur.rowcount
+    return acks, packs
+
+
+# Called by the coordinator on start so the next days' partitions exist even
+# when the maintenance job is not scheduled; failures are not fatal (rows then
+# go to the default partition).
+def ensure_partitions(days_ahead: int):
+    try:
+        with get_conn() as conn:
+            conn.autocommit = True
+            create_partitions(conn, days_ahead)
+    except Exception as e:
+        print(f"[maintenance] partition creation failed: {e!r}")
+
+
+def run(args):
+    with get_conn() as conn:
+        conn.autocommit = True
+        create_partitions(conn, args.days_ahead)
+        drop_expired(conn, args.retention_days, args.archive_bucket, args.archive_prefix, args.dry_run)
+        if not args.dry_run:
+            acks, packs = purge_rows(conn, args.retention_days)
+            if acks or packs:
+                print(f"[maintenance] purged {acks} default-partition ACKs and {packs} packs")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Create and expire objects/acks day partitions.")
+    p.add_argument("--days-ahead", type=int, default=int(os.getenv("PARTITION_DAYS_AHEAD", "3")),
+                   help="Create partitions for today and this many following days")
+    p.add_argument("--retention-days", type=int, default=int(os.getenv("RETENTION_DAYS", "7")),
+                   help="Drop day partitions older than this once all their objects are deleted")
+    p.add_argument("--archive-bucket", default=os.getenv("ARCHIVE_BUCKET") or None,
+                   help="Archive partitions to this bucket as gzipped CSV before dropping them")
+    p.add_argument("--archive-prefix", default=os.getenv("ARCHIVE_PREFIX", "archive"))
+    p.add_argument("--dry-run", action="store_true", help="Only report what would be dropped")
+    p.add_argument("--every", type=float, default=0, help="Repeat every N seconds (0 = run once)")
+    args = p.parse_args()
+
+    while True:
+        try:
+            run(args)
+        except Exception as e:
+            if not args.every:
+                raise
+            print(f"[maintenance] error: {e!r}")
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
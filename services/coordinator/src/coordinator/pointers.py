@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+
+from common.schemas import SCHEMA_POINTER, SCHEMA_POINTER_PACKED
+from common.wire import decode
+from coordinator.acks import LOCK_POINTERS_SQL
+from coordinator.db import aexecute, execute
+
+# s3-pointer-v2: bucket/key name the shared pack object
+INSERT_PACK_SQL = """
+INSERT INTO packs (pack_id, bucket, object_key, members_total, created_at)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (pack_id) DO NOTHING
+"""
+
+# Runs under LOCK_POINTERS_SQL. An existing row (duplicate pointer or
+# ACK-before-pointer placeholder) keeps its created_at: it is the partition key
+UPSERT_POINTER_SQL = """
+INSERT INTO objects
+(pointer_id, bucket, object_key, recipients_total, created_at, pointer_received_at, pack_id)
+SELECT
+    %(pointer_id)s, %(bucket)s, %(object_key)s, %(recipients_total)s,
+    COALESCE(
+        (SELECT created_at FROM objects WHERE pointer_id = %(pointer_id)s LIMIT 1),
+        %(created_at)s::timestamptz
+    ),
+    NOW(), %(pack_id)s
+ON CONFLICT (pointer_id, created_at) DO UPDATE
+SET bucket = EXCLUDED.bucket,
+    object_key = EXCLUDED.object_key,
+    recipients_total = EXCLUDED.recipients_total,
+    pack_id = EXCLUDED.pack_id,
+    pointer_received_at = NOW()
+RETURNING pointer_id, deleted_at IS NOT NULL AS deleted
+"""
+
+
+# Returns the pointer message, or None for messages without an S3 object
+# (s3-inline-v1 carries its payload: no S3 object, no refcount)
+def parse_pointer(body: bytes, content_type: str | None = None):
+    msg = decode(body, content_type)
+    if msg.get("schema") not in (SCHEMA_POINTER, SCHEMA_POINTER_PACKED):
+        return None
+    return msg
+
+
+def _params(msg: dict):
+    # Prefer pointer's created_at if provided, else now (UTC aware)
+    created_at = msg.get("created_at")
+    if created_at is None:
+        created_at = datetime.now(timezone.utc).isoformat()
+
+    pack_id = msg.get("pack_id")
+    pack = None
+    if pack_id is not None:
+        pack = (pack_id, msg["bucket"], msg["key"], int(msg["pack_members"]), created_at)
+    pointer = {
+        "pointer_id": msg["pointer_id"],
+        "bucket": msg["bucket"],
+        "object_key": msg["key"],
+        "recipients_total": int(msg.get("recipients_total", 1)),
+        "created_at": created_at,
+        "pack_id": pack_id,
+    }
+    return pack, pointer
+
+
+# Records a pointer inside the caller's transaction
+def store_pointer(conn, msg: dict):
+    pack, pointer = _params(msg)
+    with conn.cursor() as cur:
+        execute(cur, "lock_pointers", LOCK_POINTERS_SQL, ([pointer["pointer_id"]],))
+        if pack is not None:
+            execute(cur, "insert_pack", INSERT_PACK_SQL, pack)
+        execute(cur, "upsert_pointer", UPSERT_POINTER_SQL, pointer)
+
+
+# store_pointer on a psycopg AsyncConnection
+async def store_pointer_async(conn, msg: dict):
+    pack, pointer = _params(msg)
+    async with conn.cursor() as cur:
+        await aexecute(cur, "lock_pointers", LOCK_POINTERS_SQL, ([pointer["pointer_id"]],))
+        if pack is not None:
+            await aexecute(cur, "insert_pack", INSERT_PACK_SQL, pack)
+        await aexecute(cur, "upsert_pointer", UPSERT_POINTER_SQL, pointer)
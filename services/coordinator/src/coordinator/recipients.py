@@ -0,0 +1,96 @@
+import argparse
+
+import psycopg
+
+from coordinator.db import execute, get_conn
+
+# Recipient registry administration.
+#
+# The producer reads the active recipients (every RECIPIENTS_REFRESH_S
+# seconds), binds their queues to the pointer exchange, unbinds the queues of
+# deactivated ones and stamps the active count into each pointer as
+# recipients_total. recipient_id must match the branch consumer's CONSUMER_ID,
+# since the coordinator counts distinct recipient_ids per pointer. Each
+# active recipient needs a queue of its own (unique index): recipients
+# sharing a queue would split one copy of each pointer between them.
+#
+# Deactivating a recipient does not touch pointers that were already
+# published to it: drain its queue first. Nothing expires those objects
+# otherwise: they wait for its ACKs indefinitely, stay in S3, and keep
+# their day partitions from being dropped by maintenance.
+
+ADD_SQL = """
+INSERT INTO recipients (recipient_id, queue)
+VALUES (%s, %s)
+ON CONFLICT (recipient_id) DO UPDATE
+SET queue = EXCLUDED.queue,
+    active = TRUE,
+    updated_at = NOW()
+"""
+
+REMOVE_SQL = """
+UPDATE recipients
+SET active = FALSE,
+    updated_at = NOW()
+WHERE recipient_id = %s
+AND active
+"""
+
+LIST_SQL = """
+SELECT recipient_id, queue, active, updated_at
+FROM recipients
+ORDER BY recipient_id
+"""
+
+
+def add(conn, recipient_id: str, queue: str):
+    with conn.cursor() as cur:
+        execute(cur, "add_recipient", ADD_SQL, (recipient_id, queue))
+
+
+def remove(conn, recipient_id: str) -> bool:
+    with conn.cursor() as cur:
+        execute(cur, "remove_recipient", REMOVE_SQL, (recipient_id,))
+        return cur.rowcount > 0
+
+
+def list_recipients(conn):
+    with conn.cursor() as cur:
+        execute(cur, "list_recipients", LIST_SQL)
+        return cur.fetchall()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Manage the recipient registry.")
+    sub = p.add_subparsers(dest="command", required=True)
+    p_add = sub.add_parser("add", help="Register (or reactivate) a recipient")
+    p_add.add_argument("recipient_id", help="The branch consumer's CONSUMER_ID")
+    p_add.add_argument("--queue", default=None, help="Its pointer queue (default q.<recipient_id>)")
+    p_remove = sub.add_parser("remove", help="Deactivate a recipient")
+    p_remove.add_argument("recipient_id")
+    sub.add_parser("list", help="Show all recipients")
+    args = p.parse_args()
+
+    with get_conn() as conn:
+        if args.command == "add":
+            queue = args.queue or f"q.{args.recipient_id}"
+            try:
+                add(conn, args.recipient_id, queue)
+            except psycopg.errors.UniqueViolation:
+                raise SystemExit(f"[recipients] queue {queue} already belongs to another active recipient")
+            print(f"[recipients] active {args.recipient_id} queue={queue}")
+        elif args.command == "remove":
+            if remove(conn, args.recipient_id):
+                print(f"[recipients] deactivated {args.recipient_id}")
+            else:
+                print(f"[recipients] {args.recipient_id} is not an active recipient")
+        else:
+            rows = list_recipients(conn)
+            for recipient_id, queue, active, updated_at in rows:
+                state = "active" if active else "inactive"
+                print(f"{recipient_id:<24} {queue:<32} {state:<8} {updated_at:%Y-%m-%d %H:%M:%S}")
+            print(f"[recipients] {sum(1 for r in rows if r[2])} active / {len(rows)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import sys
+import time
+from collections import OrderedDict
+
+from common.metrics import CALLBACK_SECONDS, NACKS_TOTAL, REFCACHE_ENTRIES, timed
+from coordinator.acks import LOCK_POINTERS_SQL, STORE_ACKS_SQL, _ack_params, _ready, claim_ready
+from coordinator.db import execute, executemany, get_conn
+from coordinator.pointers import INSERT_PACK_SQL, UPSERT_POINTER_SQL, _params
+
+# Write-behind refcount cache for the blocking coordinator (REFCACHE=1).
+#
+# Every undeleted pointer of this coordinator is kept in memory: its
+# recipients_total, the recipients that ACKed, bucket/key and whether the
+# pointer itself arrived. Pointer and ACK deliveries are buffered and written
+# in one transaction per flush (pointer upserts, ACK rows, deletion claims).
+# Deletion candidates come from memory, which also covers pointers whose ACKs
+# all arrived before the pointer. Duplicate ACKs of known recipients or
+# recently deleted pointers are answered without touching the DB.
+#
+# Ordering rule: a flush commits before any of its deliveries is acked on
+# RabbitMQ, and memory is only updated after that commit, so a crash or a
+# failed flush loses nothing that was acked.
+#
+# The DB stays authoritative: claims are guarded UPDATEs, and pointers the DB
+# reports ready are claimed as well, so a stale or missing entry never blocks
+# a deletion. Each pointer must have a single coordinator (SHARDS/SHARD_ID).
+
+# Undeleted pointers with their ACKed recipients. WHERE deleted_at IS NULL
+# is served by idx_objects_deleted_at, so the load does not grow with the
+# deleted history.
+WARM_SQL = """
+SELECT o.pointer_id,
+    o.recipients_total,
+    o.bucket,
+    o.object_key,
+    o.pointer_received_at,
+    o.pack_id,
+    COALESCE(array_agg(a.recipient_id) FILTER (WHERE a.recipient_id IS NOT NULL), '{}')
+FROM objects o
+LEFT JOIN acks a ON a.pointer_id = o.pointer_id AND a.created_at = o.created_at
+WHERE o.deleted_at IS NULL
+GROUP BY o.pointer_id, o.created_at
+"""
+
+
+class Entry:
+    __slots__ = ("recipients_total", "acked", "bucket", "object_key", "received_at", "pack_id")
+
+    def __init__(self, recipients_total=None, bucket=None, object_key=None, received_at=None, pack_id=None,
+                 acked=()):
+        self.recipients_total = recipients_total
+        # recipient ids are interned: every entry shares the same few strings
+        self.acked = {sys.intern(r) for r in acked}
+        self.bucket = bucket
+        self.object_key = object_key
+        self.received_at = received_at
+        self.pack_id = pack_id
+
+    def ready(self, extra=()) -> bool:
+        return (
+            self.received_at is not None
+            and self.recipients_total is not None
+            and len(self.acked.union(extra)) >= self.recipients_total
+        )
+
+
+class RefcountCache:
+    def __init__(self, max_completed: int = 100_000):
+        self.entries = {}
+        # Recently deleted pointer_ids, oldest first; bounded, evicted ids are
+        # simply looked up in the DB again
+        self.completed = OrderedDict()
+        self.max_completed = max_completed
+
+    def warm(self, conn, owns=None) -> int:
+        owns = owns or (lambda pointer_id: True)
+        # server-side cursor: rows are streamed, not fetched at once
+        with conn.cursor(name="refcache_warm") as cur:
+            cur.itersize = 10_000
+            execute(cur, "refcache_warm", WARM_SQL)
+            for pointer_id, total, bucket, key, received_at, pack_id, acked in cur:
+                if owns(pointer_id):
+                    self.entries[pointer_id] = Entry(total, bucket, key, received_at, pack_id, acked)
+        self._gauges()
+        return len(self.entries)
+
+    def is_duplicate(self, pointer_id: str, recipient_id: str) -> bool:
+        if pointer_id in self.completed:
+            return True
+        entry = self.entries.get(pointer_id)
+        return entry is not None and recipient_id in entry.acked
+
+    # Deletion candidates {pointer_id: (pointer_id, bucket, object_key, pack_id)}
+    # if the given pointer messages and ACKs were applied, without applying them
+    def candidates(self, pointers, acks, extra=()) -> dict:
+        recipients = {}
+        for pointer_id, recipient_id, _ in acks:
+            recipients.setdefault(pointer_id, set()).add(recipient_id)
+        msgs = {msg["pointer_id"]: msg for msg in pointers}
+
+        ready = {}
+        for pointer_id in recipients.keys() | msgs.keys() | set(extra):
+            if pointer_id in self.completed:
+                continue
+            entry = self.entries.get(pointer_id) or Entry()
+            msg = msgs.get(pointer_id)
+            if msg is not None:
+                entry = _with_pointer(Entry(acked=entry.acked), msg)
+            if entry.ready(recipients.get(pointer_id, ())):
+                ready[pointer_id] = (pointer_id, entry.bucket, entry.object_key, entry.pack_id)
+        return ready
+
+    # Applies a committed flush. states: store_acks states (pointers missing
+    # from it were deleted before); deleted: pointer_ids whose upsert found a
+    # deleted row; claimed: pointer_ids claimed by the flush
+    def apply(self, pointers, acks, states, deleted, claimed):
+        for msg in pointers:
+            pointer_id = msg["pointer_id"]
+            if pointer_id in deleted:
+                self._complete(pointer_id)
+            elif pointer_id not in self.completed:
+                _with_pointer(self.entries.setdefault(pointer_id, Entry()), msg)
+        for pointer_id, recipient_id, _ in acks:
+            if pointer_id not in states:
+                self._complete(pointer_id)
+            elif pointer_id not in self.completed:
+                self.entries.setdefault(pointer_id, Entry()).acked.add(sys.intern(recipient_id))
+        for pointer_id in claimed:
+            self._complete(pointer_id)
+        self._gauges()
+
+    def ready_ids(self) -> set:
+        return {pointer_id for pointer_id, entry in self.entries.items() if entry.ready()}
+
+    def _complete(self, pointer_id: str):
+        self.entries.pop(pointer_id, None)
+        self.completed[pointer_id] = None
+        self.completed.move_to_end(pointer_id)
+        while len(self.completed) > self.max_completed:
+            self.completed.popitem(last=False)
+
+    def _gauges(self):
+        REFCACHE_ENTRIES.labels(state="pending").set(len(self.entries))
+        REFCACHE_ENTRIES.labels(state="completed").set(len(self.completed))
+
+
+def _with_pointer(entry: Entry, msg: dict) -> Entry:
+    entry.recipients_total = int(msg.get("recipients_total", 1))
+    entry.bucket = msg["bucket"]
+    entry.object_key = msg["key"]
+    entry.received_at = entry.received_at or time.time()
+    entry.pack_id = msg.get("pack_id")
+    return entry
+
+
+# Buffers pointer and ACK deliveries (both channels of the blocking
+# coordinator) and flushes them through the cache: one transaction, then one
+# cumulative basic_ack per channel.
+class WriteBehind:
+    def __init__(self, connection, cache: RefcountCache, flush_size: int, flush_interval: float, delete_claimed):
+        self.connection = connection
+        self.cache = cache
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.delete_claimed = delete_claimed
+        # (channel, delivery_tag, queue name, pointer message / list of ACKs)
+        self.pointers = []
+        self.acks = []
+        # pointers + ACKs buffered
+        self.count = 0
+        # pointer_ids to re-check for deletion on the next flush
+        self.recheck = set()
+        self.timer = None
+
+    def add_pointer(self, channel, delivery_tag: int, queue_name: str, msg: dict):
+        self.pointers.append((channel, delivery_tag, queue_name, msg))
+        self.count += 1
+        self._added()
+
+    # acks: the ACKs of one delivery (several for s3-ack-batch-v1)
+    def add_ack(self, channel, delivery_tag: int, queue_name: str, acks):
+        fresh = []
+        for ack in acks:
+            if self.cache.is_duplicate(ack[0], ack[1]):
+                print(f"[coordinator] ACK duplicate pointer_id={ack[0]} recipient={ack[1]} (cached)")
+            else:
+                fresh.append(ack)
+        if not fresh:
+            channel.basic_ack(delivery_tag)
+            return
+        self.acks.append((channel, delivery_tag, queue_name, fresh))
+        self.count += len(fresh)
+        self._added()
+
+    def _added(self):
+        if self.count >= self.flush_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        pointers, self.pointers = self.pointers, []
+        acks, self.acks = self.acks, []
+        self.count = 0
+        recheck, self.recheck = self.recheck, set()
+        if not (pointers or acks or recheck):
+            return
+
+        failed = set()
+        with timed(CALLBACK_SECONDS, callback="refcache_flush"):
+            try:
+                with get_conn() as conn:
+                    claimed = self._store(conn, [i[3] for i in pointers], [a for i in acks for a in i[3]], recheck)
+            except Exception as e:
+                print(f"[coordinator] flush error: {e!r} (retrying one by one)")
+                self.recheck |= recheck
+                claimed, failed = self._store_one_by_one(pointers + acks)
+
+        self.delete_claimed(claimed)
+        self._settle(pointers + acks, failed)
+        print(
+            f"[coordinator] flushed pointers={len(pointers)} acks={sum(len(i[3]) for i in acks)} failed={len(failed)} "
+            f"deleted={len(claimed)} cached={len(self.cache.entries)}"
+        )
+        if failed:
+            time.sleep(1)
+
+    # One transaction; the cache is updated once it has committed
+    def _store(self, conn, pointers, acks, recheck=()):
+        ids = [msg["pointer_id"] for msg in pointers] + [ack[0] for ack in acks] + list(recheck)
+        with conn.transaction():
+            with conn.cursor() as cur:
+                execute(cur, "lock_pointers", LOCK_POINTERS_SQL, (ids,))
+                deleted = self._upsert_pointers(cur, pointers)
+                states, ready = {}, {}
+                if acks:
+                    execute(cur, "store_acks", STORE_ACKS_SQL, _ack_params(acks))
+                    states, ready = _ready(cur.fetchall())
+                ready = {**self.cache.candidates(pointers, acks, recheck), **ready}
+                for pointer_id in deleted:
+                    ready.pop(pointer_id, None)
+                claimed_ids, claimed = claim_ready(cur, ready) if ready else ([], [])
+        self.cache.apply(pointers, acks, states, deleted, claimed_ids)
+        return claimed
+
+    # Returns the pointer_ids whose rows were already deleted
+    def _upsert_pointers(self, cur, pointers) -> set:
+        if not pointers:
+            return set()
+        params = [_params(msg) for msg in pointers]
+        packs = [pack for pack, _ in params if pack is not None]
+        if packs:
+            executemany(cur, "insert_pack", INSERT_PACK_SQL, packs)
+        executemany(cur, "upsert_pointer", UPSERT_POINTER_SQL, [pointer for _, pointer in params], returning=True)
+        deleted = set()
+        while True:
+            deleted.update(pointer_id for pointer_id, is_deleted in cur.fetchall() if is_deleted)
+            if not cur.nextset():
+                return deleted
+
+    def _store_one_by_one(self, items):
+        claimed, failed, done = [], set(), 0
+        try:
+            with get_conn() as conn:
+                for channel, tag, _, payload in items:
+                    try:
+                        if isinstance(payload, dict):
+                            claimed.extend(self._store(conn, [payload], []))
+                        else:
+                            claimed.extend(self._store(conn, [], payload))
+                    except Exception as e:
+                        print(f"[coordinator] flush error: {e!r} delivery={tag}")
+                        failed.add((channel.channel_number, tag))
+                    done += 1
+        except Exception as e:
+            print(f"[coordinator] flush error: {e!r}")
+            # committed deliveries keep their claims; the rest is redelivered
+            failed |= {(channel.channel_number, tag) for channel, tag, _, _ in items[done:]}
+        return claimed, failed
+
+    def _settle(self, items, failed):
+        by_channel = {}
+        for channel, tag, queue_name, _ in items:
+            by_channel.setdefault(channel.channel_number, (channel, queue_name, []))[2].append(tag)
+        for number, (channel, queue_name, tags) in by_channel.items():
+            # failures first so the cumulative ack below never covers them
+            bad = sorted(tag for tag in tags if (number, tag) in failed)
+            for tag in bad:
+                channel.basic_nack(tag, requeue=True)
+            NACKS_TOTAL.labels(queue=queue_name, requeue="true").inc(len(bad))
+            ok = [tag for tag in tags if (number, tag) not in failed]
+            if ok:
+                channel.basic_ack(max(ok), multiple=True)
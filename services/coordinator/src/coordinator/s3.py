@@ -1,15 +1,51 @@
-import boto3
 import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from common.metrics import instrument_s3
+
+# DeleteObjects accepts at most 1000 keys per request
+MAX_DELETE_KEYS = 1000
+
+_s3 = None
+_s3_lock = threading.Lock()
+
 
 def get_s3():
-    return boto3.client(
-        "s3",
-        endpoint_url=os.getenv("S3_ENDPOINT"),
-        aws_access_key_id=os.getenv("S3_ACCESS_KEY"),
-        aws_secret_access_key=os.getenv("S3_SECRET_KEY"),
-        region_name="us-east-1",
-    )
+    # boto3 clients are thread-safe; build one per process and reuse its
+    # connection pool instead of paying for a new client per call
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            _s3 = instrument_s3(boto3.client(
+                "s3",
+                endpoint_url=os.getenv("S3_ENDPOINT"),
+                aws_access_key_id=os.getenv("S3_ACCESS_KEY"),
+                aws_secret_access_key=os.getenv("S3_SECRET_KEY"),
+                region_name="us-east-1",
+                config=Config(max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "10"))),
+            ))
+        return _s3
+
 
 def delete_object(bucket: str, key: str):
     s3 = get_s3()
     s3.delete_object(Bucket=bucket, Key=key)
+
+
+def delete_objects(bucket: str, keys: list[str]) -> dict[str, str]:
+    # Multi-key delete; returns {key: error code} for the keys that failed.
+    # Missing keys count as deleted (S3 reports them as deleted too).
+    if len(keys) > MAX_DELETE_KEYS:
+        raise ValueError(f"at most {MAX_DELETE_KEYS} keys per request, got {len(keys)}")
+    resp = get_s3().delete_objects(
+        Bucket=bucket,
+        Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+    )
+    return {
+        e["Key"]: e.get("Code", "Unknown")
+        for e in resp.get("Errors", [])
+        if e.get("Code") not in ("NoSuchKey", "NotFound")
+    }
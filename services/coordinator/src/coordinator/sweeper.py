@@ -0,0 +1,271 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from psycopg.types.json import Jsonb
+
+from common.metrics import DELETIONS_TOTAL
+from coordinator.db import execute, get_conn
+from coordinator.s3 import MAX_DELETE_KEYS, delete_objects, get_s3
+
+# S3 reconciliation sweeper.
+#
+# Lists the bucket page by page (ListObjectsV2, at most 1000 keys per page),
+# joins each page against objects/packs in one query and deletes, in one
+# DeleteObjects request per page:
+#   - orphans: keys no objects/packs row knows about (the pointer never
+#     reached the coordinator, or its row was already purged), once older than
+#     the grace period
+#   - leaked objects: claimed (deleted_at) objects/packs that still exist,
+#     i.e. the S3 delete was recorded but did not happen, or the claim is
+#     older than the grace period and the deleter never completed it
+# Memory stays bounded by one page. After every page the last key is stored
+# in sweep_checkpoints; an interrupted sweep resumes after it.
+#
+# The grace period must exceed the longest time a pointer can take from
+# upload to the coordinator, otherwise live objects are deleted as orphans.
+
+# One state per listed key
+STATE_SQL = """
+SELECT p.object_key,
+    CASE
+        WHEN pk.pack_id IS NOT NULL THEN
+            CASE
+                WHEN pk.deleted_at IS NULL THEN 'live'
+                WHEN pk.s3_deleted_at IS NOT NULL OR pk.deleted_at < %(cutoff)s THEN 'leaked'
+                ELSE 'deleting'
+            END
+        WHEN o.n > 0 THEN
+            CASE
+                WHEN o.live THEN 'live'
+                WHEN o.recorded OR o.claimed_at < %(cutoff)s THEN 'leaked'
+                ELSE 'deleting'
+            END
+        ELSE 'orphan'
+    END AS state
+FROM unnest(%(keys)s::text[]) AS p(object_key)
+LEFT JOIN packs pk ON pk.bucket = %(bucket)s AND pk.object_key = p.object_key
+LEFT JOIN LATERAL (
+    -- pack members share the pack's key; the packs row decides for them
+    SELECT COUNT(*) AS n,
+        bool_or(deleted_at IS NULL) AS live,
+        bool_and(s3_deleted_at IS NOT NULL) AS recorded,
+        MAX(deleted_at) AS claimed_at
+    FROM objects
+    WHERE bucket = %(bucket)s
+    AND object_key = p.object_key
+    AND pack_id IS NULL
+) o ON TRUE
+"""
+
+# Deleted leaked objects: record the outcome the deleter never recorded
+RECORD_SQL = """
+WITH objs AS (
+    UPDATE objects
+    SET s3_deleted_at = NOW(),
+        delete_attempts = delete_attempts + 1
+    WHERE bucket = %(bucket)s
+    AND object_key = ANY(%(keys)s::text[])
+    AND pack_id IS NULL
+    AND deleted_at IS NOT NULL
+    AND s3_deleted_at IS NULL
+),
+pks AS (
+    UPDATE packs
+    SET s3_deleted_at = NOW(),
+        delete_attempts = delete_attempts + 1
+    WHERE bucket = %(bucket)s
+    AND object_key = ANY(%(keys)s::text[])
+    AND deleted_at IS NOT NULL
+    AND s3_deleted_at IS NULL
+    RETURNING pack_id
+)
+UPDATE objects
+SET s3_deleted_at = NOW()
+WHERE pack_id IN (SELECT pack_id FROM pks)
+AND s3_deleted_at IS NULL
+"""
+
+STATS = ("listed", "excluded", "live", "deleting", "young", "orphan", "leaked", "deleted", "failed")
+
+
+def load_checkpoint(conn, bucket: str, prefix: str):
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "load_checkpoint",
+            "SELECT last_key, started_at, stats FROM sweep_checkpoints WHERE bucket = %s AND prefix = %s",
+            (bucket, prefix),
+        )
+        return cur.fetchone()
+
+
+def save_checkpoint(conn, bucket: str, prefix: str, last_key: str, started_at: datetime, stats: dict):
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "save_checkpoint",
+            """
+            INSERT INTO sweep_checkpoints (bucket, prefix, last_key, started_at, updated_at, stats)
+            VALUES (%s, %s, %s, %s, NOW(), %s)
+            ON CONFLICT (bucket, prefix) DO UPDATE
+            SET last_key = EXCLUDED.last_key,
+                updated_at = NOW(),
+                stats = EXCLUDED.stats
+            """,
+            (bucket, prefix, last_key, started_at, Jsonb(stats)),
+        )
+
+
+def clear_checkpoint(conn, bucket: str, prefix: str):
+    with conn.cursor() as cur:
+        execute(
+            cur,
+            "clear_checkpoint",
+            "DELETE FROM sweep_checkpoints WHERE bucket = %s AND prefix = %s",
+            (bucket, prefix),
+        )
+
+
+# Yields (last key, [(key, last modified), ...]) per ListObjectsV2 page,
+# starting after start_after
+def list_pages(bucket: str, prefix: str, start_after: str | None, page_size: int):
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "PaginationConfig": {"PageSize": page_size}}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    for page in get_s3().get_paginator("list_objects_v2").paginate(**kwargs):
+        contents = page.get("Contents", [])
+        if contents:
+            yield contents[-1]["Key"], [(o["Key"], o["LastModified"]) for o in contents]
+
+
+def key_states(conn, bucket: str, keys: list[str], cutoff: datetime) -> dict[str, str]:
+    with conn.cursor() as cur:
+        execute(cur, "sweep_states", STATE_SQL, {"bucket": bucket, "keys": keys, "cutoff": cutoff})
+        return dict(cur.fetchall())
+
+
+# Classifies and (unless dry_run) deletes one page; updates stats in place
+def sweep_page(conn, bucket: str, page, cutoff: datetime, exclude: tuple[str, ...], stats: dict, dry_run: bool):
+    stats["listed"] += len(page)
+    listed = []
+    for key, modified in page:
+        if key.startswith(exclude):
+            stats["excluded"] += 1
+        else:
+            listed.append((key, modified))
+    if not listed:
+        return
+
+    states = key_states(conn, bucket, [key for key, _ in listed], cutoff)
+    doomed = {}
+    for key, modified in listed:
+        state = states[key]
+        if state == "orphan" and modified >= cutoff:
+            # may still be on its way to the coordinator
+            state = "young"
+        stats[state] += 1
+        if state in ("orphan", "leaked"):
+            doomed[key] = state
+    if not doomed or dry_run:
+        return
+
+    try:
+        errors = delete_objects(bucket, list(doomed))
+    except Exception as e:
+        errors = {k: repr(e) for k in doomed}
+    for key, state in doomed.items():
+        result = "failed" if key in errors else "deleted"
+        stats[result] += 1
+        DELETIONS_TOTAL.labels(kind=state, result=result).inc()
+    for key, code in list(errors.items())[:5]:
+        print(f"[sweeper] S3 delete failed: {bucket}/{key} {code}")
+
+    leaked = [k for k, state in doomed.items() if state == "leaked" and k not in errors]
+    if leaked:
+        with conn.cursor() as cur:
+            execute(cur, "sweep_record", RECORD_SQL, {"bucket": bucket, "keys": leaked})
+
+
+def sweep(conn, bucket: str, prefix: str = "", grace: timedelta = timedelta(hours=24),
+          exclude: tuple[str, ...] = (), page_size: int = MAX_DELETE_KEYS, dry_run: bool = False,
+          restart: bool = False, progress_every: int = 100) -> dict:
+    page_size = max(1, min(page_size, MAX_DELETE_KEYS))
+    # S3 LastModified and claims are compared with the same cutoff
+    cutoff = datetime.now(timezone.utc) - grace
+
+    # dry runs neither resume nor write checkpoints
+    checkpoint = None
+    if not dry_run:
+        if restart:
+            clear_checkpoint(conn, bucket, prefix)
+        else:
+            checkpoint = load_checkpoint(conn, bucket, prefix)
+    if checkpoint:
+        start_after, started_at, saved = checkpoint
+        stats = {name: saved.get(name, 0) for name in STATS}
+        print(f"[sweeper] resuming s3://{bucket}/{prefix} after {start_after!r} (sweep started {started_at})")
+    else:
+        start_after, started_at = None, datetime.now(timezone.utc)
+        stats = dict.fromkeys(STATS, 0)
+
+    for n, (last_key, page) in enumerate(list_pages(bucket, prefix, start_after, page_size), 1):
+        sweep_page(conn, bucket, page, cutoff, exclude, stats, dry_run)
+        if not dry_run:
+            save_checkpoint(conn, bucket, prefix, last_key, started_at, stats)
+        if progress_every and n % progress_every == 0:
+            print(f"[sweeper] {report(stats)} (at {last_key!r})")
+
+    if not dry_run:
+        clear_checkpoint(conn, bucket, prefix)
+    return stats
+
+
+def report(stats: dict) -> str:
+    return " ".join(f"{name}={stats[name]}" for name in STATS)
+
+
+def main():
+    archive_bucket = os.getenv("ARCHIVE_BUCKET") or None
+    archive_prefix = os.getenv("ARCHIVE_PREFIX", "archive")
+    p = argparse.ArgumentParser(description="Delete orphaned and leaked S3 objects.")
+    p.add_argument("--bucket", default=os.getenv("MINIO_BUCKET", "1c-exchange"))
+    p.add_argument("--prefix", default="", help="Only sweep keys under this prefix")
+    p.add_argument("--exclude-prefix", action="append", default=[],
+                   help="Never touch keys under this prefix (repeatable; the partition archive "
+                        "prefix is excluded when ARCHIVE_BUCKET is the swept bucket)")
+    p.add_argument("--grace-hours", type=float, default=float(os.getenv("SWEEP_GRACE_HOURS", "24")),
+                   help="Only delete orphans / stuck claims older than this")
+    p.add_argument("--page-size", type=int, default=MAX_DELETE_KEYS)
+    p.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    p.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first key")
+    p.add_argument("--every", type=float, default=0, help="Repeat every N seconds (0 = run once)")
+    args = p.parse_args()
+
+    exclude = list(args.exclude_prefix)
+    if archive_bucket == args.bucket:
+        exclude.append(f"{archive_prefix}/")
+
+    while True:
+        t0 = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                conn.autocommit = True
+                stats = sweep(conn, args.bucket, args.prefix, timedelta(hours=args.grace_hours), tuple(exclude),
+                              args.page_size, args.dry_run, args.restart)
+            mode = " (dry run)" if args.dry_run else ""
+            print(f"[sweeper] done{mode} in {time.perf_counter() - t0:.1f}s: {report(stats)}")
+        except Exception as e:
+            if not args.every:
+                raise
+            print(f"[sweeper] error: {e!r}")
+        if not args.every:
+            return
+        # only the first pass may restart; later passes resume as usual
+        args.restart = False
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
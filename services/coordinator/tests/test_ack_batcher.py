@@ -0,0 +1,87 @@
+import contextlib
+
+import pytest
+
+from coordinator import acks
+from coordinator.acks import AckBatcher
+
+
+class Channel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, tag, multiple=False):
+        self.calls.append(("ack", tag, multiple))
+
+    def basic_nack(self, tag, requeue=True):
+        self.calls.append(("nack", tag, requeue))
+
+
+class Connection:
+    def call_later(self, delay, callback):
+        return object()
+
+    def remove_timeout(self, timer):
+        pass
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    monkeypatch.setattr(acks, "get_conn", lambda: contextlib.nullcontext(_Conn()))
+    monkeypatch.setattr(acks.time, "sleep", lambda s: None)
+    claimed = []
+    b = AckBatcher(Connection(), Channel(), batch_size=100, flush_interval=1.0, delete_claimed=claimed.extend)
+    b.claimed = claimed
+    return b
+
+
+class _Conn:
+    def transaction(self):
+        return contextlib.nullcontext()
+
+
+def ack(pointer_id):
+    return (pointer_id, "branch1", "2026-10-17T00:00:00+00:00")
+
+
+def test_whole_batch_ok_is_one_cumulative_ack(batcher, monkeypatch):
+    monkeypatch.setattr(acks, "store_acks", lambda conn, items: ({a[0]: (1, 1) for a in items}, [a[0] for a in items]))
+    for tag in (1, 2, 3):
+        batcher.add(tag, [ack(f"p{tag}")])
+    batcher.flush()
+    assert batcher.channel.calls == [("ack", 3, True)]
+    assert batcher.claimed == ["p1", "p2", "p3"]
+
+
+def test_failed_deliveries_are_nacked_before_the_cumulative_ack(batcher, monkeypatch):
+    def store(conn, items):
+        if len(items) > 1 or items[0][0] == "p2":
+            raise RuntimeError("boom")
+        return {items[0][0]: (1, 1)}, [items[0][0]]
+
+    monkeypatch.setattr(acks, "store_acks", store)
+    for tag in (1, 2, 3):
+        batcher.add(tag, [ack(f"p{tag}")])
+    batcher.flush()
+    # the nack must come first: a cumulative ack of 3 would also settle 2
+    assert batcher.channel.calls == [("nack", 2, True), ("ack", 3, True)]
+    assert batcher.claimed == ["p1", "p3"]
+
+
+def test_only_failures_means_no_ack(batcher, monkeypatch):
+    def store(conn, items):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(acks, "store_acks", store)
+    batcher.add(7, [ack("p7")])
+    batcher.flush()
+    assert batcher.channel.calls == [("nack", 7, True)]
+
+
+def test_flush_at_batch_size(batcher, monkeypatch):
+    monkeypatch.setattr(acks, "store_acks", lambda conn, items: ({}, []))
+    batcher.batch_size = 2
+    batcher.add(1, [ack("a")])
+    assert batcher.channel.calls == []
+    batcher.add(2, [ack("b")])
+    assert batcher.channel.calls == [("ack", 2, True)]
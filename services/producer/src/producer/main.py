@@ -1,14 +1,27 @@
 import argparse
-import gzip
+import base64
 import json
+import multiprocessing
 import os
 import time
 import uuid
 import hashlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 
 import boto3
-import pika
+from botocore.config import Config
+
+from common.codecs import CODECS, choose_codec, get_codec, pointer_fields
+from common.metrics import CODEC_SECONDS, SHA256_SECONDS, instrument_s3, start_metrics_server
+from common.schemas import SCHEMA_INLINE, SCHEMA_POINTER
+from common.wire import check_format
+from producer.packing import upload_pack
+from producer.payload import build_payload_fast, generate_payload
+from producer.publisher import PointerPublisher
+from producer.ratecontrol import RateController
+from producer.registry import RecipientRegistry
+from producer.streaming import DEFAULT_PART_SIZE, stream_upload
 
 
 def parse_size(s: str) -> int:
@@ -57,46 +70,200 @@ def build_payload_approx(target_bytes: int, idx: int) -> dict:
     return base
 
 
-def make_s3_client(endpoint: str, access: str, secret: str, region: str):
-    return boto3.client(
+def make_s3_client(endpoint: str, access: str, secret: str, region: str, max_pool_connections: int = 10):
+    return instrument_s3(boto3.client(
         "s3",
         endpoint_url=endpoint,
         aws_access_key_id=access,
         aws_secret_access_key=secret,
         region_name=region,
+        config=Config(max_pool_connections=max_pool_connections),
+    ))
+
+
+# Codec for one message: "auto" picks by raw size (levels then use the codec's
+# default), anything else is a name from common.codecs.
+def select_codec(name: str, size_raw: int, level: int | None = None, zstd_dict: str | None = None):
+    if name == "auto":
+        name, level = choose_codec(size_raw), None
+    return get_codec(name, level, zstd_dict if name == "zstd" else None)
+
+
+# CPU stage: build, serialize, compress, hash. Runs in a worker process in
+# pipelined mode, so it only takes and returns picklable values. Returns
+# (pointer_id, size_raw, encoded bytes, sha256, pointer encoding fields,
+# (compress seconds, sha256 seconds)); the timings are recorded by the
+# parent with record_encode, since worker processes are not scraped.
+def encode_message(target: int, idx: int, generator: str = "fast", codec: str = "gzip",
+                   level: int | None = None, zstd_dict: str | None = None):
+    if generator == "fast":
+        pointer_id, raw = build_payload_fast(target, idx)
+    else:
+        payload = build_payload_approx(target, idx)
+        pointer_id = payload["id"]
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    c = select_codec(codec, len(raw), level, zstd_dict)
+    t0 = time.perf_counter()
+    data = c.compress(raw)
+    t1 = time.perf_counter()
+    digest = sha256_bytes(data)
+    t2 = time.perf_counter()
+    return pointer_id, len(raw), data, digest, pointer_fields(c), (t1 - t0, t2 - t1)
+
+
+def record_encode(encoded):
+    compress_s, sha256_s = encoded[5]
+    CODEC_SECONDS.labels(op="compress", encoding=encoded[4]["encoding"]).observe(compress_s)
+    SHA256_SECONDS.observe(sha256_s)
+
+
+# I/O stage: upload (and optionally verify) one encoded message, return its pointer.
+def upload_message(s3, bucket: str, prefix: str, recipients_total: int, encoded, verify: bool = False) -> dict:
+    pointer_id, size_raw, data, digest, fields, _ = encoded
+    now = datetime.now(timezone.utc)
+    key = f"{prefix}/{now:%Y/%m/%d}/{pointer_id}.json.{CODECS[fields['encoding']].extension}"
+
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=data,
+        ContentType="application/json",
+        ContentEncoding=fields["encoding"],
+        Metadata={"sha256": digest, "created_at": now.isoformat()},
     )
 
+    if verify:
+        verify_object(s3, bucket, key, digest)
+
+    return make_pointer(pointer_id, bucket, key, size_raw, len(data), digest, recipients_total, now, fields)
+
+
+# Inline path: payloads below --inline-threshold travel inside the AMQP
+# message, skipping the S3 PUT/GET/DELETE and the coordinator's refcount.
+def make_inline(encoded) -> dict:
+    pointer_id, size_raw, data, digest, fields, _ = encoded
+    return {
+        "schema": SCHEMA_INLINE,
+        "pointer_id": pointer_id,
+        **fields,
+        "content_type": "application/json",
+        "size_raw": size_raw,
+        "size_gz": len(data),
+        "sha256": digest,
+        "payload": base64.b64encode(data).decode("ascii"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
 
-def rmq_publish_pointer(pointer: dict, exchange: str, routing_key: str, queue_name: str):
-    amqp_url = os.getenv("AMQP_URL")
-    if not amqp_url:
-        return False
-
-    params = pika.URLParameters(amqp_url)
-    conn = pika.BlockingConnection(params)
-    ch = conn.channel()
-
-    # idempotent topology (demo-friendly)
-    ch.exchange_declare(exchange=exchange, exchange_type="direct", durable=True)
-    ch.queue_declare(
-        queue=queue_name, 
-        durable=True,
-        arguments={
-        "x-queue-type": "quorum"
-        }
-    )
-    ch.queue_bind(queue=queue_name, exchange=exchange, routing_key=routing_key)
-
-    body = json.dumps(pointer, ensure_ascii=False).encode("utf-8")
-    props = pika.BasicProperties(
-        content_type="application/json",
-        delivery_mode=2,  # persistent
-        message_id=pointer.get("pointer_id"),
-        timestamp=int(time.time()),
+
+def is_inline(encoded, inline_threshold: int) -> bool:
+    return len(encoded[2]) < inline_threshold
+
+
+# Streaming path: generate, compress, hash and upload chunk by chunk
+# (multipart for large objects), never holding the whole payload.
+def stream_message(s3, bucket: str, prefix: str, recipients_total: int, target: int, idx: int, args) -> dict:
+    pointer_id, chunks = generate_payload(target, idx)
+    codec = select_codec(args.codec, target, args.codec_level, args.zstd_dict)
+    now = datetime.now(timezone.utc)
+    key = f"{prefix}/{now:%Y/%m/%d}/{pointer_id}.json.{codec.extension}"
+
+    # sha256 is only known once the upload is done; it travels in the pointer
+    size_raw, size_gz, digest = stream_upload(
+        s3,
+        bucket,
+        key,
+        chunks,
+        part_size=args.part_size,
+        concurrency=args.part_concurrency,
+        metadata={"created_at": now.isoformat()},
+        codec=codec,
     )
-    ch.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=props)
-    conn.close()
-    return True
+
+    if args.verify:
+        verify_object(s3, bucket, key, digest)
+
+    return make_pointer(pointer_id, bucket, key, size_raw, size_gz, digest, recipients_total, now, pointer_fields(codec))
+
+
+def verify_object(s3, bucket: str, key: str, digest: str):
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    h = hashlib.sha256()
+    for chunk in obj["Body"].iter_chunks(1024 * 1024):
+        h.update(chunk)
+    if h.hexdigest() != digest:
+        raise RuntimeError(f"SHA mismatch for {key}")
+
+
+def make_pointer(pointer_id: str, bucket: str, key: str, size_raw: int, size_gz: int, digest: str,
+                 recipients_total: int, now: datetime, fields: dict) -> dict:
+    return {
+        "schema": SCHEMA_POINTER,
+        "pointer_id": pointer_id,
+        "bucket": bucket,
+        "key": key,
+        **fields,
+        "content_type": "application/json",
+        "size_raw": size_raw,
+        "size_gz": size_gz,
+        "sha256": digest,
+        "recipients_total": recipients_total,
+        "created_at": now.isoformat(),
+    }
+
+
+# Pipelined mode: encode in a process pool, upload in a thread pool sharing one
+# S3 client, hand pointers to `on_uploaded` on this thread in upload completion
+# order. At most `inflight` messages exist between encode start and upload end
+# (plus up to `pack` encoded messages waiting for their pack to fill).
+# Encodes are only started as fast as `rate` allows.
+def run_pipelined(args, target: int, s3, bucket: str, recipients_total: int, on_uploaded, on_packed, poll, rate):
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx) as cpu, \
+            ThreadPoolExecutor(max_workers=args.workers) as io:
+        stages = {}
+        pending = []
+        next_idx = 1
+
+        while next_idx <= args.count or stages or pending:
+            while next_idx <= args.count and len(stages) < args.inflight and rate.take():
+                encode = cpu.submit(encode_message, target, next_idx, args.generator,
+                                    args.codec, args.codec_level, args.zstd_dict)
+                stages[encode] = "encode"
+                next_idx += 1
+
+            # held back by the rate limit: come back when the next slot is due
+            held = next_idx <= args.count and len(stages) < args.inflight
+            timeout = rate.delay() if held else 1.0
+            if stages:
+                done, _ = wait(list(stages), timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                if held:
+                    time.sleep(timeout)
+            for f in done:
+                stage = stages.pop(f)
+                if stage == "encode":
+                    record_encode(f.result())
+                if stage == "encode" and is_inline(f.result(), args.inline_threshold):
+                    on_uploaded(make_inline(f.result()))
+                elif stage == "encode" and args.pack > 1:
+                    pending.append(f.result())
+                elif stage == "encode":
+                    upload = io.submit(upload_message, s3, bucket, args.prefix, recipients_total, f.result(), args.verify)
+                    stages[upload] = "upload"
+                elif stage == "pack":
+                    on_packed(f.result())
+                else:
+                    on_uploaded(f.result())
+
+            # Ship a pack once full, or whatever is left after the last encode
+            encoding = any(stage == "encode" for stage in stages.values())
+            if pending and (len(pending) >= args.pack or (next_idx > args.count and not encoding)):
+                upload = io.submit(upload_pack, s3, bucket, args.prefix, recipients_total, pending[:args.pack], args.verify)
+                stages[upload] = "pack"
+                del pending[:args.pack]
+
+            poll()
 
 
 def main():
@@ -106,7 +273,50 @@ def main():
     p.add_argument("--prefix", default="demo")
     p.add_argument("--verify", action="store_true")
     p.add_argument("--delete", action="store_true")
+    p.add_argument("--generator", choices=("fast", "approx"), default="fast",
+                   help="Payload generator: bulk random bytes (fast) or per-character (approx)")
+    p.add_argument("--confirm-batch", type=int, default=100,
+                   help="Pointers published before waiting for publisher confirms")
+    p.add_argument("--workers", type=int, default=0,
+                   help="Pipelined mode: encode processes and upload threads (0 = serial)")
+    p.add_argument("--inflight", type=int, default=0,
+                   help="Max messages between encode and upload in pipelined mode (default 2 x workers)")
+    p.add_argument("--stream", action="store_true",
+                   help="Constant-memory path: streaming compression + sha256 into a multipart upload")
+    p.add_argument("--part-size", default=str(DEFAULT_PART_SIZE),
+                   help="Multipart part size for --stream, e.g. 8MB (min 5MB)")
+    p.add_argument("--part-concurrency", type=int, default=4,
+                   help="Parts uploaded in parallel for --stream")
+    p.add_argument("--inline-threshold", default="0",
+                   help="Embed payloads whose compressed size is below this (e.g. 64KB) in the AMQP message")
+    p.add_argument("--pack", type=int, default=0,
+                   help="Concatenate this many encoded payloads into one S3 object (s3-pointer-v2; 0/1 = off)")
+    p.add_argument("--codec", choices=(*CODECS, "auto"), default="gzip",
+                   help="Payload compression; auto = by size (lz4 for huge, zstd if installed, else gzip)")
+    p.add_argument("--codec-level", type=int, default=None, help="Compression level (codec default if unset)")
+    p.add_argument("--zstd-dict", default=None, help="Trained zstd dictionary file (consumers need the same file)")
+    p.add_argument("--rate", type=float, default=0.0,
+                   help="Start at most this many messages per second (0 = unlimited); "
+                        "with --adaptive the starting rate (default 10)")
+    p.add_argument("--adaptive", action="store_true",
+                   help="AIMD rate control from recipient queue depth and publisher confirm latency")
+    p.add_argument("--max-queue-depth", type=int, default=1000,
+                   help="--adaptive: back off while the fullest recipient queue holds more ready messages")
+    p.add_argument("--max-confirm-ms", type=float, default=1000.0,
+                   help="--adaptive: back off while p95 publish-to-confirm latency is above this")
+    p.add_argument("--min-rate", type=float, default=1.0, help="--adaptive: lower bound, msg/s")
+    p.add_argument("--max-rate", type=float, default=1000.0, help="--adaptive: upper bound, msg/s")
+    p.add_argument("--rate-step", type=float, default=5.0, help="--adaptive: additive increase per interval, msg/s")
+    p.add_argument("--rate-interval", type=float, default=1.0, help="--adaptive: seconds between samples")
     args = p.parse_args()
+    args.part_size = parse_size(args.part_size)
+    args.inline_threshold = parse_size(args.inline_threshold)
+    if args.stream and args.workers > 0:
+        p.error("--stream and --workers are mutually exclusive")
+    if args.stream and args.pack > 1:
+        p.error("--stream and --pack are mutually exclusive")
+    if args.inflight <= 0:
+        args.inflight = max(1, 2 * args.workers)
 
     endpoint = os.getenv("MINIO_ENDPOINT", "http://minio:9000")
     access = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
@@ -114,78 +324,160 @@ def main():
     bucket = os.getenv("MINIO_BUCKET", "1c-exchange")
     region = os.getenv("MINIO_REGION", "us-east-1")
     recipients_total = int(os.getenv("RECIPIENTS_TOTAL", "1"))
+    # RECIPIENT_REGISTRY=1: recipients come from the registry in DB_DSN
+    # (reloaded every RECIPIENTS_REFRESH_S) instead of RECIPIENTS_TOTAL/RMQ_QUEUE
+    registry = None
+    if os.getenv("RECIPIENT_REGISTRY", "0") == "1":
+        registry = RecipientRegistry(os.environ["DB_DSN"], float(os.getenv("RECIPIENTS_REFRESH_S", "30")))
+        registry.refresh()
+        recipients_total = registry.total
+    # /metrics while the job runs (0 disables)
+    start_metrics_server(int(os.getenv("METRICS_PORT", "9100")))
 
     exchange = os.getenv("RMQ_EXCHANGE", "ex.msg")
     routing_key = os.getenv("RMQ_ROUTING_KEY", "branch1")
     queue_name = os.getenv("RMQ_QUEUE", "q.branch1")
+    # SHARDS > 1: route pointers to coordinator shards by pointer_id
+    shards = int(os.getenv("SHARDS", "1"))
+    # Pointer encoding on the wire: json | msgpack (compact typed records)
+    wire_format = os.getenv("WIRE_FORMAT", "json")
+    check_format(wire_format)
 
-    s3 = make_s3_client(endpoint, access, secret, region)
+    s3 = make_s3_client(endpoint, access, secret, region,
+                        max_pool_connections=max(10, args.workers, args.part_concurrency))
+
+    # publish pointers to RMQ if configured
+    publisher = None
+    amqp_url = os.getenv("AMQP_URL")
+    if args.adaptive and not amqp_url:
+        p.error("--adaptive needs AMQP_URL (queue depth and confirms come from the broker)")
+    rate = RateController(
+        args.rate or (10.0 if args.adaptive else 0.0),
+        adaptive=args.adaptive,
+        max_depth=args.max_queue_depth,
+        max_confirm=args.max_confirm_ms / 1000,
+        min_rate=args.min_rate,
+        max_rate=args.max_rate,
+        step=args.rate_step,
+        interval=args.rate_interval,
+    )
+    if amqp_url:
+        publisher = PointerPublisher(
+            amqp_url, exchange, routing_key, queue_name if registry is None else None,
+            confirm_batch=args.confirm_batch, shards=shards, wire_format=wire_format
+        )
+        publisher.connect()
+        if registry is not None:
+            publisher.bind_queues(registry.queues())
+            publisher.unbind_queues(registry.stale_queues())
 
     target = parse_size(args.msg_size)
     t0 = time.time()
 
-    pointers = []
+    # Only counters and the first pointer are kept for the summary: inline
+    # pointers carry their whole payload
+    first = None
+    uploaded = inline = packs = 0
     published = 0
 
-    for i in range(1, args.count + 1):
-        payload = build_payload_approx(target, i)
-        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-        gz = gzip.compress(raw)
-
-        pointer_id = payload["id"]
-        now = datetime.now(timezone.utc)
-        key = f"{args.prefix}/{now:%Y/%m/%d}/{pointer_id}.json.gz"
-        digest = sha256_bytes(gz)
-
-        s3.put_object(
-            Bucket=bucket,
-            Key=key,
-            Body=gz,
-            ContentType="application/json",
-            ContentEncoding="gzip",
-            Metadata={"sha256": digest, "created_at": now.isoformat()},
-        )
-
-        pointer = {
-            "schema": "s3-pointer-v1",
-            "pointer_id": pointer_id,
-            "bucket": bucket,
-            "key": key,
-            "encoding": "gzip",
-            "content_type": "application/json",
-            "size_raw": len(raw),
-            "size_gz": len(gz),
-            "sha256": digest,
-            "recipients_total": recipients_total,
-            "created_at": now.isoformat(),
-        }
-        pointers.append(pointer)
-
-        if args.verify:
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            data = obj["Body"].read()
-            if sha256_bytes(data) != digest:
-                raise RuntimeError(f"SHA mismatch for {key}")
-
-        # publish pointer to RMQ if configured
-        if rmq_publish_pointer(pointer, exchange, routing_key, queue_name):
+    def on_uploaded(pointer: dict):
+        nonlocal first, uploaded, inline, published
+        first = first or pointer
+        uploaded += 1
+        if pointer["schema"] == SCHEMA_INLINE:
+            inline += 1
+
+        if publisher is not None:
+            # counted against the queues bound right now
+            if registry is not None and "recipients_total" in pointer:
+                pointer["recipients_total"] = registry.total
+            publisher.publish(pointer)
             published += 1
 
-        if args.delete:
-            s3.delete_object(Bucket=bucket, Key=key)
+        if args.delete and pointer["schema"] == SCHEMA_POINTER:
+            s3.delete_object(Bucket=pointer["bucket"], Key=pointer["key"])
 
-        if i % 10 == 0 or i == args.count:
+        if uploaded % 10 == 0 or uploaded == args.count:
             elapsed = time.time() - t0
-            print(f"[{i}/{args.count}] uploaded, published={published}, elapsed={elapsed:.1f}s")
+            print(f"[{uploaded}/{args.count}] uploaded, published={published}, elapsed={elapsed:.1f}s")
+
+    def on_packed(pack_pointers: list[dict]):
+        nonlocal packs
+        packs += 1
+        for pointer in pack_pointers:
+            on_uploaded(pointer)
+        if args.delete:
+            s3.delete_object(Bucket=pack_pointers[0]["bucket"], Key=pack_pointers[0]["key"])
+
+    def poll():
+        if publisher is None:
+            return
+        if registry is not None and registry.due():
+            if registry.refresh():
+                publisher.bind_queues(registry.queues())
+            # also undoes the binding of a deactivated consumer that restarted
+            publisher.unbind_queues(registry.stale_queues())
+        # read pending confirms before sampling their latency
+        publisher.poll()
+        if rate.due():
+            queues = registry.queues() if registry is not None else [queue_name]
+            rate.update(publisher.queue_depth(queues), publisher.recent_confirm_latency())
+
+    # Waits for the next slot of the rate limit, keeping confirms, heartbeats
+    # and rate samples flowing meanwhile
+    def pace():
+        while not rate.take():
+            time.sleep(min(rate.delay(), 0.05))
+            poll()
+
+    if args.workers > 0:
+        run_pipelined(args, target, s3, bucket, recipients_total, on_uploaded, on_packed, poll, rate)
+    elif args.stream:
+        for i in range(1, args.count + 1):
+            pace()
+            on_uploaded(stream_message(s3, bucket, args.prefix, recipients_total, target, i, args))
+            poll()
+    else:
+        pending = []
+        for i in range(1, args.count + 1):
+            pace()
+            encoded = encode_message(target, i, args.generator, args.codec, args.codec_level, args.zstd_dict)
+            record_encode(encoded)
+            if is_inline(encoded, args.inline_threshold):
+                on_uploaded(make_inline(encoded))
+            elif args.pack > 1:
+                pending.append(encoded)
+                if len(pending) == args.pack:
+                    on_packed(upload_pack(s3, bucket, args.prefix, recipients_total, pending, args.verify))
+                    pending = []
+            else:
+                on_uploaded(upload_message(s3, bucket, args.prefix, recipients_total, encoded, args.verify))
+            poll()
+        if pending:
+            on_packed(upload_pack(s3, bucket, args.prefix, recipients_total, pending, args.verify))
+
+    if publisher is not None:
+        publisher.close()
 
     elapsed = time.time() - t0
     print("\n=== SUMMARY ===")
     print(f"endpoint={endpoint}")
     print(f"bucket={bucket}")
     print(f"published={published}/{args.count}")
+    if publisher is not None:
+        print(publisher.summary())
+    if rate.adaptive or rate.rate > 0:
+        print(rate.summary())
     print(f"elapsed={elapsed:.2f}s")
+    if inline:
+        print(f"inline={inline}/{args.count}")
+    if packs:
+        print(f"packs={packs}")
+    example = dict(first)
+    if "payload" in example:
+        example["payload"] = f"<{len(example['payload'])} base64 chars>"
     print("\nExample pointer:")
-    print(json.dumps(pointers[0], ensure_ascii=False, indent=2))
+    print(json.dumps(example, ensure_ascii=False, indent=2))
 
 
 if __name__ == "__main__":
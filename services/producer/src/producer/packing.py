@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import json
+import uuid
+from datetime import datetime, timezone
+
+from common.schemas import SCHEMA_PACK_INDEX, SCHEMA_POINTER_PACKED
+
+
+# Pack mode: several encoded payloads (each a complete gzip member or
+# zstd/lz4 frame) are concatenated into one S3 object, followed by a
+# gzip-compressed JSON index.
+# Every payload gets its own s3-pointer-v2 carrying the byte range
+# (offset/length) of its member, so consumers fetch only their slice with a
+# ranged GET and the coordinator deletes the pack once every member pointer
+# is fully ACKed.
+def upload_pack(s3, bucket: str, prefix: str, recipients_total: int, encoded_list, verify: bool = False) -> list[dict]:
+    pack_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    key = f"{prefix}/{now:%Y/%m/%d}/pack-{pack_id}.bin"
+
+    parts = []
+    members = []
+    offset = 0
+    for pointer_id, size_raw, data, digest, fields, _ in encoded_list:
+        parts.append(data)
+        members.append({
+            "pointer_id": pointer_id,
+            "offset": offset,
+            "length": len(data),
+            "size_raw": size_raw,
+            "sha256": digest,
+            **fields,
+        })
+        offset += len(data)
+
+    index = {
+        "schema": SCHEMA_PACK_INDEX,
+        "pack_id": pack_id,
+        "members": members,
+    }
+    parts.append(gzip.compress(json.dumps(index, ensure_ascii=False).encode("utf-8")))
+    body = b"".join(parts)
+
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        ContentType="application/octet-stream",
+        Metadata={
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "index-offset": str(offset),
+            "members": str(len(members)),
+            "created_at": now.isoformat(),
+        },
+    )
+
+    if verify:
+        for m in members:
+            obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={m['offset']}-{m['offset'] + m['length'] - 1}")
+            if hashlib.sha256(obj["Body"].read()).hexdigest() != m["sha256"]:
+                raise RuntimeError(f"SHA mismatch for {key} pointer_id={m['pointer_id']}")
+
+    return [
+        {
+            "schema": SCHEMA_POINTER_PACKED,
+            "pointer_id": m["pointer_id"],
+            "pack_id": pack_id,
+            "pack_members": len(members),
+            "bucket": bucket,
+            "key": key,
+            "offset": m["offset"],
+            "length": m["length"],
+            "encoding": m["encoding"],
+            **({"dict_id": m["dict_id"]} if "dict_id" in m else {}),
+            "content_type": "application/json",
+            "size_raw": m["size_raw"],
+            "size_gz": m["length"],
+            "sha256": m["sha256"],
+            "recipients_total": recipients_total,
+            "created_at": now.isoformat(),
+        }
+        for m in members
+    ]
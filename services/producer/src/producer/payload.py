@@ -0,0 +1,105 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # optional: os.urandom is used instead
+    np = None
+
+# Same `demo-1c-object-v1` shape as build_payload_approx, generated in bulk:
+#
+#   {"schema": "demo-1c-object-v1", "id": "...", "idx": 1, "ts": "...", "data": ["<1 KB>", ...]}
+#
+# Random bytes come from NumPy's SFC64 bit generator when NumPy is installed
+# (os.urandom otherwise) and are mapped onto the alphanumeric alphabet with one
+# bytes.translate call per block. Quotes and separators are written with
+# extended-slice assignment, so no Python-level loop runs per character or per
+# item. The JSON is emitted as encoded chunks and is exactly `target_bytes`
+# long whenever the target is at least the fixed header and footer.
+
+ALPHABET = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+_TRANSLATE = bytes(ALPHABET[b % len(ALPHABET)] for b in range(256))
+
+ITEM_SIZE = 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def _random_source():
+    if np is not None:
+        bitgen = np.random.SFC64()
+        return lambda n: bitgen.random_raw((n + 7) // 8).tobytes()[:n]
+    return os.urandom
+
+
+def rand_ascii_bytes(n: int, source=os.urandom) -> bytes:
+    return source(n).translate(_TRANSLATE)
+
+
+def _item_sizes(remaining: int):
+    # Every item but the last costs size + 4 (quotes and ", "), the last size + 2
+    if remaining < 2:
+        return []
+    k = -(-(remaining + 2) // (ITEM_SIZE + 4))
+    sizes = [ITEM_SIZE] * k
+    sizes[-1] = remaining + 2 - 4 * k - (k - 1) * ITEM_SIZE
+    if sizes[-1] < 0:
+        if k == 1:
+            return []
+        sizes[-2] += sizes[-1]
+        sizes[-1] = 0
+    return sizes
+
+
+def _full_items(count: int, source) -> bytes:
+    # `count` items of ITEM_SIZE characters, each framed as `"...", `
+    stride = ITEM_SIZE + 4
+    buf = bytearray(rand_ascii_bytes(count * stride, source))
+    buf[0::stride] = b'"' * count
+    buf[ITEM_SIZE + 1::stride] = b'"' * count
+    buf[ITEM_SIZE + 2::stride] = b"," * count
+    buf[ITEM_SIZE + 3::stride] = b" " * count
+    return bytes(buf)
+
+
+def generate_payload(target_bytes: int, idx: int, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    payload_id = str(uuid.uuid4())
+    base = {
+        "schema": "demo-1c-object-v1",
+        "id": payload_id,
+        "idx": idx,
+        "ts": datetime.now(timezone.utc).isoformat(),
+    }
+    header = json.dumps(base, ensure_ascii=False).encode("utf-8")[:-1] + b', "data": ['
+    footer = b"]}"
+    remaining = target_bytes - len(header) - len(footer)
+    sizes = _item_sizes(remaining)
+
+    def chunks():
+        source = _random_source()
+        yield header
+        if sizes:
+            # All but the last two items have the full size
+            full = max(0, len(sizes) - 2)
+            per_block = max(1, chunk_size // (ITEM_SIZE + 4))
+            for start in range(0, full, per_block):
+                yield _full_items(min(per_block, full - start), source)
+
+            tail = sizes[full:]
+            text = rand_ascii_bytes(sum(tail), source)
+            if len(tail) == 2:
+                yield b'"' + text[:tail[0]] + b'", "' + text[tail[0]:] + b'"'
+            else:
+                yield b'"' + text + b'"'
+        elif remaining > 0:
+            # one byte left, too few for an empty string item: "data": [ ]
+            yield b" " * remaining
+        yield footer
+
+    return payload_id, chunks()
+
+
+def build_payload_fast(target_bytes: int, idx: int):
+    payload_id, chunks = generate_payload(target_bytes, idx)
+    return payload_id, b"".join(chunks)
@@ -0,0 +1,264 @@
+import time
+
+import pika
+
+from common.metrics import PUBLISH_CONFIRM_SECONDS, PUBLISHED_TOTAL
+from common.sharding import shard_key, shard_names
+from common.wire import encode
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# Long-lived pointer publisher.
+#
+# One connection + channel for the whole run, topology declared once.
+# Publishes are mandatory and tracked with publisher confirms; every
+# `confirm_batch` messages (and on flush/close) we wait for the broker to
+# confirm everything outstanding. Nacked, returned (unroutable) and timed out
+# pointers are re-sent, which is safe because pointers are idempotent
+# downstream.
+class PointerPublisher:
+    def __init__(
+        self,
+        amqp_url: str,
+        exchange: str,
+        routing_key: str,
+        queue_name: str,
+        confirm_batch: int = 100,
+        confirm_timeout: float = 30.0,
+        max_attempts: int = 5,
+        shards: int = 1,
+        wire_format: str = "json",
+    ):
+        self.amqp_url = amqp_url
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.queue_name = queue_name
+        self.confirm_batch = max(1, confirm_batch)
+        self.confirm_timeout = confirm_timeout
+        self.max_attempts = max_attempts
+        self.shards = shards
+        self.wire_format = wire_format
+
+        self.connection = None
+        self.channel = None
+        # for passive declares, which close the channel on a missing queue
+        self.probe = None
+        self.seq = 0
+        # delivery tag -> (pointer, first publish time, attempts)
+        self.outstanding = {}
+        self.acked = []
+        self.resend = []
+        self.returned = set()
+
+        self.confirmed = 0
+        self.resent = 0
+        self.confirm_latencies = []
+        self.latency_mark = 0
+        # Confirms are only read while pumping the connection. Between two
+        # pumps the producer is busy encoding/uploading, which must not count
+        # as broker latency: a confirm found by a non-blocking pump is taken
+        # to have arrived right after the previous pump ended.
+        self.drained_at = 0.0
+        self.waiting = False
+
+    def connect(self):
+        self.connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+        self.channel = self.connection.channel()
+
+        # idempotent topology, declared once per run
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type="direct", durable=True)
+        if self.queue_name:
+            self.bind_queues([self.queue_name])
+
+        # Private API, on purpose: the public BlockingChannel.confirm_delivery()
+        # makes every basic_publish wait for its own confirm, with no timeout,
+        # which serializes publishes on the confirm round trip and loses the
+        # confirm window. This is the call it makes itself on the underlying
+        # pika.channel.Channel, only with our callback. pika is pinned to
+        # 1.3.2 in requirements.txt for it; check the call on any upgrade
+        # (the alternative is a SelectConnection publisher).
+        impl = getattr(self.channel, "_impl", None)
+        if not hasattr(impl, "confirm_delivery"):
+            raise RuntimeError(f"pika {pika.__version__} has no Channel.confirm_delivery behind BlockingChannel (needs 1.3.2)")
+        select_ok = []
+        impl.confirm_delivery(
+            ack_nack_callback=self._on_confirm,
+            callback=lambda _frame: select_ok.append(True),
+        )
+        while not select_ok:
+            self.connection.process_data_events(time_limit=1)
+
+        self.channel.add_on_return_callback(self._on_return)
+
+    # Every bound queue receives each pointer: one publish reaches all
+    # recipients. Sharded: pointers go out on "<routing_key>.<shard>", each
+    # branch queue gets them all.
+    def bind_queues(self, queues):
+        for queue in queues:
+            self.channel.queue_declare(
+                queue=queue,
+                durable=True,
+                arguments={
+                "x-queue-type": "quorum"
+                }
+            )
+            for key in shard_names(self.routing_key, self.shards):
+                self.channel.queue_bind(queue=queue, exchange=self.exchange, routing_key=key)
+
+    # Stops routing pointers to the given queues. A missing queue closes the
+    # channel it was unbound on, so each one gets its own.
+    def unbind_queues(self, queues):
+        for queue in queues:
+            channel = self.connection.channel()
+            try:
+                for key in shard_names(self.routing_key, self.shards):
+                    channel.queue_unbind(queue=queue, exchange=self.exchange, routing_key=key)
+            except pika.exceptions.ChannelClosedByBroker:
+                continue
+            channel.close()
+
+    # Ready messages in the fullest of `queues` (passive declare, no
+    # management API needed); None if none of them could be read.
+    def queue_depth(self, queues):
+        depth = None
+        for queue in queues:
+            if self.probe is None or not self.probe.is_open:
+                self.probe = self.connection.channel()
+            try:
+                ok = self.probe.queue_declare(queue=queue, passive=True)
+            except pika.exceptions.ChannelClosedByBroker:
+                continue
+            depth = max(depth or 0, ok.method.message_count)
+        return depth
+
+    # p95 confirm latency since the previous call, or the age of the oldest
+    # pointer still unconfirmed at the last pump if that is larger (a stalled
+    # broker sends no confirms at all); None without anything to measure.
+    # Call right after poll().
+    def recent_confirm_latency(self):
+        recent = self.confirm_latencies[self.latency_mark:]
+        self.latency_mark = len(self.confirm_latencies)
+        latency = percentile(recent, 0.95) if recent else None
+        if self.outstanding:
+            oldest = self.drained_at - min(item[1] for item in self.outstanding.values())
+            latency = max(latency or 0.0, oldest)
+        return latency
+
+    def publish(self, pointer: dict):
+        self._send(pointer, time.monotonic(), 1)
+        if len(self.outstanding) >= self.confirm_batch:
+            self.flush()
+
+    def poll(self):
+        # Keep heartbeats and confirms flowing between publishes
+        self._pump(0)
+
+    def flush(self):
+        while True:
+            deadline = time.monotonic() + self.confirm_timeout
+            while self.outstanding and time.monotonic() < deadline:
+                self._pump(0.1)
+
+            if self.outstanding:
+                print(f"[producer] {len(self.outstanding)} pointers not confirmed in {self.confirm_timeout}s (resend)")
+                PUBLISHED_TOTAL.labels(result="timeout").inc(len(self.outstanding))
+                self.resend.extend(self.outstanding.values())
+                self.outstanding.clear()
+
+            # Basic.Return always precedes the Basic.Ack of the same message
+            for item in self.acked:
+                if item[0]["pointer_id"] in self.returned:
+                    PUBLISHED_TOTAL.labels(result="returned").inc()
+                    self.resend.append(item)
+                else:
+                    PUBLISHED_TOTAL.labels(result="confirmed").inc()
+                    self.confirmed += 1
+            self.acked.clear()
+            self.returned.clear()
+
+            if not self.resend:
+                return
+
+            resend, self.resend = self.resend, []
+            for pointer, first_sent, attempts in resend:
+                if attempts >= self.max_attempts:
+                    raise RuntimeError(f"pointer {pointer['pointer_id']} not confirmed after {attempts} attempts")
+                self.resent += 1
+                self._send(pointer, first_sent, attempts + 1)
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.flush()
+        finally:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def _pump(self, time_limit: float):
+        self.waiting = time_limit > 0
+        try:
+            self.connection.process_data_events(time_limit=time_limit)
+        finally:
+            self.waiting = False
+            self.drained_at = time.monotonic()
+
+    def _send(self, pointer: dict, first_sent: float, attempts: int):
+        body, content_type = encode(pointer, self.wire_format)
+        props = pika.BasicProperties(
+            content_type=content_type,
+            delivery_mode=2,  # persistent
+            message_id=pointer.get("pointer_id"),
+            timestamp=int(time.time()),
+        )
+        self.channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=shard_key(self.routing_key, pointer["pointer_id"], self.shards),
+            body=body,
+            properties=props,
+            mandatory=True,
+        )
+        self.seq += 1
+        self.outstanding[self.seq] = (pointer, first_sent, attempts)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self.outstanding if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.outstanding else []
+
+        # arrival: exact while blocked on the socket, else the lower bound
+        now = time.monotonic()
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        for tag in tags:
+            item = self.outstanding.pop(tag)
+            if nacked:
+                PUBLISHED_TOTAL.labels(result="nacked").inc()
+                self.resend.append(item)
+            else:
+                received = now if self.waiting else max(self.drained_at, item[1])
+                self.confirm_latencies.append(received - item[1])
+                PUBLISH_CONFIRM_SECONDS.observe(received - item[1])
+                self.acked.append(item)
+
+    def _on_return(self, channel, method, properties, body):
+        self.returned.add(properties.message_id)
+
+    def summary(self) -> str:
+        lat = self.confirm_latencies
+        return (
+            f"confirmed={self.confirmed} resent={self.resent} "
+            f"confirm_latency_ms p50={percentile(lat, 0.50) * 1000:.1f} "
+            f"p95={percentile(lat, 0.95) * 1000:.1f} "
+            f"max={max(lat, default=0.0) * 1000:.1f}"
+        )
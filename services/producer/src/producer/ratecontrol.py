@@ -0,0 +1,102 @@
+import time
+
+from common.metrics import PRODUCER_RATE_LIMIT, QUEUE_DEPTH
+
+# Producer pacing.
+#
+# Messages are started no faster than `rate` per second (0 = unlimited).
+# Slots missed while the producer was busy are not made up in a burst: at
+# most one slot of credit is kept, enough to absorb loop jitter.
+#
+# Adaptive mode (AIMD) also moves the rate every `interval` seconds from two
+# samples: the depth of the fullest recipient queue (ready messages) and the
+# publish-to-confirm latency. Above either target the rate is cut by
+# BACKOFF; below both it grows by `step`, but only if the producer actually
+# kept up with the current rate (otherwise the limit is not what holds it
+# back and raising it would only build up headroom for the next burst).
+
+BACKOFF = 0.5
+# Share of the allowed messages that must have started for the rate to grow
+KEEPING_UP = 0.9
+
+
+class RateController:
+    def __init__(
+        self,
+        rate: float = 0.0,
+        adaptive: bool = False,
+        max_depth: int = 1000,
+        max_confirm: float = 1.0,
+        min_rate: float = 1.0,
+        max_rate: float = 1000.0,
+        step: float = 5.0,
+        interval: float = 1.0,
+    ):
+        self.adaptive = adaptive
+        self.max_depth = max_depth
+        self.max_confirm = max_confirm
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.interval = interval
+        self.rate = min(max(rate, min_rate), max_rate) if adaptive else rate
+
+        self.next_at = 0.0
+        self.sampled_at = time.monotonic()
+        self.started = 0
+        self.decreases = 0
+        self.increases = 0
+        PRODUCER_RATE_LIMIT.set(self.rate)
+
+    # Seconds until the next message may start
+    def delay(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        return max(0.0, self.next_at - time.monotonic())
+
+    # Claims the next slot if it is due
+    def take(self) -> bool:
+        if self.rate <= 0:
+            self.started += 1
+            return True
+        now = time.monotonic()
+        if now < self.next_at:
+            return False
+        self.next_at = max(self.next_at, now - 1.0 / self.rate) + 1.0 / self.rate
+        self.started += 1
+        return True
+
+    def due(self) -> bool:
+        return self.adaptive and time.monotonic() - self.sampled_at >= self.interval
+
+    # AIMD step from one sample; depth/latency are None when unknown
+    def update(self, depth: int | None, latency: float | None):
+        now = time.monotonic()
+        allowed = self.rate * (now - self.sampled_at)
+        kept_up = self.started >= KEEPING_UP * allowed
+        self.sampled_at = now
+        self.started = 0
+
+        if depth is not None:
+            QUEUE_DEPTH.set(depth)
+        over = (depth is not None and depth > self.max_depth) or (latency is not None and latency > self.max_confirm)
+        if over:
+            rate = max(self.min_rate, self.rate * BACKOFF)
+        elif kept_up:
+            rate = min(self.max_rate, self.rate + self.step)
+        else:
+            return
+        if rate == self.rate:
+            return
+        if over:
+            confirm_ms = latency * 1000 if latency is not None else 0.0
+            print(f"[producer] backpressure depth={depth} confirm_ms={confirm_ms:.0f}: rate {self.rate:.1f} -> {rate:.1f} msg/s")
+            self.decreases += 1
+        else:
+            self.increases += 1
+        self.rate = rate
+        PRODUCER_RATE_LIMIT.set(rate)
+
+    def summary(self) -> str:
+        mode = "adaptive" if self.adaptive else "fixed"
+        return f"rate={self.rate:.1f}msg/s ({mode}) decreases={self.decreases} increases={self.increases}"
@@ -0,0 +1,73 @@
+import time
+
+from common.metrics import RECIPIENTS_ACTIVE
+
+try:
+    import psycopg
+except ImportError:  # optional: only needed with a registry (DB_DSN)
+    psycopg = None
+
+# Producer-side snapshot of the recipient registry (the recipients table,
+# managed with `python -m coordinator.recipients`).
+#
+# The snapshot is loaded at start and reloaded every `refresh_interval`
+# seconds from poll(), never per message. Every pointer is published once;
+# the queues of all active recipients are bound to its routing key, and
+# recipients_total is the size of the snapshot those bindings were made
+# from. A failed reload keeps the previous snapshot, as does a reload that
+# finds no active recipient (pointers would be unroutable).
+
+SNAPSHOT_SQL = "SELECT recipient_id, queue, active FROM recipients ORDER BY recipient_id"
+
+
+class RecipientRegistry:
+    def __init__(self, dsn: str, refresh_interval: float = 30.0):
+        if psycopg is None:
+            raise RuntimeError("the recipient registry requires psycopg")
+        self.dsn = dsn
+        self.refresh_interval = refresh_interval
+        # {recipient_id: queue}
+        self.active = {}
+        self.inactive = {}
+        self.loaded_at = None
+
+    @property
+    def total(self) -> int:
+        return len(self.active)
+
+    def queues(self) -> list[str]:
+        return sorted(set(self.active.values()))
+
+    # Queues of deactivated recipients that no active recipient uses
+    def stale_queues(self) -> list[str]:
+        return sorted(set(self.inactive.values()) - set(self.active.values()))
+
+    def due(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_interval
+
+    # Returns True if the active set changed
+    def refresh(self) -> bool:
+        self.loaded_at = time.monotonic()
+        try:
+            with psycopg.connect(self.dsn, connect_timeout=5) as conn:
+                rows = conn.execute(SNAPSHOT_SQL).fetchall()
+        except Exception as e:
+            if not self.active:
+                raise
+            print(f"[producer] recipient registry refresh failed: {e!r} (keeping {self.total} recipients)")
+            return False
+
+        active = {recipient_id: queue for recipient_id, queue, is_active in rows if is_active}
+        inactive = {recipient_id: queue for recipient_id, queue, is_active in rows if not is_active}
+        if not active:
+            if not self.active:
+                raise RuntimeError("no active recipients in the registry")
+            print(f"[producer] recipient registry has no active recipients (keeping {self.total})")
+            return False
+
+        changed = active != self.active
+        self.active, self.inactive = active, inactive
+        RECIPIENTS_ACTIVE.set(self.total)
+        if changed:
+            print(f"[producer] recipients={self.total}: {', '.join(sorted(active))}")
+        return changed
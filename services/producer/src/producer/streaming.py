@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.codecs import get_codec
+from common.metrics import CODEC_SECONDS, SHA256_SECONDS
+
+# S3 rejects multipart parts below 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+# Streams raw chunks through an incremental compressor (gzip unless `codec`
+# says otherwise) and an
+# incremental sha256 (of the compressed bytes, as in the pointer) into an S3
+# multipart upload. Parts are uploaded by `concurrency` threads; a semaphore
+# blocks the producer side while that many parts are in flight, so memory
+# stays at about (concurrency + 1) x part_size regardless of object size.
+# Objects that fit in one part go through a single put_object instead.
+#
+# Returns (size_raw, size_gz, sha256 hex). On any failure the multipart upload
+# is aborted before the exception propagates.
+def stream_upload(
+    s3,
+    bucket: str,
+    key: str,
+    chunks,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = 4,
+    content_type: str = "application/json",
+    metadata: dict | None = None,
+    codec=None,
+):
+    part_size = max(part_size, MIN_PART_SIZE)
+    codec = codec or get_codec("gzip")
+    compressor = codec.compressobj()
+    digest = hashlib.sha256()
+    size_raw = 0
+    size_gz = 0
+    compress_s = 0.0
+    sha256_s = 0.0
+
+    buf = bytearray()
+    upload_id = None
+    parts = {}
+    futures = []
+    slots = threading.BoundedSemaphore(concurrency)
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def upload_part(number: int, body: bytes):
+        try:
+            resp = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+            parts[number] = resp["ETag"]
+        finally:
+            slots.release()
+
+    def submit_part(body: bytes):
+        nonlocal upload_id
+        if upload_id is None:
+            resp = s3.create_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                ContentType=content_type,
+                ContentEncoding=codec.name,
+                Metadata=metadata or {},
+            )
+            upload_id = resp["UploadId"]
+        # Fail fast if an earlier part already failed
+        for f in futures:
+            if f.done() and f.exception() is not None:
+                raise f.exception()
+        slots.acquire()
+        futures.append(pool.submit(upload_part, len(futures) + 1, body))
+
+    def feed(data: bytes):
+        nonlocal size_gz, sha256_s
+        if not data:
+            return
+        t0 = time.perf_counter()
+        digest.update(data)
+        sha256_s += time.perf_counter() - t0
+        size_gz += len(data)
+        buf.extend(data)
+        while len(buf) >= part_size:
+            submit_part(bytes(buf[:part_size]))
+            del buf[:part_size]
+
+    try:
+        for chunk in chunks:
+            size_raw += len(chunk)
+            t0 = time.perf_counter()
+            out = compressor.compress(chunk)
+            compress_s += time.perf_counter() - t0
+            feed(out)
+        feed(compressor.flush())
+
+        if upload_id is None:
+            s3.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=bytes(buf),
+                ContentType=content_type,
+                ContentEncoding=codec.name,
+                Metadata=metadata or {},
+            )
+        else:
+            if buf:
+                submit_part(bytes(buf))
+            buf.clear()
+            for f in futures:
+                f.result()
+            s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [{"ETag": parts[n], "PartNumber": n} for n in sorted(parts)]},
+            )
+    except BaseException:
+        for f in futures:
+            f.cancel()
+        pool.shutdown(wait=True)
+        if upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                print(f"[producer] abort multipart upload failed {bucket}/{key}: {e!r}")
+        raise
+    pool.shutdown(wait=True)
+
+    CODEC_SECONDS.labels(op="compress", encoding=codec.name).observe(compress_s)
+    SHA256_SECONDS.observe(sha256_s)
+    return size_raw, size_gz, digest.hexdigest()
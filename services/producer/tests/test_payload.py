@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from producer.payload import ITEM_SIZE, build_payload_fast, generate_payload
+
+
+def overhead() -> int:
+    # header + footer of an empty `data` array; the timestamp drops its
+    # microseconds when they are zero, so measure rather than hard-code
+    return max(len(build_payload_fast(0, 7)[1]) for _ in range(3))
+
+
+@pytest.mark.parametrize("extra", [0, 1, 2, 3, 4, 5, ITEM_SIZE, ITEM_SIZE + 1, ITEM_SIZE + 2, ITEM_SIZE + 3,
+                                   ITEM_SIZE + 4, ITEM_SIZE + 5, ITEM_SIZE + 6, 2 * ITEM_SIZE + 7,
+                                   2 * ITEM_SIZE + 8, 2 * ITEM_SIZE + 9, 10 * (ITEM_SIZE + 4) + 1])
+def test_size_is_exact_from_the_header_up(extra):
+    base = overhead()
+    pointer_id, body = build_payload_fast(base + extra, 7)
+    if len(body) != base + extra:
+        # the timestamp lost its microseconds during this call
+        pointer_id, body = build_payload_fast(base + extra, 7)
+    assert len(body) == base + extra
+    doc = json.loads(body)
+    assert doc["id"] == pointer_id and doc["idx"] == 7
+    assert all(len(item) <= 2 * ITEM_SIZE for item in doc["data"])
+
+
+@pytest.mark.parametrize("target", [4096, 65536, 3 * 1024 * 1024 + 17])
+def test_chunked_output_matches_target(target):
+    _, chunks = generate_payload(target, 1, chunk_size=64 * 1024)
+    body = b"".join(chunks)
+    assert len(body) == target
+    assert json.loads(body)["schema"] == "demo-1c-object-v1"
@@ -0,0 +1,98 @@
+import pytest
+
+from producer import ratecontrol
+from producer.ratecontrol import RateController
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratecontrol.time, "monotonic", clock)
+    return clock
+
+
+def test_unlimited_never_waits(clock):
+    rate = RateController(0)
+    assert all(rate.take() for _ in range(1000))
+    assert rate.delay() == 0
+
+
+def test_fixed_rate_spacing(clock):
+    rate = RateController(10)
+    # the first slot plus one slot of credit
+    assert rate.take() and rate.take()
+    assert not rate.take()
+    assert rate.delay() == pytest.approx(0.1)
+    clock.now += 0.1
+    assert rate.take()
+    assert not rate.take()
+
+
+def test_missed_slots_are_not_made_up(clock):
+    rate = RateController(10)
+    rate.take()
+    clock.now += 5
+    # one slot of credit at most
+    assert rate.take() and rate.take()
+    assert not rate.take()
+
+
+def adaptive(clock, **kw):
+    kw.setdefault("interval", 1.0)
+    return RateController(100, adaptive=True, max_depth=10, max_confirm=0.5, min_rate=5, max_rate=120, step=10, **kw)
+
+
+def run_interval(clock, rate, started):
+    clock.now += rate.interval
+    rate.started = started
+
+
+def test_additive_increase_up_to_max(clock):
+    rate = adaptive(clock)
+    run_interval(clock, rate, 100)
+    rate.update(0, 0.01)
+    assert rate.rate == 110
+    run_interval(clock, rate, 110)
+    rate.update(0, 0.01)
+    assert rate.rate == 120
+    run_interval(clock, rate, 120)
+    rate.update(None, None)
+    assert rate.rate == 120
+
+
+def test_multiplicative_decrease_down_to_min(clock):
+    rate = adaptive(clock)
+    run_interval(clock, rate, 100)
+    rate.update(11, None)
+    assert rate.rate == 50
+    run_interval(clock, rate, 50)
+    rate.update(0, 0.6)
+    assert rate.rate == 25
+    for _ in range(5):
+        run_interval(clock, rate, 0)
+        rate.update(100, None)
+    assert rate.rate == 5
+    assert rate.decreases == 5
+
+
+def test_no_increase_when_not_keeping_up(clock):
+    rate = adaptive(clock)
+    run_interval(clock, rate, 50)
+    rate.update(0, 0.0)
+    assert rate.rate == 100
+
+
+def test_due_only_in_adaptive_mode(clock):
+    assert not RateController(10).due()
+    rate = adaptive(clock)
+    assert not rate.due()
+    clock.now += 1.0
+    assert rate.due()